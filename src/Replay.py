@@ -0,0 +1,57 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from mesa.visualization.modules import CanvasGrid, ChartModule, TextElement
+from mesa.visualization.ModularVisualization import ModularServer
+from src.environment.MesaAdapter import RasterGrid, agent_portrayal, mesa_view
+from src.environment.Recording import ReplayModel, RunReplay
+
+CANVAS_CELL_SIZE = 10
+MAX_CANVAS_WIDTH = 1000
+chart_height = 150
+chart_width = 450
+
+class CurrentConfig(TextElement):
+    def render(self, model):
+        return (f"Day {model.current_day}, step {model.current_step_in_day} - Configs: "
+                f"CleaningLVL={model.initial_cleaning}, Split={model.splitting_level}, TestLVL={model.test_lvl}, "
+                f"SocialDistance={model.social_distancing}, Masking={model.mask_mandate}, "
+                f"Shifts/day={model.shifts_per_day}")
+
+
+def build_replay_server(path, port=8513, start_frame=0, raster=False):
+    """Visualization server playing back a recording made with factory_model.enable_recording. With raster
+    the floor is drawn as one image per frame, for recordings of large floors."""
+    replay = RunReplay(path)
+    canvas_width = min(replay.width * CANVAS_CELL_SIZE, MAX_CANVAS_WIDTH)
+    canvas_height = canvas_width * replay.height // replay.width
+    if raster:
+        grid = RasterGrid(replay.width, replay.height, canvas_width, canvas_height)
+    else:
+        grid = CanvasGrid(agent_portrayal, replay.width, replay.height, canvas_width, canvas_height)
+    chart = ChartModule(
+        [
+            {"Label": "Healthy", "Color": "Green"},
+            {"Label": "Infected", "Color": "Red"},
+            {"Label": "Recovered", "Color": "Blue"},
+            {"Label": "Death", "Color": "Black"},
+            {"Label": "Quarantined", "Color": "Brown"}
+        ], canvas_height=chart_height, canvas_width=chart_width
+    )
+    prod_chart = ChartModule([{"Label": "Productivity", "Color": "Purple"}],
+                             canvas_height=chart_height, canvas_width=chart_width)
+    daily_infections_chart = ChartModule([{"Label": "Daily Infections", "Color": "Red"}],
+                                         canvas_height=chart_height, canvas_width=chart_width)
+    server = ModularServer(
+        mesa_view(ReplayModel),
+        [grid, CurrentConfig(), chart, prod_chart, daily_infections_chart],
+        f"Factory Infection Model Replay ({os.path.basename(os.path.normpath(path))})",
+        {"path": path, "start_frame": start_frame}
+    )
+    server.port = port
+    return server
+
+
+if __name__ == "__main__":
+    build_replay_server(sys.argv[1]).launch()
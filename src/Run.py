@@ -1,43 +1,21 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
 from mesa.visualization.modules import CanvasGrid, ChartModule, TextElement
 from mesa.visualization.ModularVisualization import ModularServer
-from environment.FactoryModel import factory_model
-from environment.FactoryConfig import FactoryConfig
-from src.model.dqn_agent import DQNAgent
+from src.environment.FactoryModel import factory_model
+from src.environment.FactoryConfig import FactoryConfig, build_action_space
+from src.environment.MesaAdapter import RasterGrid, agent_portrayal, mesa_view
+from src.model.ensemble_dqn_agent import load_agent
 import torch
 import numpy as np
-import itertools
-
-cleaning_options = ['light', 'medium', 'heavy']
-splitting_options = [0, 1, 2, 3]  # none, half, quarter, eighth
-testing_options = ['none', 'light', 'medium', 'heavy']
-social_distancing_options = [False, True]
-mask_mandate_options = [False, True]
-shifts_options = [1, 2, 3, 4]  # maps to 1, 2, 3, or 4 shifts per day
 
 class CurrentConfig(TextElement):
     def render(self, model):
         return f"Configs: CleaningLVL={model.initial_cleaning}, Split={model.splitting_level}, TestLVL={model.test_lvl}, SocialDistance={model.social_distancing}, Masking={model.mask_mandate}, Shifts/day={model.shifts_per_day}"
 
-    
-#ACTION DICTIONARY
-actions = [
-    {
-        'cleaning_type': cleaning,
-        'splitting_level': splitting,
-        'testing_level': testing,
-        'social_distancing': social_distancing,
-        'mask_mandate': mask_mandate,
-        'shifts_per_day': shifts
-    }
-    for cleaning, splitting, testing, social_distancing, mask_mandate, shifts in itertools.product(
-        cleaning_options,
-        splitting_options,
-        testing_options,
-        social_distancing_options,
-        mask_mandate_options,
-        shifts_options
-    )
-]
+
 config_chart = ChartModule([
     {"Label": "Cleaning Level", "Color": "Brown"},
     {"Label": "Splitting Level", "Color": "Purple"},
@@ -46,28 +24,6 @@ config_chart = ChartModule([
     {"Label": "Mask Mandate", "Color": "Blue"}
 ], data_collector_name='datacollector')
 
-def agent_portrayal(agent):
-    """Defines how agents appear in the visualization."""
-    portrayal = {"Shape": "circle", "Filled": "true", "r": 0.5}
-
-    if agent.is_quarantined:
-        portrayal["Color"] = "brown"
-        portrayal["Layer"] = 5  
-    elif agent.health_status == "healthy":
-        portrayal["Color"] = "green"
-        portrayal["Layer"] = 1
-    elif agent.health_status == "infected":
-        portrayal["Color"] = "red"
-        portrayal["Layer"] = 2
-    elif agent.health_status == "recovered":
-        portrayal["Color"] = "blue"
-        portrayal["Layer"] = 3
-    elif agent.health_status == "death":
-        portrayal["Color"] = "black"
-        portrayal["Layer"] = 4
-
-    return portrayal
-
 GRID_WIDTH = 50
 GRID_HEIGHT = 25
 CANVAS_WIDTH = 500
@@ -112,11 +68,6 @@ viz_config = FactoryConfig(
 )
 
 
-state_dim = 8
-action_dim = len(actions)
-agent = DQNAgent(state_dim, action_dim)
-agent.load_model("dqn_factory_model.pth")  # TRAINING.PY WEIGHTS
-
 def factory_model_with_dqn(N, config, width, height, dqn_agent, action_space):
     """Creates and returns a factory model that uses the trained DQN for decision making"""
     model = factory_model(
@@ -205,19 +156,28 @@ def factory_model_with_dqn(N, config, width, height, dqn_agent, action_space):
     return model
 
 
-server = ModularServer(
-    factory_model_with_dqn,
-    [grid, current_config, chart, prod_chart, daily_infections_chart],
-    "Factory Infection Model with DQN",
-    {
-        "N": 100, 
-        "config": viz_config, 
-        "width": GRID_WIDTH, 
-        "height": GRID_HEIGHT,
-        "dqn_agent": agent,
-        "action_space": actions
-    }
-)
+def build_server(model_path="dqn_factory_model.pth", port=8511, raster=False):
+    """Visualization server driven by the trained DQN in model_path (Train.py weights). With raster the floor
+    is drawn as one heatmap image per frame instead of one circle per agent."""
+    actions = build_action_space()
+    agent = load_agent(model_path, 8, len(actions))
+    floor = RasterGrid(GRID_WIDTH, GRID_HEIGHT, CANVAS_WIDTH, CANVAS_HEIGHT) if raster else grid
+    server = ModularServer(
+        mesa_view(factory_model_with_dqn),
+        [floor, current_config, chart, prod_chart, daily_infections_chart],
+        "Factory Infection Model with DQN",
+        {
+            "N": 100, 
+            "config": viz_config, 
+            "width": GRID_WIDTH, 
+            "height": GRID_HEIGHT,
+            "dqn_agent": agent,
+            "action_space": actions
+        }
+    )
+    server.port = port
+    return server
+
 
-server.port = 8511
-server.launch()
+if __name__ == "__main__":
+    build_server().launch()
@@ -0,0 +1,537 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import random
+import signal
+import threading
+import time
+import urllib.request
+import numpy as np
+import tornado.iostream
+import tornado.web
+
+MAX_DAYS = 365
+MAX_AGENTS = 100000
+MAX_CELLS = 4000000
+
+
+class ServiceBusy(Exception):
+    """The request queue is full, the client should retry later"""
+
+
+def is_whole(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def check_config(config):
+    """Raises ValueError for config values a model cannot run with, FactoryConfig itself only checks names"""
+    from src.environment.FactoryConfig import (CLEANING_OPTIONS, SHIFTS_OPTIONS, SPLITTING_OPTIONS,
+                                               TESTING_OPTIONS)
+    for name in ("width", "height", "num_agents", "steps_per_day"):
+        if not is_whole(config[name]) or config[name] < 1:
+            raise ValueError(f"config {name} must be a positive integer, not {config[name]!r}")
+    if config["width"] * config["height"] > MAX_CELLS:
+        raise ValueError(f"The floor can have at most {MAX_CELLS} cells")
+    if config["num_agents"] > min(MAX_AGENTS, config["width"] * config["height"]):
+        raise ValueError(f"num_agents must fit on the floor and be at most {MAX_AGENTS}")
+    levers = {"cleaning_type": CLEANING_OPTIONS, "splitting_level": SPLITTING_OPTIONS,
+              "testing_level": TESTING_OPTIONS, "shifts_per_day": SHIFTS_OPTIONS,
+              "social_distancing": [False, True], "mask_mandate": [False, True, 0, 1, 2, 3]}
+    for name, options in levers.items():
+        if name in config and not any(config[name] == option and type(config[name]) is type(option)
+                                      for option in options):
+            raise ValueError(f"config {name} must be one of {options}, not {config[name]!r}")
+    if config["steps_per_day"] < config.get("shifts_per_day", 1):
+        raise ValueError("config steps_per_day must be at least shifts_per_day")
+
+
+def check_action(action, action_space):
+    """Raises ValueError unless every key of an action dictionary is a policy lever and every value one of
+    that lever's options in the action space"""
+    options = {}
+    for candidate in action_space:
+        for name, value in candidate.items():
+            options.setdefault(name, [])
+            if value not in options[name]:
+                options[name].append(value)
+    unknown = set(action) - set(options)
+    if unknown:
+        raise ValueError(f"Unknown action keys {sorted(unknown)}, expected some of {sorted(options)}")
+    for name, value in action.items():
+        if not any(value == option and type(value) is type(option) for option in options[name]):
+            raise ValueError(f"Action {name} must be one of {options[name]}, not {value!r}")
+
+
+def parse_scenario(body):
+    """Validates a scenario request and fills in the defaults. A scenario is a FactoryConfig `config`, an
+    `engine`, a `seed` (drawn by the service when missing), a number of `days` and optionally a policy: one
+    `action` (a dictionary or an index into the action space) held every day, or a `schedule` of daily
+    actions like SchedulePolicy. Raises ValueError for invalid requests."""
+    from src.cli import ENGINES
+    from src.environment.FactoryConfig import FactoryConfig, build_action_space
+    from src.evaluation.Episode import DEFAULT_CONFIG
+
+    if not isinstance(body, dict):
+        raise ValueError("A scenario must be a JSON object")
+    unknown = set(body) - {"config", "engine", "seed", "days", "action", "schedule"}
+    if unknown:
+        raise ValueError(f"Unknown scenario fields {sorted(unknown)}")
+    if not isinstance(body.get("config", {}), dict):
+        raise ValueError("config must be a JSON object")
+    config = {**DEFAULT_CONFIG, **body.get("config", {})}
+    try:
+        defaults = vars(FactoryConfig(**{**config, "visualization": False}))
+    except TypeError as error:
+        raise ValueError(f"Invalid config: {error}")
+    check_config({**defaults, **config})
+    engines = tuple(engine for engine in ENGINES if engine != "distributed") #workers cannot start stripe processes
+    engine = body.get("engine", "python")
+    if engine not in engines:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {engines}")
+    days = body.get("days", 10)
+    if not isinstance(days, int) or not 1 <= days <= MAX_DAYS:
+        raise ValueError(f"days must be an integer from 1 to {MAX_DAYS}")
+    seed = body.get("seed")
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    if not isinstance(seed, int):
+        raise ValueError("seed must be an integer")
+    if "action" in body and "schedule" in body:
+        raise ValueError("Give either an action or a schedule, not both")
+
+    action_space = build_action_space()
+    def resolve(action):
+        if action is None:
+            return action
+        if isinstance(action, dict):
+            check_action(action, action_space)
+            return action
+        if isinstance(action, int) and 0 <= action < len(action_space):
+            return action_space[action]
+        raise ValueError(f"Actions are dictionaries or indices below {len(action_space)}, not {action!r}")
+    schedule = None
+    if "action" in body:
+        schedule = [resolve(body["action"])]
+    elif "schedule" in body:
+        if not isinstance(body["schedule"], list) or not body["schedule"]:
+            raise ValueError("schedule must be a non empty list of daily actions")
+        schedule = [resolve(action) for action in body["schedule"]]
+    return {"config": config, "engine": engine, "seed": seed, "days": days, "schedule": schedule}
+
+
+def scenario_key(scenario):
+    """Identical scenarios share one run"""
+    return json.dumps(scenario, sort_keys=True)
+
+
+def batch_key(scenario):
+    """Scenarios with the same engine, floor and length are batched into one multi-environment run, so the
+    environments of a batch finish their days at about the same time"""
+    config = scenario["config"]
+    return (scenario["engine"], config["width"], config["height"], config["num_agents"], scenario["days"])
+
+
+def run_scenarios(scenarios, emit, params=None):
+    """Steps the environments of a batch in lockstep, one day of every environment at a time, and emits
+    every finished day. A failing environment only fails its own scenario. params is the fitted parameter
+    file of the compartmental engine."""
+    from src.cli import build_engine
+    from src.environment.FactoryConfig import FactoryConfig
+    from src.evaluation.Episode import DAILY_METRICS, SchedulePolicy, iter_episode, silenced, summarize_episode
+
+    with silenced():
+        episodes = []
+        for job_id, scenario in scenarios:
+            try:
+                config = FactoryConfig(**{**scenario["config"], "visualization": False})
+                model = build_engine(scenario["engine"], config, scenario["seed"], params=params)
+                policy = SchedulePolicy(scenario["schedule"]) if scenario["schedule"] else None
+                episodes.append((job_id, iter_episode(policy, num_days=scenario["days"], model=model), []))
+            except Exception as error:
+                emit(job_id, "error", {"error": f"{type(error).__name__}: {error}"})
+        while episodes:
+            running = []
+            for job_id, days, rows in episodes:
+                try:
+                    row = next(days, None)
+                except Exception as error:
+                    emit(job_id, "error", {"error": f"{type(error).__name__}: {error}"})
+                    continue
+                if row is None:
+                    daily = np.array(rows)
+                    emit(job_id, "done", {"summary": summarize_episode(
+                        {name: daily[:, i] for i, name in enumerate(DAILY_METRICS)})})
+                    continue
+                emit(job_id, "day", {"day": len(rows), **dict(zip(DAILY_METRICS, map(float, row)))})
+                rows.append(row)
+                running.append((job_id, days, rows))
+            episodes = running
+
+
+def warm_up(engines, params=None):
+    """Imports the engines and runs a day of a small floor on each, so the first request a worker serves
+    does not pay for imports, kernel compilation or first allocations"""
+    from src.cli import build_engine
+    from src.environment.FactoryConfig import FactoryConfig
+    from src.evaluation.Episode import iter_episode, silenced
+
+    config = FactoryConfig(width=20, height=10, num_agents=20, visualization=False)
+    with silenced():
+        for engine in engines:
+            list(iter_episode(num_days=1, model=build_engine(engine, config, seed=0, params=params)))
+
+
+def worker_loop(tasks, results, engines, params=None):
+    """Worker process. Warms up once, then runs batches from the shared task queue until it gets None."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) #the service shuts workers down itself
+    warm_up(engines, params)
+    results.put((None, "ready", os.getpid()))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_id, scenarios = task
+        results.put((None, "started", (batch_id, os.getpid())))
+        run_scenarios(scenarios, lambda job_id, kind, payload: results.put((job_id, kind, payload)), params)
+        results.put((None, "finished", batch_id))
+
+
+class Job:
+    """One distinct scenario and the streams of every request waiting for it. Messages are kept so a request
+    coalesced into a job that already started gets the days it missed."""
+    def __init__(self, job_id, scenario):
+        self.job_id = job_id
+        self.scenario = scenario
+        self.key = scenario_key(scenario)
+        self.subscribers = []
+        self.history = []
+        self.submitted = time.perf_counter()
+        self.first_day = None
+
+    def subscribe(self):
+        subscription = asyncio.Queue()
+        for message in self.history:
+            subscription.put_nowait(message)
+        self.subscribers.append(subscription)
+        return subscription
+
+    def publish(self, message):
+        self.history.append(message)
+        for subscription in self.subscribers:
+            subscription.put_nowait(message)
+
+
+class SimulationService:
+    """Runs scenario requests on a pool of pre-warmed worker processes.
+
+    Identical requests are coalesced into one job. When there are more queued jobs than idle workers, jobs
+    with the same batch_key are sent to a worker together as one multi-environment batch (at most
+    ceil(queued / idle workers) each, so no worker idles while another steps several environments), waiting
+    at most batch_window seconds for company. Batches are only dispatched to idle workers, so queued jobs can still be batched and dropped when every requester
+    disconnected. Once max_queue jobs are waiting, new requests are refused (ServiceBusy) instead of
+    growing the queue without bound. A worker that dies is replaced and the jobs of its batch fail."""
+    def __init__(self, workers=None, max_queue=256, max_batch=8, batch_window=0.02, engines=("python",),
+                 params=None):
+        self.workers = workers or os.cpu_count()
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.engines = tuple(engines)
+        self.params = params
+        self.context = multiprocessing.get_context("spawn")
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.processes = []
+        self.jobs = {} #key -> job, queued or running
+        self.jobs_by_id = {}
+        self.pending = collections.deque()
+        self.batches = {} #batch id -> job ids
+        self.batch_workers = {} #batch id -> pid
+        self.next_id = 0
+        self.ready = 0
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=1000)
+        self.first_day_latencies = collections.deque(maxlen=1000)
+        self.batch_sizes = collections.deque(maxlen=1000)
+        self.loop = None
+        self.wakeup = None
+        self.reader = None
+
+    def start_worker(self):
+        process = self.context.Process(target=worker_loop,
+                                       args=(self.tasks, self.results, self.engines, self.params), daemon=True)
+        process.start()
+        self.processes.append(process)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        for _ in range(self.workers):
+            self.start_worker()
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+        self.dispatcher = asyncio.ensure_future(self.dispatch())
+
+    def read_results(self):
+        """Forwards worker messages to the event loop"""
+        while True:
+            message = self.results.get()
+            if message is None:
+                break
+            try:
+                self.loop.call_soon_threadsafe(self.on_result, message)
+            except RuntimeError:
+                break #the event loop has shut down
+
+    def submit(self, scenario):
+        """Subscribes to the job of a parsed scenario, creating and queueing it unless an identical one is
+        already queued or running. Returns an asyncio.Queue of messages that ends with done or error."""
+        self.counters["requests"] += 1
+        key = scenario_key(scenario)
+        job = self.jobs.get(key)
+        if job is not None:
+            self.counters["coalesced"] += 1
+            return job.subscribe()
+        if len(self.pending) >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise ServiceBusy()
+        job = Job(self.next_id, scenario)
+        self.next_id += 1
+        self.jobs[key] = self.jobs_by_id[job.job_id] = job
+        self.pending.append(job)
+        self.wakeup.set()
+        return job.subscribe()
+
+    def unsubscribe(self, subscription):
+        """Called when a requester goes away. A queued job nobody waits for any more is dropped."""
+        for job in list(self.jobs.values()):
+            if subscription in job.subscribers:
+                job.subscribers.remove(subscription)
+                if not job.subscribers and job in self.pending:
+                    self.pending.remove(job)
+                    self.forget(job)
+                    self.counters["abandoned"] += 1
+
+    def forget(self, job):
+        self.jobs.pop(job.key, None)
+        self.jobs_by_id.pop(job.job_id, None)
+
+    def take_batch(self, limit):
+        """The oldest queued job and up to limit - 1 later jobs it can be batched with"""
+        first = self.pending.popleft()
+        batch = [first]
+        for job in list(self.pending):
+            if len(batch) >= limit:
+                break
+            if batch_key(job.scenario) == batch_key(first.scenario):
+                self.pending.remove(job)
+                batch.append(job)
+        return batch
+
+    async def dispatch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            self.replace_dead_workers()
+            while self.pending and len(self.batches) < len(self.processes):
+                wait = self.pending[0].submitted + self.batch_window - time.perf_counter()
+                if wait > 0 and len(self.pending) < self.max_batch:
+                    await asyncio.sleep(wait) #give compatible requests a moment to arrive
+                    continue
+                #a batch runs its environments one after another on one core, so spread the queue over every
+                #idle worker first and only batch what is left over
+                idle = len(self.processes) - len(self.batches)
+                batch = self.take_batch(min(self.max_batch, -(-len(self.pending) // idle)))
+                batch_id = self.next_id
+                self.next_id += 1
+                self.batches[batch_id] = [job.job_id for job in batch]
+                self.batch_sizes.append(len(batch))
+                self.counters["batches"] += 1
+                self.tasks.put((batch_id, [(job.job_id, job.scenario) for job in batch]))
+
+    def replace_dead_workers(self):
+        for process in [process for process in self.processes if not process.is_alive()]:
+            self.processes.remove(process)
+            self.counters["worker_restarts"] += 1
+            for batch_id, pid in list(self.batch_workers.items()):
+                if pid == process.pid:
+                    for job_id in self.batches.pop(batch_id, []):
+                        if job_id in self.jobs_by_id:
+                            self.on_result((job_id, "error", {"error": "worker process died"}))
+                    del self.batch_workers[batch_id]
+            self.start_worker()
+
+    def on_result(self, message):
+        job_id, kind, payload = message
+        if job_id is None:
+            if kind == "ready":
+                self.ready += 1
+            elif kind == "started":
+                self.batch_workers[payload[0]] = payload[1]
+            elif kind == "finished":
+                self.batches.pop(payload, None)
+                self.batch_workers.pop(payload, None)
+                self.wakeup.set()
+            return
+        job = self.jobs_by_id.get(job_id)
+        if job is None:
+            return
+        now = time.perf_counter()
+        if kind == "day" and job.first_day is None:
+            job.first_day = now
+            self.first_day_latencies.append(now - job.submitted)
+        job.publish({"type": kind, **payload})
+        if kind in ("done", "error"):
+            self.counters["completed" if kind == "done" else "failed"] += 1
+            self.latencies.append(now - job.submitted)
+            self.forget(job)
+
+    def metrics(self):
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p95 = np.percentile(list(values), [50, 95])
+            return {"p50": float(p50), "p95": float(p95)}
+        return {
+            "queue_depth": len(self.pending),
+            "max_queue": self.max_queue,
+            "running_batches": len(self.batches),
+            "running_jobs": sum(len(job_ids) for job_ids in self.batches.values()),
+            "workers": len(self.processes),
+            "workers_ready": self.ready,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+            "latency_seconds": percentiles(self.latencies),
+            "first_day_seconds": percentiles(self.first_day_latencies),
+            **{name: self.counters[name] for name in ("requests", "coalesced", "rejected", "abandoned",
+                                                      "batches", "completed", "failed", "worker_restarts")},
+        }
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if self.reader is not None:
+            self.results.put(None)
+            self.reader.join(timeout=5)
+
+
+class SimulateHandler(tornado.web.RequestHandler):
+    """POST a scenario, get newline delimited JSON back: accepted (with the seed), one day message per
+    simulated day as it finishes, then done with the episode summary, or error"""
+    def initialize(self, service):
+        self.service = service
+        self.subscription = None
+
+    async def post(self):
+        try:
+            scenario = parse_scenario(json.loads(self.request.body or b"{}"))
+        except ValueError as error:
+            self.set_status(400)
+            self.finish({"error": str(error)})
+            return
+        try:
+            self.subscription = self.service.submit(scenario)
+        except ServiceBusy:
+            self.set_status(503)
+            self.set_header("Retry-After", "1")
+            self.finish({"error": "queue full", "queue_depth": len(self.service.pending)})
+            return
+        self.set_header("Content-Type", "application/x-ndjson")
+        message = {"type": "accepted", "seed": scenario["seed"], "queue_depth": len(self.service.pending)}
+        while message is not None:
+            self.write(json.dumps(message) + "\n")
+            try:
+                await self.flush()
+            except tornado.iostream.StreamClosedError:
+                break
+            if message["type"] in ("done", "error"):
+                break
+            message = await self.subscription.get()
+        self.service.unsubscribe(self.subscription)
+        if message is not None:
+            self.finish()
+
+    def on_connection_close(self):
+        if self.subscription is not None:
+            self.subscription.put_nowait(None)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def get(self):
+        self.write(self.service.metrics())
+
+
+async def serve(service, port, host="127.0.0.1"):
+    service.start()
+    app = tornado.web.Application([
+        (r"/simulate", SimulateHandler, {"service": service}),
+        (r"/metrics", MetricsHandler, {"service": service}),
+    ])
+    app.listen(port, address=host)
+    print(f"Simulation service at http://{host}:{port} with {service.workers} workers")
+    await asyncio.Event().wait()
+
+
+def query(scenario, url="http://127.0.0.1:8515"):
+    """Client side: yields the messages the service streams back for one scenario"""
+    request = urllib.request.Request(f"{url}/simulate", data=json.dumps(scenario).encode(),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            yield json.loads(line)
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve on demand simulations over HTTP")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sv = commands.add_parser("serve", help="start the service")
+    sv.add_argument("--port", type=int, default=8515)
+    sv.add_argument("--host", default="127.0.0.1")
+    sv.add_argument("--workers", type=int, default=None)
+    sv.add_argument("--max-queue", type=int, default=256, help="queued scenarios before requests are refused")
+    sv.add_argument("--max-batch", type=int, default=8, help="environments per worker batch")
+    sv.add_argument("--batch-window-ms", type=float, default=20, help="wait for compatible requests to batch")
+    sv.add_argument("--engines", nargs="+", default=["python"], help="engines to warm the workers up with")
+    sv.add_argument("--params", default=None, help="fitted parameters of the compartmental engine (SurrogateFit)")
+    qu = commands.add_parser("query", help="send one scenario to a running service and print the stream")
+    qu.add_argument("scenario", help="scenario as JSON, for example '{\"days\": 10, \"action\": 5}'")
+    qu.add_argument("--url", default="http://127.0.0.1:8515")
+    args = parser.parse_args(argv)
+
+    if args.command == "query":
+        for message in query(json.loads(args.scenario), args.url):
+            print(json.dumps(message))
+        return
+    service = SimulationService(args.workers, args.max_queue, args.max_batch, args.batch_window_ms / 1000,
+                                args.engines, args.params)
+    signal.signal(signal.SIGTERM, interrupt)
+    try:
+        asyncio.run(serve(service, args.port, args.host))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        print(f"Served {service.counters['requests']} requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import signal
+import struct
+import time
+import numpy as np
+import tornado.web
+import tornado.websocket
+from src.environment.FrameBuffer import CHART_SERIES, FrameRing, cell_raster, chart_values
+
+#Binary frame messages: kind, step, count. A keyframe is followed by count cell codes (the whole floor), a
+#delta by count uint32 cell indices and then count cell codes.
+HEADER = struct.Struct("<BxxxII")
+KEYFRAME, DELTA = 0, 1
+CELL_COLORS = ["#ffffff", "#2e8b57", "#d62728", "#1f77b4", "#000000"] #empty, healthy, infected, recovered, death
+SERIES_COLORS = ["Green", "Red", "Blue", "Black", "Brown", "Purple"]
+
+
+def run_simulation(ring_name, width, height, slots, engine, num_agents, seed, steps, max_steps_per_second,
+                   stop):
+    """Simulation process. Steps the model as fast as it can (or at max_steps_per_second) and publishes
+    every step to the frame ring, never waiting for the server."""
+    from src.cli import build_engine
+    from src.environment.FactoryConfig import FactoryConfig
+    from src.evaluation.Episode import silenced
+
+    ring = FrameRing.attach(ring_name, width, height, slots)
+    config = FactoryConfig(width=width, height=height, num_agents=num_agents, visualization=False)
+    with silenced():
+        model = build_engine(engine, config, seed)
+        step = 0
+        cell_raster(model, ring.next_cells())
+        ring.publish(step, [0.0] * len(CHART_SERIES))
+        interval = 1.0 / max_steps_per_second if max_steps_per_second else 0.0
+        next_step = time.perf_counter()
+        while not stop.is_set() and (steps is None or step < steps):
+            results = model.step()
+            step += 1
+            cell_raster(model, ring.next_cells())
+            ring.publish(step, chart_values(model, results))
+            if interval:
+                next_step += interval
+                time.sleep(max(0.0, next_step - time.perf_counter()))
+    ring.close()
+
+
+class FrameSocket(tornado.websocket.WebSocketHandler):
+    """One browser. Sends are fire and forget: while the previous frame is still being written to a slow
+    client it is skipped, and it gets a keyframe once it has caught up."""
+    def initialize(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.pending = None
+        self.needs_keyframe = True
+
+    def open(self):
+        self.write_message(json.dumps(self.broadcaster.describe()))
+        self.broadcaster.clients.add(self)
+
+    def on_close(self):
+        self.broadcaster.clients.discard(self)
+
+    def busy(self):
+        return self.pending is not None and not self.pending.done()
+
+    def send(self, message, binary):
+        try:
+            self.pending = self.write_message(message, binary=binary)
+        except tornado.websocket.WebSocketClosedError:
+            self.broadcaster.clients.discard(self)
+
+
+class PageHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(PAGE)
+
+
+class Broadcaster:
+    """Reads the newest frame from the ring at most fps times a second and sends each client the cells that
+    changed since the last frame sent, plus that frame's chart point"""
+    def __init__(self, ring, fps=10):
+        self.ring = ring
+        self.fps = fps
+        self.clients = set()
+        self.cells = np.zeros((ring.height, ring.width), dtype=np.uint8)
+        self.sent_cells = self.cells.copy()
+        self.last_seq = -1
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    def describe(self):
+        return {"type": "meta", "width": self.ring.width, "height": self.ring.height, "fps": self.fps,
+                "cell_colors": CELL_COLORS, "series": list(CHART_SERIES), "series_colors": SERIES_COLORS}
+
+    def tick(self):
+        frame = self.ring.latest(self.cells)
+        if frame is None or frame[0] == self.last_seq:
+            return
+        seq, step, charts = frame
+        if self.last_seq >= 0:
+            self.frames_dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.frames_read += 1
+
+        flat = self.cells.ravel()
+        changed = np.flatnonzero(flat != self.sent_cells.ravel()).astype(np.uint32)
+        delta = HEADER.pack(DELTA, step, len(changed)) + changed.tobytes() + flat[changed].tobytes()
+        keyframe = None
+        chart = json.dumps({"type": "chart", "step": step, "values": charts})
+        for client in list(self.clients):
+            if client.busy():
+                client.needs_keyframe = True #drop this frame for a client that is behind
+                continue
+            if client.needs_keyframe:
+                if keyframe is None:
+                    keyframe = HEADER.pack(KEYFRAME, step, flat.size) + flat.tobytes()
+                client.send(keyframe, binary=True)
+                client.needs_keyframe = False
+            else:
+                client.send(delta, binary=True)
+            client.send(chart, binary=False)
+        self.sent_cells[:] = self.cells
+
+    async def run(self):
+        interval = 1.0 / self.fps
+        while True:
+            started = time.perf_counter()
+            self.tick()
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+async def serve(broadcaster, port):
+    app = tornado.web.Application([
+        (r"/", PageHandler),
+        (r"/ws", FrameSocket, {"broadcaster": broadcaster}),
+    ])
+    app.listen(port)
+    print(f"Streaming visualization at http://127.0.0.1:{port}")
+    await broadcaster.run()
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def stream(engine="numpy", num_agents=10000, width=200, height=100, seed=None, steps=None, fps=10, port=8514,
+           max_steps_per_second=None, slots=8):
+    """Runs the simulation in its own process and streams it to browsers until interrupted"""
+    ring = FrameRing(width, height, slots)
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    process = context.Process(target=run_simulation, daemon=True,
+                              args=(ring.name, width, height, slots, engine, num_agents, seed, steps,
+                                    max_steps_per_second, stop))
+    process.start()
+    broadcaster = Broadcaster(ring, fps)
+    signal.signal(signal.SIGTERM, interrupt) #clean up the shared memory when stopped by a service manager
+    try:
+        asyncio.run(serve(broadcaster, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        stop.set()
+        process.join(timeout=5)
+        print(f"Sent {broadcaster.frames_read} frames, dropped {broadcaster.frames_dropped}")
+        ring.close()
+        ring.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a running simulation to the browser")
+    parser.add_argument("--engine", choices=("python", "numpy", "numba"), default="numpy")
+    parser.add_argument("--agents", type=int, default=10000)
+    parser.add_argument("--width", type=int, default=200)
+    parser.add_argument("--height", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=None, help="stop the simulation after this many steps")
+    parser.add_argument("--fps", type=float, default=10, help="frames sent to browsers per second")
+    parser.add_argument("--max-steps-per-second", type=float, default=None,
+                        help="slow the simulation down, by default it runs as fast as it can")
+    parser.add_argument("--port", type=int, default=8514)
+    args = parser.parse_args(argv)
+    stream(args.engine, args.agents, args.width, args.height, args.seed, args.steps, args.fps, args.port,
+           args.max_steps_per_second)
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<title>Factory Infection Model (streaming)</title>
+<style>
+body { font-family: sans-serif; margin: 20px; }
+canvas { border: 1px solid #ccc; image-rendering: pixelated; display: block; margin-bottom: 10px; }
+</style>
+</head>
+<body>
+<div id="status">Connecting...</div>
+<canvas id="floor"></canvas>
+<canvas id="chart" width="600" height="200"></canvas>
+<div id="legend"></div>
+<script>
+const status = document.getElementById("status");
+const floor = document.getElementById("floor");
+const chart = document.getElementById("chart");
+const legend = document.getElementById("legend");
+const MAX_POINTS = 600;
+let meta = null, image = null, pixels = null, palette = null, series = [];
+
+function hexColor(hex) {
+  return [parseInt(hex.slice(1, 3), 16), parseInt(hex.slice(3, 5), 16), parseInt(hex.slice(5, 7), 16)];
+}
+
+function setCell(index, code) {
+  //rasters are stored with y = 0 first, Mesa draws y = 0 at the bottom
+  const x = index % meta.width, y = meta.height - 1 - Math.floor(index / meta.width);
+  const p = 4 * (y * meta.width + x), c = palette[code];
+  pixels[p] = c[0]; pixels[p + 1] = c[1]; pixels[p + 2] = c[2]; pixels[p + 3] = 255;
+}
+
+function onFrame(buffer) {
+  const view = new DataView(buffer);
+  const kind = view.getUint8(0), step = view.getUint32(4, true), count = view.getUint32(8, true);
+  if (kind === 0) {
+    const codes = new Uint8Array(buffer, 12, count);
+    for (let i = 0; i < count; i++) setCell(i, codes[i]);
+  } else {
+    const indices = new Uint32Array(buffer.slice(12, 12 + 4 * count));
+    const codes = new Uint8Array(buffer, 12 + 4 * count, count);
+    for (let i = 0; i < count; i++) setCell(indices[i], codes[i]);
+  }
+  floor.getContext("2d").putImageData(image, 0, 0);
+  status.textContent = `Step ${step} (day ${Math.floor(step / 24)})`;
+}
+
+function drawChart() {
+  const ctx = chart.getContext("2d");
+  ctx.clearRect(0, 0, chart.width, chart.height);
+  series.forEach((s, i) => {
+    if (s.length < 2) return;
+    const max = Math.max(1, ...s);
+    ctx.strokeStyle = meta.series_colors[i];
+    ctx.beginPath();
+    s.forEach((v, j) => {
+      const x = j * chart.width / (MAX_POINTS - 1), y = chart.height - v / max * (chart.height - 4) - 2;
+      j ? ctx.lineTo(x, y) : ctx.moveTo(x, y);
+    });
+    ctx.stroke();
+  });
+}
+
+const socket = new WebSocket(`ws://${location.host}/ws`);
+socket.binaryType = "arraybuffer";
+socket.onmessage = (event) => {
+  if (event.data instanceof ArrayBuffer) { onFrame(event.data); return; }
+  const message = JSON.parse(event.data);
+  if (message.type === "meta") {
+    meta = message;
+    floor.width = meta.width; floor.height = meta.height;
+    const scale = Math.max(1, Math.floor(900 / meta.width));
+    floor.style.width = `${meta.width * scale}px`;
+    image = floor.getContext("2d").createImageData(meta.width, meta.height);
+    pixels = image.data;
+    palette = meta.cell_colors.map(hexColor);
+    series = meta.series.map(() => []);
+    legend.innerHTML = meta.series.map((name, i) =>
+      `<span style="color:${meta.series_colors[i]}">&#9632; ${name}</span>`).join(" &nbsp; ") +
+      " (each series scaled to its own maximum)";
+  } else if (message.type === "chart") {
+    message.values.forEach((v, i) => { series[i].push(v); if (series[i].length > MAX_POINTS) series[i].shift(); });
+    drawChart();
+  }
+};
+socket.onclose = () => { status.textContent = "Disconnected"; };
+</script>
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,19 @@
-import itertools
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
 import random
-import matplotlib.pyplot as plt
 import numpy as np
-from mesa.visualization.modules import CanvasGrid, ChartModule
-from environment.FactoryModel import factory_model
+from src.environment.FactoryModel import factory_model
+from src.environment.FactoryConfig import FactoryConfig, build_action_space
 from src.model.dqn_agent import DQNAgent
-from mesa.visualization.modules import CanvasGrid, ChartModule
-from mesa.visualization.ModularVisualization import ModularServer
-from environment.FactoryModel import factory_model
-from environment.FactoryConfig import FactoryConfig
-
-def agent_portrayal(agent):
-    """Defines how agents appear in the visualization."""
-    portrayal = {"Shape": "circle", "Filled": "true", "r": 0.5}
-
-    if hasattr(agent, "health_status"):
-        if agent.health_status == "healthy":
-            portrayal["Color"] = "green"
-            portrayal["Layer"] = 1
-        elif agent.health_status == "infected":
-            portrayal["Color"] = "red"
-            portrayal["Layer"] = 2
-        elif agent.health_status == "recovered":
-            portrayal["Color"] = "blue"
-            portrayal["Layer"] = 3
-        elif agent.health_status == "death":
-            portrayal["Color"] = "black"
-            portrayal["Layer"] = 4
-
-    return portrayal
+from src.model.training_metrics import MetricsExporter, TrainingMetrics
 
 # Visualization components
 GRID_WIDTH = 50
 GRID_HEIGHT = 25
 CANVAS_WIDTH = 500
 CANVAS_HEIGHT = 250
-grid = CanvasGrid(agent_portrayal, GRID_WIDTH, GRID_HEIGHT, CANVAS_WIDTH, CANVAS_HEIGHT)
 
 
 # Create the server for visualization
@@ -54,54 +32,34 @@ viz_config = FactoryConfig(
 )
 
 
-chart = ChartModule(
-    [
-        {"Label": "Healthy", "Color": "Green"},
-        {"Label": "Infected", "Color": "Red"},
-        {"Label": "Recovered", "Color": "Blue"},
-        {"Label": "Death", "Color": "Black"}
-    ]
-)
-prod_chart = ChartModule([{"Label": "Productivity", "Color": "Purple"}])
-daily_infections_chart = ChartModule([{"Label": "Daily Infections", "Color": "Red"}])
-
-#PARAMETERS
-cleaning_options = ['light', 'medium', 'heavy']
-splitting_options = [0, 1, 2, 3]  # none, half, quarter, eighth
-testing_options = ['none', 'light', 'medium', 'heavy']
-social_distancing_options = [False, True]
-mask_mandate_options = [False, True]
-shifts_options = [1, 2, 3, 4]  # maps to 1, 2, 3, or 4 shifts per day
-
-# Generate all combinations
-combinations = list(itertools.product(
-    cleaning_options,
-    splitting_options,
-    testing_options,
-    social_distancing_options,
-    mask_mandate_options,
-    shifts_options
-))
-
-actions = [
-    {
-        'cleaning_type': cleaning,
-        'splitting_level': splitting,
-        'testing_level': testing,
-        'social_distancing': social_distancing,
-        'mask_mandate': mask_mandate,
-        'shifts_per_day': shifts
-    }
-    for cleaning, splitting, testing, social_distancing, mask_mandate, shifts in combinations
-]
-
-state_dim = 8
-action_dim = len(actions)
-agent = DQNAgent(state_dim, action_dim)
+def visualization_server():
+    """Builds the Mesa visualization server. Mesa is only imported here, so headless training never loads it."""
+    from mesa.visualization.modules import CanvasGrid, ChartModule
+    from mesa.visualization.ModularVisualization import ModularServer
+    from src.environment.MesaAdapter import agent_portrayal, mesa_view
+
+    grid = CanvasGrid(agent_portrayal, GRID_WIDTH, GRID_HEIGHT, CANVAS_WIDTH, CANVAS_HEIGHT)
+    chart = ChartModule(
+        [
+            {"Label": "Healthy", "Color": "Green"},
+            {"Label": "Infected", "Color": "Red"},
+            {"Label": "Recovered", "Color": "Blue"},
+            {"Label": "Death", "Color": "Black"}
+        ]
+    )
+    prod_chart = ChartModule([{"Label": "Productivity", "Color": "Purple"}])
+    daily_infections_chart = ChartModule([{"Label": "Daily Infections", "Color": "Red"}])
+    return ModularServer(
+        mesa_view(factory_model),
+        [grid, chart, prod_chart, daily_infections_chart],
+        "Factory Infection Model",
+        {"N": 100, "config": viz_config, "width": GRID_WIDTH, "height": GRID_HEIGHT},
+    )
 
 #TRAINING PARAMETERS 
-num_episodes = 2000
-max_steps_per_episode = 240 #10 Days
+STATE_DIM = 8
+NUM_EPISODES = 2000
+MAX_STEPS_PER_EPISODE = 240 #10 Days
 
 def find_empty_cell(model, x_start=None, x_end=None):
     """HELPER FUNCTION. Find an empty cell in the grid within the given x bounds"""
@@ -123,114 +81,202 @@ def find_empty_cell(model, x_start=None, x_end=None):
         return random.choice(empty_cells)
     return None
 
-def train_with_toggle(dqn_agent, num_episodes, max_steps_per_episode, visualize_every=50, enable_visualization=False):
-    """MAIN TRAINING LOOP"""
+def step_reward(step_results):
+    """Reward of one simulation step"""
+    infected = step_results.get('infected', 0)
+    productivity = step_results.get('productivity', 0)
+    death = step_results.get('death', 0)
+
+    reward = (-20 * infected) - (100 * death)  #Reduced penalty multipliers
+    if productivity >= 0.75:
+        reward += 8 * productivity
+    elif productivity >= 0.6:
+        reward += 2 * productivity
+    elif productivity < 0.6:
+        reward -= 100 * (0.6 - productivity)
+    return reward
+
+
+def episode_done(model):
+    """stats.is_done of factory_model. The compartmental surrogate's infected count is an expected value that
+    never reaches zero, so it is done below half a worker."""
+    if hasattr(model, "stats"):
+        return model.stats.is_done()
+    return model.count_health_status("infected") < 0.5 or model.current_step > 100
+
+
+def train_with_toggle(dqn_agent, num_episodes, max_steps_per_episode, visualize_every=50, enable_visualization=False,
+                      metrics_port=None, metrics_file=None, metrics_interval=15.0, actions=None,
+                      model_path="dqn_factory_model.pth", plot_path="final_training_metrics.png",
+                      record_dir=None, record_every=50, dataset_dir=None, checkpoint_dir=None, checkpoint_every=25,
+                      engine="python", params=None):
+    """MAIN TRAINING LOOP. Throughput and the time split of the loop are printed every episode, and served on
+    localhost:metrics_port and/or written to metrics_file in Prometheus format while training runs. With a
+    record_dir every record_every-th episode is recorded there for replay with Replay.py. With a dataset_dir
+    every daily decision is appended there as a transition for offline training.
+
+    With a checkpoint_dir the full training state is checkpointed there every checkpoint_every episodes and
+    training continues from the last checkpoint when one exists, up to num_episodes in total. SIGTERM (a spot
+    instance preemption notice) checkpoints at the end of the current episode and stops.
+
+    With engine="compartmental" the episodes run on the compartmental surrogate (fitted parameters from the
+    params file, its defaults otherwise), which is much cheaper for pretraining. Resuming its checkpoint
+    directory with the python engine and more episodes fine tunes the pretrained agent on factory_model."""
+    if engine not in ("python", "compartmental"):
+        raise ValueError(f"Unknown engine {engine!r}, expected one of ('python', 'compartmental')")
+    if engine == "compartmental" and (enable_visualization or record_dir is not None):
+        raise ValueError("Visualization and recording need the python engine")
+    surrogate_params = None
+    if engine == "compartmental":
+        from src.environment.CompartmentalModel import compartmental_model, load_params
+        surrogate_params = load_params(params) if params else None
+    actions = actions or build_action_space()
+    recorder = None
+    if dataset_dir is not None:
+        from src.model.transition_dataset import DecisionRecorder, TransitionWriter
+        recorder = DecisionRecorder(TransitionWriter(dataset_dir, metadata={"source": "train"}))
+    metrics = TrainingMetrics(dqn_agent)
+    exporter = None
+    if metrics_port is not None or metrics_file is not None:
+        exporter = MetricsExporter(metrics, port=metrics_port, textfile=metrics_file, interval=metrics_interval)
+
     total_cleaning_counter = {"light": 0, "medium": 0, "heavy": 0}
     total_shifts_counter = {"1": 0, "2": 0, "3": 0, "4": 0}
     total_mask_counter = {True: 0, False: 0}
     total_splitting_level_counter = {"0": 0, "1": 0, "2": 0, "3": 0}
     total_swab_testing_counter = {"none": 0, "light": 0, "medium": 0, "heavy": 0}
     total_social_distancing_counter = {True: 0, False: 0}
+    counters = (total_cleaning_counter, total_shifts_counter, total_mask_counter, total_splitting_level_counter,
+                total_swab_testing_counter, total_social_distancing_counter)
+
+    start_episode = 0
+    checkpoint = None
+    preempted = []
+    if checkpoint_dir is not None:
+        import signal
+        import threading
+        from src.model.training_checkpoint import TrainingCheckpoint
+        checkpoint = TrainingCheckpoint(checkpoint_dir)
+        if checkpoint.exists():
+            start_episode, extra = checkpoint.restore(dqn_agent)
+            for counter, saved in zip(counters, extra["counters"]):
+                counter.update(saved)
+            print(f"Resuming from checkpoint after episode {start_episode} "
+                  f"({len(dqn_agent.replay_buffer)} experiences in replay)")
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: preempted.append(signum))
 
-    for episode in range(num_episodes):
+    for episode in range(start_episode, num_episodes):
         is_visualizing = enable_visualization and (episode % visualize_every == 0)
-        model = factory_model(
-            width=GRID_WIDTH,
-            height=GRID_HEIGHT,
-            N=100,
-            config=viz_config if is_visualizing else None,
-            visualization=is_visualizing
-        )
+        with metrics.timed("simulation"):
+            if engine == "compartmental":
+                model = compartmental_model(GRID_WIDTH, GRID_HEIGHT, 100, params=surrogate_params)
+            else:
+                model = factory_model(
+                    width=GRID_WIDTH,
+                    height=GRID_HEIGHT,
+                    N=100,
+                    config=viz_config if is_visualizing else None,
+                    visualization=is_visualizing
+                )
+            if record_dir is not None and episode % record_every == 0:
+                model.enable_recording(os.path.join(record_dir, f"episode_{episode + 1:05d}"))
 
         if is_visualizing:
             print(f"Starting visualization for episode {episode + 1}")
-            server = ModularServer(
-                factory_model,
-                [grid, chart, prod_chart, daily_infections_chart],
-                "Factory Infection Model",
-                {"N": 100, "config": viz_config, "width": GRID_WIDTH, "height": GRID_HEIGHT},
-            )
+            server = visualization_server()
             server.port = 8511
             server.launch()
 
         state = np.array(model.get_state())
         total_reward = 0
+        dqn_agent.begin_episode()
 
         for step in range(max_steps_per_episode):
             if step % 24 == 0:
-                action_index = dqn_agent.select_action(state)
+                with metrics.timed("action_selection"):
+                    action_index = dqn_agent.select_action(state)
                 action = actions[action_index]
-                #PROBABLY SHOULD BE MOVED TO GRIDMANAGER. HANDLES NEW SPLIT CHANGE BORDERS
-                if 'splitting_level' in action:
-                    old_level = model.grid_manager.splitting_level
-                    if old_level != action['splitting_level']:
-                        positions = model.grid_manager.get_random_positions(model.num_agents)
-                        active_agents = [agent for agent in model.schedule.agents 
-                                       if not agent.is_dead and not agent.is_quarantined]
+                if recorder is not None:
+                    recorder.decide(state, action_index)
+                with metrics.timed("reconfiguration"):
+                    #PROBABLY SHOULD BE MOVED TO GRIDMANAGER. HANDLES NEW SPLIT CHANGE BORDERS
+                    if 'splitting_level' in action and engine == "python":
+                        old_level = model.grid_manager.splitting_level
+                        if old_level != action['splitting_level']:
+                            positions = model.grid_manager.get_random_positions(model.num_agents)
+                            active_agents = [agent for agent in model.schedule.agents 
+                                           if not agent.is_dead and not agent.is_quarantined]
                         
-                        #remove all active agents
-                        for agent in active_agents:
-                            if agent.pos is not None:
-                                model.grid.remove_agent(agent)
-                                agent.pos = None
+                            #remove all active agents
+                            for agent in active_agents:
+                                if agent.pos is not None:
+                                    model.grid.remove_agent(agent)
+                                    agent.pos = None
                         
-                        #Place active agents in their new positions
-                        for i, agent in enumerate(active_agents):
-                            if i < len(positions):
-                                new_pos = positions[i]
-                                if model.grid.is_cell_empty(new_pos):
-                                    model.grid.place_agent(agent, new_pos)
-                                    agent.set_base_position(new_pos)
-                                else:
-                                    x_start = (model.grid.width // (2 ** action['splitting_level'])) * (i % (2 ** action['splitting_level']))
-                                    x_end = x_start + (model.grid.width // (2 ** action['splitting_level']))
-                                    empty_pos = find_empty_cell(model, x_start, x_end)
-                                    if empty_pos:
-                                        model.grid.place_agent(agent, empty_pos)
-                                        agent.set_base_position(empty_pos)
+                            #Place active agents in their new positions
+                            for i, agent in enumerate(active_agents):
+                                if i < len(positions):
+                                    new_pos = positions[i]
+                                    if model.grid.is_cell_empty(new_pos):
+                                        model.grid.place_agent(agent, new_pos)
+                                        agent.set_base_position(new_pos)
+                                    else:
+                                        x_start = (model.grid.width // (2 ** action['splitting_level'])) * (i % (2 ** action['splitting_level']))
+                                        x_end = x_start + (model.grid.width // (2 ** action['splitting_level']))
+                                        empty_pos = find_empty_cell(model, x_start, x_end)
+                                        if empty_pos:
+                                            model.grid.place_agent(agent, empty_pos)
+                                            agent.set_base_position(empty_pos)
                 
-                model.update_config(action)
+                    model.update_config(action)
 
-                for agent in model.schedule.agents:
-                    if not agent.is_dead and not agent.is_quarantined and agent.pos is None:
-                        empty_pos = find_empty_cell(model)
-                        if empty_pos:
-                            model.grid.place_agent(agent, empty_pos)
-                            agent.set_base_position(empty_pos)
+                    if engine == "python":
+                        for agent in model.schedule.agents:
+                            if not agent.is_dead and not agent.is_quarantined and agent.pos is None:
+                                empty_pos = find_empty_cell(model)
+                                if empty_pos:
+                                    model.grid.place_agent(agent, empty_pos)
+                                    agent.set_base_position(empty_pos)
 
-            step_results = model.step()
-
-            infected = step_results.get('infected', 0)
-            productivity = step_results.get('productivity', 0)
-            death = step_results.get('death', 0)
-
-            reward = (-20 * infected) - (100 * death)  #Reduced penalty multipliers
-            if productivity >= 0.75:
-                reward += 8 * productivity
-            elif productivity >= 0.6:
-                reward += 2 * productivity
-            elif productivity < 0.6:
-                reward -= 100 * (0.6 - productivity)
+            with metrics.timed("simulation"):
+                step_results = model.step()
 
+            reward = step_reward(step_results)
             total_reward += reward
+            if recorder is not None:
+                recorder.add_reward(reward)
 
-            next_state = np.array(model.get_state())
-            done = model.stats.is_done()
+            with metrics.timed("simulation"):
+                next_state = np.array(model.get_state())
+                done = episode_done(model)
+            metrics.env_step()
             if step % 24 == 0:
-                dqn_agent.store_experience(state, action_index, reward, next_state, done)
-                dqn_agent.train()
+                updates = len(dqn_agent.losses_history)
+                with metrics.timed("learner"):
+                    dqn_agent.store_experience(state, action_index, reward, next_state, done)
+                    dqn_agent.train()
+                if len(dqn_agent.losses_history) > updates:
+                    metrics.learner_update()
             state = next_state
 
             if done:
                 break
 
+        if engine == "python":
+            model.disable_recording()
+        if recorder is not None:
+            recorder.end_episode(state, done, episode=episode + 1, epsilon=dqn_agent.epsilon)
+
         # Update the target network periodically
         if episode % 10 == 0:
             dqn_agent.update_target_network()
         dqn_agent.rewards_history.append(total_reward)
+        metrics.end_episode(total_reward)
 
         # Print progress
         print(f"Episode {episode + 1}/{num_episodes}, Total Reward: {total_reward:.2f}, Epsilon: {dqn_agent.epsilon:.4f}")
+        print(metrics.summary_line())
         # COUNTER PRINTS AT EVERY EPISODE
         print(f"  Cleaning Counter: {model.cleaning_counter}")
         print(f"  Shifts Counter: {model.shifts_counter}")
@@ -253,17 +299,42 @@ def train_with_toggle(dqn_agent, num_episodes, max_steps_per_episode, visualize_
         for key in total_social_distancing_counter:
             total_social_distancing_counter[key] += model.social_distancing_counter[key]
 
+        if checkpoint is not None and ((episode + 1) % checkpoint_every == 0 or episode + 1 == num_episodes or
+                                       preempted):
+            seconds = checkpoint.save(dqn_agent, episode + 1, {"counters": counters})
+            print(f"  Checkpoint after episode {episode + 1} ({seconds:.2f}s)")
+            if preempted:
+                break
+
+    if exporter is not None:
+        exporter.close()
+    if recorder is not None:
+        recorder.writer.close()
+    metrics.unwatch_agent()
+    if checkpoint is not None and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, previous_handler)
+    if preempted:
+        print(f"Stopped by SIGTERM after episode {episode + 1}, rerun with the same checkpoint directory to resume.")
+        return
+
     # Save the trained model
-    dqn_agent.save_model("dqn_factory_model.pth")
+    dqn_agent.save_model(model_path)
     #PRINTS FOR TOTAL COUNTS AFTER TRAINING FINISHED
-    print("Training completed. Model saved as 'dqn_factory_model.pth'.")
+    print(f"Training completed. Model saved as '{model_path}'.")
     print(f"\nTotal Cleaning Counter: {total_cleaning_counter}")
     print(f"Total Shifts Counter: {total_shifts_counter}")
     print(f"Total Mask Counter: {total_mask_counter}")
     print(f"Total Splitting Level Counter: {total_splitting_level_counter}")
     print(f"Total Swab Testing Counter: {total_swab_testing_counter}")
     print(f"Total Social Distancing Counter: {total_social_distancing_counter}")
-    #FINAL PLOTS
+    if plot_path:
+        plot_training_metrics(dqn_agent, plot_path)
+
+
+def plot_training_metrics(dqn_agent, path='final_training_metrics.png'):
+    """FINAL PLOTS. matplotlib is imported here so training without plots never loads it"""
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(15, 10))
     
     plt.subplot(2, 2, 1)
@@ -291,7 +362,30 @@ def train_with_toggle(dqn_agent, num_episodes, max_steps_per_episode, visualize_
     plt.ylabel('Total Reward')
     
     plt.tight_layout()
-    plt.savefig('final_training_metrics.png')
+    plt.savefig(path)
     plt.close()
 
-train_with_toggle(agent, num_episodes, max_steps_per_episode, visualize_every=5, enable_visualization=False)
\ No newline at end of file
+
+def train(num_episodes=NUM_EPISODES, max_steps_per_episode=MAX_STEPS_PER_EPISODE, model_path="dqn_factory_model.pth",
+          visualize_every=5, enable_visualization=False, metrics_port=None, metrics_file=None,
+          plot_path="final_training_metrics.png", record_dir=None, record_every=50, members=None,
+          dataset_dir=None, checkpoint_dir=None, checkpoint_every=25, engine="python", params=None):
+    """Trains a new DQN over the full action space and saves its Q network to model_path. With members a
+    bootstrapped ensemble of that many Q networks is trained instead (EnsembleDQNAgent). engine="compartmental"
+    trains on the compartmental surrogate (see train_with_toggle)."""
+    actions = build_action_space()
+    if members:
+        from src.model.ensemble_dqn_agent import EnsembleDQNAgent
+        agent = EnsembleDQNAgent(STATE_DIM, len(actions), members=members)
+    else:
+        agent = DQNAgent(STATE_DIM, len(actions))
+    train_with_toggle(agent, num_episodes, max_steps_per_episode, visualize_every=visualize_every,
+                      enable_visualization=enable_visualization, metrics_port=metrics_port,
+                      metrics_file=metrics_file, actions=actions, model_path=model_path, plot_path=plot_path,
+                      record_dir=record_dir, record_every=record_every, dataset_dir=dataset_dir,
+                      checkpoint_dir=checkpoint_dir, checkpoint_every=checkpoint_every, engine=engine, params=params)
+    return agent
+
+
+if __name__ == "__main__":
+    train()
@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import math
+import time
+from src.environment.FactoryConfig import FactoryConfig
+from src.evaluation.Episode import silenced
+
+#Workers per cell of the default 50x25 floor with 100 workers
+DEFAULT_DENSITY = 100 / (50 * 25)
+
+
+def floor_for(num_agents, density=DEFAULT_DENSITY, aspect=2):
+    """Floor dimensions (width aspect times the height) that hold num_agents at the given occupancy density"""
+    height = max(2, round(math.sqrt(num_agents / density / aspect)))
+    return max(2, round(aspect * height)), height
+
+
+def build_engine(backend, config, seed=0):
+    """python is the Mesa factory_model, numpy and numba are the vectorized engine's kernel backends and
+    distributed is the vectorized engine split into stripes over every core"""
+    if backend == "python":
+        from src.environment.FactoryModel import factory_model
+        return factory_model(config.width, config.height, config.num_agents, config=config, seed=seed)
+    if backend == "distributed":
+        from src.environment.DistributedModel import distributed_model
+        return distributed_model(config.width, config.height, config.num_agents, config=config, seed=seed)
+    from src.environment.VectorizedModel import vectorized_model
+    return vectorized_model(config.width, config.height, config.num_agents, config=config, seed=seed, backend=backend)
+
+
+def time_backend(backend, num_agents, steps=48, time_budget=30.0, social_distancing=False, seed=0):
+    """Builds one engine and times its steps. Stops early once the time budget is used, but always runs at
+    least one step."""
+    width, height = floor_for(num_agents)
+    config = FactoryConfig(width=width, height=height, num_agents=num_agents, splitting_level=1,
+                           social_distancing=social_distancing)
+    with silenced():
+        start = time.perf_counter()
+        model = build_engine(backend, config, seed)
+        init_seconds = time.perf_counter() - start
+
+        step_times = []
+        run_start = time.perf_counter()
+        while len(step_times) < steps and (not step_times or time.perf_counter() - run_start < time_budget):
+            start = time.perf_counter()
+            model.step()
+            step_times.append(time.perf_counter() - start)
+
+    step_times.sort()
+    return {
+        "backend": backend,
+        "agents": num_agents,
+        "width": width,
+        "height": height,
+        "social_distancing": social_distancing,
+        "init_seconds": init_seconds,
+        "steps": len(step_times),
+        "median_step_seconds": step_times[len(step_times) // 2],
+        "steps_per_second": len(step_times) / sum(step_times),
+        "agent_steps_per_second": num_agents * len(step_times) / sum(step_times),
+    }
+
+
+def run(backends=("python", "numpy", "numba"), sizes=(100, 1000, 10000, 100000), steps=48, time_budget=30.0,
+        python_max_agents=10000, social_distancing=False):
+    """Times every backend at every workforce size. The Mesa engine is skipped above python_max_agents."""
+    results = []
+    for backend in backends:
+        if backend == "numba":
+            try:
+                from src.environment.kernels.NumbaKernels import warmup
+            except ImportError:
+                print("Numba is not installed, skipping the numba backend")
+                continue
+            start = time.perf_counter()
+            warmup()
+            print(f"numba kernels ready in {time.perf_counter() - start:.2f}s (compiled or loaded from cache)")
+        for size in sizes:
+            if backend == "python" and size > python_max_agents:
+                continue
+            result = time_backend(backend, size, steps, time_budget, social_distancing)
+            results.append(result)
+            print(f"{backend:>6} {size:>7} workers: {result['steps_per_second']:10.2f} steps/s, "
+                  f"{result['agent_steps_per_second']:12.0f} agent-steps/s, init {result['init_seconds']:.2f}s")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the Mesa, NumPy and Numba simulation backends")
+    parser.add_argument("--backends", nargs="+", default=["python", "numpy", "numba"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000, 100000])
+    parser.add_argument("--steps", type=int, default=48)
+    parser.add_argument("--time-budget", type=float, default=30.0, help="seconds of stepping per backend and size")
+    parser.add_argument("--python-max-agents", type=int, default=10000)
+    parser.add_argument("--social-distancing", action="store_true")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.backends, args.sizes, args.steps, args.time_budget, args.python_max_agents,
+                  args.social_distancing)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from src.environment.FactoryConfig import FactoryConfig
+from src.environment.FactoryModel import factory_model
+from src.evaluation.Episode import silenced
+
+#Parameter matrix of the default run. Density is workers per cell and sets the floor size.
+DEFAULT_MATRIX = {
+    "agents": [100, 1000],
+    "density": [0.08, 0.16],
+    "splitting_level": [0, 2],
+    "prevalence": [0.01, 0.2],
+}
+QUICK_MATRIX = {"agents": [100], "density": [0.08], "splitting_level": [1], "prevalence": [0.05]}
+
+
+def build_benchmark_model(agents, density, splitting_level, prevalence, social_distancing=False, seed=0):
+    """Factory model at the given size and occupancy with a share of the workers already infected"""
+    height = max(2, round((agents / density / 2) ** 0.5))
+    config = FactoryConfig(width=2 * height, height=height, num_agents=agents, splitting_level=splitting_level,
+                           social_distancing=social_distancing, testing_level='medium')
+    model = factory_model(config.width, config.height, agents, config=config, seed=seed)
+    for agent in random.Random(seed).sample(model.schedule.agents, max(1, int(agents * prevalence))):
+        agent.health_status = "infected"
+        agent.had_covid = True
+    return model
+
+
+def agent_loop(method, infected_only=False):
+    """Calls an agent method on every worker (or every infected worker)"""
+    def setup(model):
+        agents = [a for a in model.schedule.agents if a.pos is not None and
+                  (not infected_only or a.health_status == "infected")]
+        calls = [getattr(agent, method) for agent in agents]
+        def run():
+            for call in calls:
+                call()
+        return run, max(1, len(calls))
+    return setup
+
+
+def move_setup(social_distancing):
+    def setup(model):
+        model.social_distancing = social_distancing
+        return agent_loop("move")(model)
+    return setup
+
+
+def shift_change_setup(model):
+    return model.grid_manager.process_shift_change, 1
+
+
+def cleaning_setup(model):
+    manager = model.grid_manager
+    manager.sections_being_cleaned = set(range(len(manager.section_infection_levels)))
+    return manager.apply_cleaning_effects, 1
+
+
+def testing_setup(model):
+    testing = model.testing
+    def run():
+        #Force a testing step, then put the quarantined workers back so repeats test the same floor
+        testing.next_test_steps[model.test_lvl] = model.current_step_in_day
+        testing.process_testing(model.test_lvl)
+        for agent in list(model.quarantine.quarantine_zone):
+            model.quarantine.return_from_quarantine(agent)
+    return run, 1
+
+
+def stats_setup(model):
+    def run():
+        model.stats.count_health_status("infected")
+        model.stats.calculate_productivity()
+    return run, 1
+
+
+def model_step_setup(model):
+    return model.step, 1
+
+
+#name -> setup(model) returning (callable, units per call); times are reported per unit (per agent for agent loops)
+BENCHMARKS = {
+    "worker_agent.step": agent_loop("step"),
+    "worker_agent.infection": agent_loop("infection", infected_only=True),
+    "worker_agent.move": move_setup(False),
+    "worker_agent.move[distancing]": move_setup(True),
+    "GridManager.process_shift_change": shift_change_setup,
+    "GridManager.apply_cleaning_effects": cleaning_setup,
+    "TestingManager.process_testing": testing_setup,
+    "StatsCollector.reads": stats_setup,
+    "factory_model.step": model_step_setup,
+}
+
+
+def time_case(setup, params, repeat=5, min_time=0.2, max_calls=1000):
+    """Times one benchmark case. A fresh model is built for every repeat and the callable is run until
+    min_time has passed (at least once). Returns seconds per unit for every repeat."""
+    samples = []
+    for r in range(repeat):
+        with silenced():
+            model = build_benchmark_model(**params, seed=r)
+            fn, units = setup(model)
+            calls = 0
+            start = time.perf_counter()
+            while calls < max_calls and (calls == 0 or time.perf_counter() - start < min_time):
+                fn()
+                calls += 1
+            elapsed = time.perf_counter() - start
+        samples.append(elapsed / (calls * units))
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(benchmarks=None, matrix=None, repeat=5, min_time=0.2):
+    """Runs every benchmark over the cartesian product of the parameter matrix"""
+    matrix = matrix or DEFAULT_MATRIX
+    names = benchmarks or list(BENCHMARKS)
+    results = []
+    keys = list(matrix)
+    for values in itertools.product(*(matrix[k] for k in keys)):
+        params = dict(zip(keys, values))
+        for name in names:
+            samples = time_case(BENCHMARKS[name], params, repeat, min_time)
+            result = {
+                "benchmark": name,
+                "params": params,
+                "median_seconds": statistics.median(samples),
+                "min_seconds": min(samples),
+                "stdev_seconds": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+                "repeat": len(samples),
+            }
+            results.append(result)
+            print(f"{name:<36} {json.dumps(params)}: {result['median_seconds'] * 1e6:12.2f} us")
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def case_key(result):
+    return result["benchmark"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(baseline, current, threshold=0.10):
+    """Compares two suite results case by case on the fastest repeat, which is the least sensitive to
+    machine noise. Returns the rows and the cases that got slower by more than threshold (a fraction)."""
+    base = {case_key(r): r for r in baseline["results"]}
+    rows = []
+    regressions = []
+    for result in current["results"]:
+        key = case_key(result)
+        if key not in base:
+            continue
+        ratio = result["min_seconds"] / base[key]["min_seconds"]
+        row = {"benchmark": key[0], "params": result["params"], "baseline": base[key]["min_seconds"],
+               "current": result["min_seconds"], "ratio": ratio}
+        rows.append(row)
+        if ratio > 1 + threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the simulation hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the suite and write JSON results")
+    run_parser.add_argument("--output", default="bench_results.json")
+    run_parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=None)
+    run_parser.add_argument("--quick", action="store_true", help="one small case per benchmark")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--min-time", type=float, default=0.2)
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        suite = run_suite(args.benchmarks, QUICK_MATRIX if args.quick else None, args.repeat, args.min_time)
+        with open(args.output, "w") as f:
+            json.dump(suite, f, indent=2)
+        print(f"Results written to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows, regressions = compare(baseline, current, args.threshold)
+    print(f"{baseline['meta'].get('revision')} -> {current['meta'].get('revision')}")
+    for row in rows:
+        flag = "REGRESSION" if row in regressions else ""
+        print(f"{row['benchmark']:<36} {json.dumps(row['params'])}: {row['ratio']:6.2f}x {flag}")
+    print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
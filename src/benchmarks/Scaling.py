@@ -0,0 +1,321 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import queue
+import time
+import traceback
+from collections import defaultdict
+import numpy as np
+from src.benchmarks.Backends import build_engine, floor_for
+from src.environment.FactoryConfig import FactoryConfig
+from src.evaluation.Episode import silenced
+
+try:
+    import resource
+except ImportError: #not available on Windows, memory is then not reported
+    resource = None
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+DEFAULT_DENSITIES = (0.08, 0.2)
+SWEEP_KEYS = ("density", "aspect", "social_distancing", "splitting_level")
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def measure_point(engine, agents, density, aspect, social_distancing, splitting_level, steps=24, time_budget=30.0,
+                  seed=0):
+    """Builds one model and times plain steps, then profiles further steps per phase.
+    Meant to run in a fresh process so the peak RSS belongs to this point only."""
+    width, height = floor_for(agents, density, aspect)
+    config = FactoryConfig(width=width, height=height, num_agents=agents, splitting_level=splitting_level,
+                           social_distancing=social_distancing)
+    baseline_rss = peak_rss_mb()
+    with silenced():
+        start = time.perf_counter()
+        model = build_engine(engine, config, seed)
+        init_seconds = time.perf_counter() - start
+
+        step_times = []
+        run_start = time.perf_counter()
+        while len(step_times) < steps and (not step_times or time.perf_counter() - run_start < time_budget):
+            start = time.perf_counter()
+            model.step()
+            step_times.append(time.perf_counter() - start)
+
+        model.enable_profiling()
+        phase_steps = max(1, len(step_times) // 2)
+        phase_start = time.perf_counter()
+        for _ in range(phase_steps):
+            model.step()
+        phase_total = time.perf_counter() - phase_start
+        metrics = model.disable_profiling()
+
+    step_seconds = sum(step_times) / len(step_times)
+    #Phases the engine never reaches (the factory's per-agent phases on a vectorized engine) are left out
+    phases = {phase: timing["seconds"] / phase_steps for phase, timing in metrics["phases"].items()
+              if timing["seconds"]}
+    phases["other"] = max(0.0, phase_total / phase_steps - sum(phases.values()))
+    return {
+        "engine": engine,
+        "agents": agents,
+        "density": density,
+        "aspect": aspect,
+        "social_distancing": social_distancing,
+        "splitting_level": splitting_level,
+        "width": width,
+        "height": height,
+        "init_seconds": init_seconds,
+        "steps": len(step_times),
+        "step_seconds": step_seconds,
+        "steps_per_second": 1 / step_seconds,
+        "agent_steps_per_second": agents / step_seconds,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "phase_steps": phase_steps,
+        "phase_seconds": phases,
+    }
+
+
+def group_key(point):
+    return tuple(point[k] for k in ("engine",) + SWEEP_KEYS)
+
+
+def predicted_step_seconds(measured, agents):
+    """Extrapolates the step time of a group to a larger workforce from its last two points (at least
+    linear growth is assumed)"""
+    last = measured[-1]
+    exponent = 1.0
+    if len(measured) > 1:
+        prev = measured[-2]
+        exponent = max(1.0, math.log(last["step_seconds"] / prev["step_seconds"]) /
+                       math.log(last["agents"] / prev["agents"]))
+    return last["step_seconds"] * (agents / last["agents"]) ** exponent
+
+
+def run_in_process(results, function, args):
+    try:
+        results.put(("ok", function(*args)))
+    except Exception:
+        results.put(("error", traceback.format_exc()))
+
+
+def isolated(function, *args):
+    """function(*args) in a fresh spawned process, so every point's peak memory is its own"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_in_process, args=(results, function, args))
+    process.start()
+    try:
+        while True:
+            try:
+                kind, value = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Point process exited with code {process.exitcode}")
+    finally:
+        process.join()
+    if kind == "error":
+        raise RuntimeError(f"Point failed:\n{value}")
+    return value
+
+
+def run_study(engine="python", sizes=DEFAULT_SIZES, densities=DEFAULT_DENSITIES, aspects=(2,),
+              social_distancing=(False, True), splitting_levels=(0, 3), steps=24, time_budget=30.0,
+              max_step_seconds=10.0, seed=0):
+    """Sweeps the workforce size for every combination of floor density, aspect ratio, social distancing and
+    splitting level. Each point runs in its own process. A size is skipped (and reported with its predicted
+    step time) once the group's measured growth says a single step would exceed max_step_seconds."""
+    points = []
+    for density, aspect, distancing, splitting in itertools.product(densities, aspects, social_distancing,
+                                                                     splitting_levels):
+        measured = []
+        for agents in sorted(sizes):
+            width, height = floor_for(agents, density, aspect)
+            if agents > width * height:
+                continue
+            if measured:
+                predicted = predicted_step_seconds(measured, agents)
+                if predicted > max_step_seconds:
+                    points.append({"engine": engine, "agents": agents, "density": density, "aspect": aspect,
+                                   "social_distancing": distancing, "splitting_level": splitting,
+                                   "width": width, "height": height, "skipped": True, "predicted_step_seconds": predicted})
+                    print(f"{engine} {agents:>7} workers density {density} distancing {distancing} "
+                          f"splitting {splitting}: skipped, predicted {predicted:.1f}s per step")
+                    continue
+            point = isolated(measure_point, engine, agents, density, aspect, distancing, splitting, steps,
+                             time_budget, seed)
+            measured.append(point)
+            points.append(point)
+            print(f"{engine} {agents:>7} workers density {density} distancing {distancing} "
+                  f"splitting {splitting}: {point['steps_per_second']:9.2f} steps/s, "
+                  f"peak {point['peak_rss_mb'] or 0:.0f} MB")
+    return points
+
+
+def fit_power_law(agents, seconds):
+    """Least squares fit of seconds = coefficient * agents ** exponent in log space"""
+    exponent, log_coefficient = np.polyfit(np.log(agents), np.log(seconds), 1)
+    return {"exponent": float(exponent), "coefficient": float(math.exp(log_coefficient))}
+
+
+def fit_exponents(points):
+    """Empirical complexity exponents of the step time and of every phase, per sweep group"""
+    groups = defaultdict(list)
+    for point in points:
+        if not point.get("skipped"):
+            groups[group_key(point)].append(point)
+    fits = []
+    for key, measured in groups.items():
+        if len(measured) < 2:
+            continue
+        agents = [p["agents"] for p in measured]
+        fit = dict(zip(("engine",) + SWEEP_KEYS, key))
+        fit["step"] = fit_power_law(agents, [p["step_seconds"] for p in measured])
+        fit["phases"] = {}
+        for phase in measured[-1]["phase_seconds"]:
+            seconds = [p["phase_seconds"].get(phase, 0.0) for p in measured]
+            if all(s > 0 for s in seconds):
+                fit["phases"][phase] = fit_power_law(agents, seconds)
+        fits.append(fit)
+    return fits
+
+
+def max_agents(fit, steps_per_second):
+    """Largest workforce the fitted step time allows at the given step rate"""
+    if fit["exponent"] <= 0:
+        return math.inf
+    return (1 / (steps_per_second * fit["coefficient"])) ** (1 / fit["exponent"])
+
+
+def summary_table(points, fits, rates=(1.0, 10.0)):
+    lines = [f"{'agents':>8} {'floor':>11} {'density':>7} {'dist':>5} {'split':>5} {'steps/s':>10} "
+             f"{'peak MB':>8}  slowest phases"]
+    for p in points:
+        floor = f"{p['width']}x{p['height']}"
+        if p.get("skipped"):
+            lines.append(f"{p['agents']:>8} {floor:>11} {p['density']:>7} {str(p['social_distancing']):>5} "
+                         f"{p['splitting_level']:>5}  skipped, ~{p['predicted_step_seconds']:.0f}s per step")
+            continue
+        slowest = sorted(p["phase_seconds"].items(), key=lambda kv: -kv[1])[:3]
+        total = sum(p["phase_seconds"].values()) or 1.0
+        phases = ", ".join(f"{name} {seconds / total:.0%}" for name, seconds in slowest)
+        lines.append(f"{p['agents']:>8} {floor:>11} {p['density']:>7} {str(p['social_distancing']):>5} "
+                     f"{p['splitting_level']:>5} {p['steps_per_second']:>10.2f} {p['peak_rss_mb'] or 0:>8.0f}  "
+                     f"{phases}")
+    lines.append("")
+    lines.append("Complexity exponents (step time ~ agents^b)")
+    for fit in fits:
+        limits = ", ".join(f"{max_agents(fit['step'], rate):,.0f} at {rate:g} steps/s" for rate in rates)
+        superlinear = ", ".join(f"{name} {phase['exponent']:.2f}" for name, phase in
+                                sorted(fit["phases"].items(), key=lambda kv: -kv[1]["exponent"]))
+        lines.append(f"density {fit['density']} aspect {fit['aspect']} distancing {fit['social_distancing']} "
+                     f"splitting {fit['splitting_level']}: b={fit['step']['exponent']:.2f} (max {limits})")
+        lines.append(f"    phases: {superlinear}")
+    return "\n".join(lines)
+
+
+def group_label(key):
+    _, density, aspect, distancing, splitting = key
+    return f"d={density} a={aspect} sd={int(distancing)} s={splitting}"
+
+
+def plot_results(points, directory):
+    """Throughput, memory and per-phase curves against workforce size. Needs matplotlib."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping plots")
+        return []
+
+    groups = defaultdict(list)
+    for point in points:
+        if not point.get("skipped"):
+            groups[group_key(point)].append(point)
+    files = []
+
+    for metric, ylabel, name in (("steps_per_second", "steps per second", "throughput.png"),
+                                 ("peak_rss_mb", "peak RSS (MB)", "memory.png")):
+        fig, ax = plt.subplots(figsize=(8, 5))
+        for key, measured in groups.items():
+            ax.plot([p["agents"] for p in measured], [p[metric] or 0 for p in measured], marker="o",
+                    label=group_label(key))
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("workers")
+        ax.set_ylabel(ylabel)
+        ax.legend(fontsize="small")
+        fig.tight_layout()
+        fig.savefig(os.path.join(directory, name))
+        plt.close(fig)
+        files.append(name)
+
+    columns = min(3, len(groups)) or 1
+    rows = math.ceil(len(groups) / columns) or 1
+    fig, axes = plt.subplots(rows, columns, figsize=(5 * columns, 4 * rows), squeeze=False)
+    for ax, (key, measured) in zip(axes.flat, groups.items()):
+        phases = sorted({phase for p in measured for phase in p["phase_seconds"]})
+        for phase in phases:
+            ax.plot([p["agents"] for p in measured], [p["phase_seconds"].get(phase, 0) for p in measured],
+                    marker=".", label=phase)
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_title(group_label(key), fontsize="small")
+        ax.set_xlabel("workers")
+        ax.set_ylabel("seconds per step")
+    axes.flat[0].legend(fontsize="x-small")
+    fig.tight_layout()
+    fig.savefig(os.path.join(directory, "phases.png"))
+    plt.close(fig)
+    files.append("phases.png")
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput, memory and per-phase scaling study of the simulation")
+    parser.add_argument("--engine", default="python", choices=["python", "numpy", "numba"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument("--densities", nargs="+", type=float, default=list(DEFAULT_DENSITIES),
+                        help="workers per floor cell")
+    parser.add_argument("--aspects", nargs="+", type=float, default=[2], help="floor width divided by height")
+    parser.add_argument("--social-distancing", nargs="+", type=int, default=[0, 1], choices=[0, 1])
+    parser.add_argument("--splitting-levels", nargs="+", type=int, default=[0, 3], choices=[0, 1, 2, 3])
+    parser.add_argument("--steps", type=int, default=24)
+    parser.add_argument("--time-budget", type=float, default=30.0, help="seconds of plain stepping per point")
+    parser.add_argument("--max-step-seconds", type=float, default=10.0,
+                        help="skip sizes whose predicted step time exceeds this")
+    parser.add_argument("--output-dir", default="scaling_results")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    points = run_study(args.engine, args.sizes, args.densities, args.aspects,
+                       [bool(v) for v in args.social_distancing], args.splitting_levels, args.steps,
+                       args.time_budget, args.max_step_seconds)
+    fits = fit_exponents(points)
+    table = summary_table(points, fits)
+    print()
+    print(table)
+    with open(os.path.join(args.output_dir, "results.json"), "w") as f:
+        json.dump({"points": points, "fits": fits}, f, indent=2)
+    with open(os.path.join(args.output_dir, "summary.txt"), "w") as f:
+        f.write(table + "\n")
+    plot_results(points, args.output_dir)
+    print(f"Results written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
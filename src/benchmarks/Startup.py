@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+HEAVY_MODULES = ("torch", "matplotlib", "mesa", "numba", "pandas", "numpy")
+
+#name -> command line, run from the repository root with the current interpreter
+COMMANDS = {
+    "interpreter": ["-c", "pass"],
+    "cli --help": ["-m", "src.cli", "--help"],
+    "import factory_model": ["-c", "import src.environment.FactoryModel"],
+    "simulate 1 day": ["-m", "src.cli", "simulate", "--days", "1", "--seed", "0"],
+    "simulate 1 day (numpy engine)": ["-m", "src.cli", "simulate", "--days", "1", "--seed", "0", "--engine", "numpy"],
+    "import Train (torch)": ["-c", "import src.Train"],
+}
+
+
+def time_command(args, repeats=5):
+    """Wall time of fresh interpreter runs of one command"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def loaded_modules(statement):
+    """Heavy third party modules loaded by a statement in a fresh interpreter"""
+    probe = f"import sys; {statement}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, check=True, capture_output=True, text=True)
+    return output.stdout.split()
+
+
+def run(commands=None, repeats=5):
+    results = []
+    for name in commands or COMMANDS:
+        samples = time_command(COMMANDS[name], repeats)
+        result = {"command": name, "median_seconds": statistics.median(samples), "min_seconds": min(samples)}
+        results.append(result)
+        print(f"{name:<32} {result['median_seconds'] * 1000:8.0f} ms median, {result['min_seconds'] * 1000:8.0f} ms min")
+    modules = loaded_modules("import src.cli")
+    print(f"Heavy modules loaded by importing the CLI: {', '.join(modules) or 'none'}")
+    return {"results": results, "cli_import_modules": modules}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup time of the CLI and of the main imports")
+    parser.add_argument("--commands", nargs="+", choices=list(COMMANDS), default=None)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.commands, args.repeats)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
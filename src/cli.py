@@ -0,0 +1,222 @@
+import argparse
+import json
+import sys
+
+#Subcommands that forward their remaining arguments to an existing module's main(argv)
+BENCHMARKS = {
+    "micro": "src.benchmarks.Microbenchmarks",
+    "scaling": "src.benchmarks.Scaling",
+    "backends": "src.benchmarks.Backends",
+    "startup": "src.benchmarks.Startup",
+}
+ENGINES = ("python", "numpy", "numba", "compartmental", "distributed")
+
+
+def build_engine(engine, config, seed=None, processes=None, params=None):
+    """Headless model of the chosen engine. Each engine module is imported only when it is used. processes is
+    the number of stripe processes of the distributed engine, all cores by default. params is a parameter
+    file written by SurrogateFit for the compartmental engine, its fitted defaults otherwise."""
+    if engine == "python":
+        from src.environment.FactoryModel import factory_model
+        return factory_model(config.width, config.height, config.num_agents, config=config, seed=seed)
+    if engine == "compartmental":
+        from src.environment.CompartmentalModel import compartmental_model, load_params
+        return compartmental_model(config.width, config.height, config.num_agents, config=config, seed=seed,
+                                   params=load_params(params) if params else None)
+    if engine == "distributed":
+        from src.environment.DistributedModel import distributed_model
+        return distributed_model(config.width, config.height, config.num_agents, config=config, seed=seed,
+                                 processes=processes)
+    from src.environment.VectorizedModel import vectorized_model
+    return vectorized_model(config.width, config.height, config.num_agents, config=config, seed=seed,
+                            backend=engine)
+
+
+def simulate(args):
+    from src.environment.FactoryConfig import FactoryConfig, build_action_space
+    from src.evaluation.Episode import StaticPolicy, run_episode, silenced, summarize_episode
+
+    policy = None
+    if args.model:
+        from src.evaluation.Episode import NetworkPolicy
+        policy = NetworkPolicy(args.model)
+    elif args.action is not None:
+        policy = StaticPolicy(build_action_space()[args.action])
+
+    config = FactoryConfig(width=args.width, height=args.height, num_agents=args.agents, visualization=False)
+    with silenced(not args.verbose):
+        model = build_engine(args.engine, config, args.seed, args.processes, args.params)
+    if args.record:
+        if not hasattr(model, "enable_recording"):
+            raise SystemExit(f"Recording needs the python engine, not {args.engine}")
+        model.enable_recording(args.record)
+    daily = run_episode(policy, seed=args.seed, num_days=args.days, quiet=not args.verbose, model=model)
+    if args.record:
+        print(f"Recording written to {model.disable_recording()}")
+    summary = summarize_episode(daily)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "daily": {k: v.tolist() for k, v in daily.items()}}, f, indent=2)
+    print(json.dumps(summary))
+    return 0
+
+
+def train(args):
+    from src.Train import train as run_training
+    run_training(num_episodes=args.episodes, max_steps_per_episode=args.steps, model_path=args.output,
+                 visualize_every=args.visualize_every, enable_visualization=args.visualize,
+                 metrics_port=args.metrics_port, metrics_file=args.metrics_file,
+                 plot_path=None if args.no_plot else args.plot, record_dir=args.record_dir,
+                 record_every=args.record_every, members=args.ensemble, dataset_dir=args.dataset,
+                 checkpoint_dir=args.checkpoint_dir, checkpoint_every=args.checkpoint_every, engine=args.engine,
+                 params=args.params)
+    return 0
+
+
+def serve(args):
+    if args.replay:
+        from src.Replay import build_replay_server
+        server = build_replay_server(args.replay, port=args.port or 8513, start_frame=args.start_frame,
+                                     raster=args.raster)
+    elif args.demo:
+        from src.demo import build_demo_server
+        server = build_demo_server(port=args.port or 8512)
+    else:
+        from src.Run import build_server
+        server = build_server(args.model, port=args.port or 8511, raster=args.raster)
+    server.launch()
+    return 0
+
+
+def forward(module_name, argv):
+    """Runs an existing module's main(argv), importing the module only now"""
+    import importlib
+    module = importlib.import_module(module_name)
+    result = module.main(argv)
+    return result if isinstance(result, int) else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="factory-sim", description="Workplace virus mitigation simulator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sim = commands.add_parser("simulate", help="run one headless episode and print its outcomes")
+    sim.add_argument("--engine", choices=ENGINES, default="python")
+    sim.add_argument("--agents", type=int, default=100)
+    sim.add_argument("--width", type=int, default=50)
+    sim.add_argument("--height", type=int, default=25)
+    sim.add_argument("--days", type=int, default=10)
+    sim.add_argument("--seed", type=int, default=None)
+    sim.add_argument("--processes", type=int, default=None, help="stripe processes of the distributed engine")
+    sim.add_argument("--params", default=None, help="fitted parameters of the compartmental engine (SurrogateFit)")
+    sim.add_argument("--action", type=int, default=None, help="index of a static action in build_action_space()")
+    sim.add_argument("--model", default=None, help="exported QNetwork choosing the action every day")
+    sim.add_argument("--output", default=None, help="write the summary and per-day metrics as JSON")
+    sim.add_argument("--record", default=None, help="record the run to this directory for serve --replay")
+    sim.add_argument("--verbose", action="store_true", help="show the model's own logging")
+    sim.set_defaults(handler=simulate)
+
+    tr = commands.add_parser("train", help="train the DQN")
+    tr.add_argument("--episodes", type=int, default=2000)
+    tr.add_argument("--steps", type=int, default=240, help="steps per episode (24 per day)")
+    tr.add_argument("--engine", choices=("python", "compartmental"), default="python",
+                    help="train on the agent based model or pretrain on the compartmental surrogate")
+    tr.add_argument("--params", default=None, help="fitted parameters of the compartmental engine (SurrogateFit)")
+    tr.add_argument("--output", default="dqn_factory_model.pth")
+    tr.add_argument("--plot", default="final_training_metrics.png")
+    tr.add_argument("--no-plot", action="store_true")
+    tr.add_argument("--visualize", action="store_true", help="launch the visualization server every few episodes")
+    tr.add_argument("--visualize-every", type=int, default=5)
+    tr.add_argument("--metrics-port", type=int, default=None, help="serve live training metrics on localhost")
+    tr.add_argument("--metrics-file", default=None, help="Prometheus textfile refreshed while training")
+    tr.add_argument("--record-dir", default=None, help="record episodes to this directory for serve --replay")
+    tr.add_argument("--record-every", type=int, default=50, help="record every n-th episode")
+    tr.add_argument("--dataset", default=None, help="append every transition to this dataset for offline training")
+    tr.add_argument("--checkpoint-dir", default=None,
+                    help="checkpoint the full training state here and resume from it when present")
+    tr.add_argument("--checkpoint-every", type=int, default=25, help="episodes between checkpoints")
+    tr.add_argument("--ensemble", type=int, default=None, metavar="K",
+                    help="train a bootstrapped ensemble of K Q networks in one batched pass")
+    tr.set_defaults(handler=train)
+
+    ev = commands.add_parser("evaluate", add_help=False,
+                             help="benchmark policies (arguments are passed to src/evaluation/Evaluator.py)")
+    ev.set_defaults(handler=lambda args: forward("src.evaluation.Evaluator", args.extra))
+
+    sw = commands.add_parser("sweep", add_help=False,
+                             help="run a resumable parameter sweep (arguments are passed to src/evaluation/Sweep.py)")
+    sw.set_defaults(handler=lambda args: forward("src.evaluation.Sweep", args.extra))
+
+    su = commands.add_parser("surrogate", add_help=False,
+                             help="fit or query the learned outcome surrogate (arguments are passed to "
+                                  "src/evaluation/OutcomeSurrogate.py)")
+    su.set_defaults(handler=lambda args: forward("src.evaluation.OutcomeSurrogate", args.extra))
+
+    pa = commands.add_parser("pareto", add_help=False,
+                             help="search Pareto optimal policy schedules (arguments are passed to "
+                                  "src/evaluation/Pareto.py)")
+    pa.set_defaults(handler=lambda args: forward("src.evaluation.Pareto", args.extra))
+
+    tu = commands.add_parser("tune", add_help=False,
+                             help="search DQN hyperparameters with successive halving (arguments are passed to "
+                                  "src/model/hyperparameter_search.py)")
+    tu.set_defaults(handler=lambda args: forward("src.model.hyperparameter_search", args.extra))
+
+    ds = commands.add_parser("dataset", add_help=False,
+                             help="collect or inspect transition datasets (arguments are passed to "
+                                  "src/model/transition_dataset.py)")
+    ds.set_defaults(handler=lambda args: forward("src.model.transition_dataset", args.extra))
+
+    of = commands.add_parser("offline", add_help=False,
+                             help="train a Q network from a transition dataset (arguments are passed to "
+                                  "src/model/offline_training.py)")
+    of.set_defaults(handler=lambda args: forward("src.model.offline_training", args.extra))
+
+    pc = commands.add_parser("policy-cache", add_help=False,
+                             help="measure the policy inference cache on a saved network (arguments are passed "
+                                  "to src/model/policy_cache.py)")
+    pc.set_defaults(handler=lambda args: forward("src.model.policy_cache", args.extra))
+
+    sm = commands.add_parser("service", add_help=False,
+                             help="serve on demand simulations over HTTP (arguments are passed to src/Service.py)")
+    sm.set_defaults(handler=lambda args: forward("src.Service", args.extra))
+
+    fl = commands.add_parser("fleet", add_help=False,
+                             help="simulate several sites that carry infections between them (arguments are "
+                                  "passed to src/evaluation/Fleet.py)")
+    fl.set_defaults(handler=lambda args: forward("src.evaluation.Fleet", args.extra))
+
+    sv = commands.add_parser("serve", help="launch the Mesa visualization server")
+    sv.add_argument("--model", default="dqn_factory_model.pth")
+    sv.add_argument("--port", type=int, default=None)
+    sv.add_argument("--demo", action="store_true", help="serve the small demo floor without a trained model")
+    sv.add_argument("--replay", default=None, help="play back a recorded run instead of simulating")
+    sv.add_argument("--start-frame", type=int, default=0)
+    sv.add_argument("--raster", action="store_true", help="draw the floor as one heatmap image per frame")
+    sv.set_defaults(handler=serve)
+
+    st = commands.add_parser("stream", add_help=False,
+                             help="stream a large run to the browser (arguments are passed to src/Stream.py)")
+    st.set_defaults(handler=lambda args: forward("src.Stream", args.extra))
+
+    bench = commands.add_parser("bench", add_help=False,
+                                help="run a benchmark (arguments are passed to the benchmark module)")
+    bench.add_argument("benchmark", choices=list(BENCHMARKS))
+    bench.set_defaults(handler=lambda args: forward(BENCHMARKS[args.benchmark], args.extra))
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    passthrough = ("evaluate", "sweep", "surrogate", "pareto", "tune", "dataset", "offline", "policy-cache", "service",
+                   "stream", "fleet", "bench")
+    if extra and args.command not in passthrough:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.extra = extra
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,20 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from functools import partial
 from mesa.visualization.modules import CanvasGrid, ChartModule
 from mesa.visualization.ModularVisualization import ModularServer
-from environment.FactoryModel import factory_model
-from environment.FactoryConfig import FactoryConfig
-
-def agent_portrayal(agent):
-    """Defines how agents appear in the visualization."""
-    portrayal = {"Shape": "circle", "Filled": "true", "r": 0.7}
-
-    if agent.health_status == "healthy":
-        portrayal["Color"] = "green"
-        portrayal["Layer"] = 1
-    elif agent.health_status == "infected":
-        portrayal["Color"] = "red"
-        portrayal["Layer"] = 2
-    elif agent.health_status == "recovered":
-        portrayal["Color"] = "blue"
-        portrayal["Layer"] = 3
-    elif agent.health_status == "death":
-        portrayal["Color"] = "black"
-        portrayal["Layer"] = 4
-
-    return portrayal
+from src.environment.FactoryModel import factory_model
+from src.environment.FactoryConfig import FactoryConfig
+from src.environment.MesaAdapter import agent_portrayal, mesa_view
 
 GRID_WIDTH = 10
 GRID_HEIGHT = 10
 CANVAS_WIDTH = 400
 CANVAS_HEIGHT = 400
 
-grid = CanvasGrid(agent_portrayal, GRID_WIDTH, GRID_HEIGHT, CANVAS_WIDTH, CANVAS_HEIGHT)
+grid = CanvasGrid(partial(agent_portrayal, radius=0.7), GRID_WIDTH, GRID_HEIGHT, CANVAS_WIDTH, CANVAS_HEIGHT)
 
 health_chart = ChartModule(
     [
@@ -65,12 +52,17 @@ def create_factory_model(N, config, width, height):
         visualization=True
     )
 
-server = ModularServer(
-    create_factory_model,
-    [grid, health_chart, productivity_chart],
-    "Factory Infection Model Demo",
-    {"N": 8, "config": demo_config, "width": GRID_WIDTH, "height": GRID_HEIGHT}
-)
+def build_demo_server(port=8512):
+    """Small 10x10 demo floor with social distancing, heavy cleaning and medium testing"""
+    server = ModularServer(
+        mesa_view(create_factory_model),
+        [grid, health_chart, productivity_chart],
+        "Factory Infection Model Demo",
+        {"N": 8, "config": demo_config, "width": GRID_WIDTH, "height": GRID_HEIGHT}
+    )
+    server.port = port
+    return server
+
 
-server.port = 8512
-server.launch()
\ No newline at end of file
+if __name__ == "__main__":
+    build_demo_server().launch()
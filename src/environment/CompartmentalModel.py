@@ -0,0 +1,273 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import json
+import numpy as np
+from src.environment.FactoryConfig import FactoryConfig
+from src.environment.GridManager import CLEANING_SCHEDULE
+from src.environment.WorkerAgent import (BASE_INFECTION_PROBABILITIES, DISTANCING_PRODUCTION_FACTOR,
+                                         DISTANCING_TRANSMISSION_FACTOR, HEALTH_PRODUCTION, INFECTION_STEPS,
+                                         MASK_PRODUCTION_FACTOR, MASK_TRANSMISSION_FACTOR, PRIOR_INFECTION_FACTOR,
+                                         RECOVERY_STEPS, SHIFT_PENALTIES, SPLITTING_LEVEL_PENALTIES)
+from src.environment.infection_control.Quarantine import QUARANTINE_DURATION
+from src.environment.infection_control.SwabTesting import FALSE_NEGATIVE_RATE, FALSE_POSITIVE_RATE, TESTING_LEVELS
+
+#Expected infection weight of one sick agent on a fully occupied floor: cells at Manhattan distance d
+#(1 cell at d=0, 4d cells otherwise) times the per contact infection probability at that distance
+CONTACT_WEIGHT = sum((4 * d if d else 1) * p for d, p in BASE_INFECTION_PROBABILITIES.items())
+
+#Fitted against factory_model ensembles by src/evaluation/SurrogateFit.py with its defaults (24 static
+#actions x 8 replicates on the 50x25 floor with 100 workers, 10 days) and 10 sweeps. Held out r2: 0.70
+#infected, 0.78 recovered, 0.85 productivity. Refit for other floors and pass the file to load_params.
+#beta scales transmission, alpha is the incidence exponent that stands in for the local saturation
+#of spread caused by workers being confined to their 2x2 workspaces.
+DEFAULT_PARAMS = {"beta": 0.683, "alpha": 0.793}
+
+
+def load_params(path):
+    """Reads fitted surrogate parameters written by SurrogateFit.fit_surrogate"""
+    with open(path) as f:
+        return {**DEFAULT_PARAMS, **json.load(f)["params"]}
+
+
+class compartmental_model:
+    """Mean field (SEIR style) companion of factory_model with the same get_state, update_config and step
+    interface. Workers are tracked as counts: healthy (never infected and previously infected), free
+    infected/recovered workers by infection_time (so the 40/80 step timers are exact), quarantined
+    infected by infection_time and false positive quarantines by time in quarantine. Each step applies
+    the cleaning, testing, quarantine, transmission, progression and production rules of the agent based
+    model as expected values, which is orders of magnitude cheaper than simulating every worker."""
+    def __init__(self, width, height, N, visualization=False, config=None, seed=None, params=None):
+        if config is None:
+            config = FactoryConfig(width=width, height=height, num_agents=N, visualization=visualization)
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.num_agents = config.num_agents
+        self.width = config.width
+        self.height = config.height
+
+        # Policy parameters, same names as factory_model
+        self.mask_mandate = config.mask_mandate
+        self.social_distancing = config.social_distancing
+        self.initial_cleaning = config.cleaning_type
+        self.test_lvl = config.testing_level
+        self.splitting_level = config.splitting_level
+
+        self.steps_per_day = config.steps_per_day
+        self.shifts_per_day = config.shifts_per_day
+        self.steps_per_shift = config.steps_per_shift
+
+        self.current_step = 0
+        self.current_step_in_day = 0
+        self.current_day = 0
+
+        # Compartments
+        self.susceptible = float(self.num_agents - 1)
+        self.susceptible_prior = 0.0 #healthy again after recovering, half as likely to be infected
+        self.timers = np.zeros(RECOVERY_STEPS + 1) #free workers by infection_time, infected up to INFECTION_STEPS
+        self.timers[0] = 1.0
+        self.quarantined = np.zeros(INFECTION_STEPS + 1) #quarantined infected by infection_time
+        self.quarantined_healthy = np.zeros((2, QUARANTINE_DURATION)) #false positives (never infected, prior) by steps in quarantine
+        self.section_level = 0.0 #mean section infection level, 0-10 like GridManager
+        self.last_productivity = 0.0
+
+        # Cleaning and testing timing mirrors GridManager and TestingManager
+        self.current_cleaning = self.initial_cleaning
+        self.cleaning_steps_remaining = 0
+        self.next_cleaning = {level: schedule['frequency'] for level, schedule in CLEANING_SCHEDULE.items()}
+        self.next_test_steps = {level: 0 for level in TESTING_LEVELS}
+        self.impact_duration_remaining = 0
+        self.current_test_impact = 0
+
+        self.swab_testing_counter = {"none": 0, "light": 0, "medium": 0, "heavy": 0}
+        self.cleaning_counter = {"light": 0, "medium": 0, "heavy": 0}
+        self.shifts_counter = {"1": 0, "2": 0, "3": 0, "4": 0}
+        self.mask_counter = {True: 0, False: 0}
+        self.social_distancing_counter = {True: 0, False: 0}
+        self.splitting_level_counter = {"0": 0, "1": 0, "2": 0, "3": 0}
+
+        self.last_productivity = self.calculate_productivity(1.0, 0.0)
+
+    @property
+    def num_sections(self):
+        return 2 ** self.splitting_level if self.splitting_level > 0 else 1
+
+    def count_health_status(self, status):
+        """Expected number of workers in a health status, quarantined workers included"""
+        if status == "healthy":
+            return self.susceptible + self.susceptible_prior + self.quarantined_healthy.sum()
+        if status == "infected":
+            return self.timers[:INFECTION_STEPS + 1].sum() + self.quarantined.sum()
+        if status == "recovered":
+            return self.timers[INFECTION_STEPS + 1:].sum()
+        return 0.0
+
+    def get_state(self):
+        """Same observation as factory_model.get_state"""
+        return [
+            self.count_health_status("healthy"),
+            self.count_health_status("infected"),
+            self.count_health_status("recovered"),
+            self.count_health_status("death"),
+            self.last_productivity,
+            self.current_step_in_day,
+            int(self.social_distancing),
+            int(self.mask_mandate),
+        ]
+
+    def process_cleaning(self):
+        """Returns the production multiplier of this step's cleaning and lowers the section infection level"""
+        schedule = CLEANING_SCHEDULE[self.current_cleaning]
+        if self.cleaning_steps_remaining > 0:
+            self.cleaning_steps_remaining -= 1
+        elif self.current_step_in_day == self.next_cleaning[self.current_cleaning]:
+            self.cleaning_steps_remaining = schedule['duration']
+            self.next_cleaning[self.current_cleaning] = (
+                (self.current_step_in_day + schedule['frequency']) % self.steps_per_day)
+        else:
+            return 1.0
+        self.section_level *= (1 - schedule['infection_reduction'])
+        return 1 - schedule['production_reduction']
+
+    def process_testing(self):
+        """Quarantines expected positives and returns the production multiplier of the testing impact and the
+        number of recovered false positives, who lose one step of production before being released"""
+        level = TESTING_LEVELS[self.test_lvl]
+        recovered_positives = 0.0
+        if self.test_lvl != 'none' and self.current_step_in_day == self.next_test_steps[self.test_lvl]:
+            self.next_test_steps[self.test_lvl] = (self.current_step_in_day + level['frequency']) % self.steps_per_day
+            proportion = level['proportion']
+            positives = self.timers[:INFECTION_STEPS + 1] * proportion * (1 - FALSE_NEGATIVE_RATE)
+            self.timers[:INFECTION_STEPS + 1] -= positives
+            self.quarantined += positives
+
+            false_positives = np.array([self.susceptible, self.susceptible_prior]) * proportion * FALSE_POSITIVE_RATE
+            self.susceptible -= false_positives[0]
+            self.susceptible_prior -= false_positives[1]
+            self.quarantined_healthy[:, 0] += false_positives
+            recovered_positives = self.timers[INFECTION_STEPS + 1:].sum() * proportion * FALSE_POSITIVE_RATE
+
+            self.impact_duration_remaining = level['impact_duration']
+            self.current_test_impact = level['productivity_impact']
+
+        if self.impact_duration_remaining > 0:
+            self.impact_duration_remaining -= 1
+            return 1 - self.current_test_impact, recovered_positives
+        return 1.0, recovered_positives
+
+    def process_quarantine(self):
+        """Releases false positives once they have served the quarantine duration"""
+        released = self.quarantined_healthy[:, -1].copy()
+        self.quarantined_healthy[:, 1:] = self.quarantined_healthy[:, :-1].copy()
+        self.quarantined_healthy[:, 0] = 0.0
+        self.susceptible += released[0]
+        self.susceptible_prior += released[1]
+
+    def transmission(self):
+        """Expected new infections this step from free infected workers"""
+        infected = self.timers[:INFECTION_STEPS + 1].sum()
+        section_probability = 0.8 * min(1.0 + self.section_level * 0.1, 2.0) #GridManager.get_infection_probability
+        modifier = MASK_TRANSMISSION_FACTOR if self.mask_mandate else 1.0
+        modifier *= DISTANCING_TRANSMISSION_FACTOR if self.social_distancing else 1.0
+
+        hazard = (self.params["beta"] * CONTACT_WEIGHT * modifier * section_probability *
+                  infected ** self.params["alpha"] / (self.width * self.height))
+        new_naive = self.susceptible * -np.expm1(-hazard)
+        new_prior = self.susceptible_prior * -np.expm1(-hazard * PRIOR_INFECTION_FACTOR)
+        self.susceptible -= new_naive
+        self.susceptible_prior -= new_prior
+
+        #Every sick worker raises the infection level of its section, capped at 10
+        self.section_level = min(self.section_level + (infected + new_naive + new_prior) / self.num_sections, 10.0)
+        return new_naive + new_prior
+
+    def progress(self, new_infections):
+        """Advances every infection_time by one step (worker_agent.update_infection)"""
+        recovered_again = self.timers[-1]
+        self.timers[1:] = self.timers[:-1].copy()
+        self.timers[0] = new_infections
+        self.susceptible_prior += recovered_again
+
+        leaving_quarantine = self.quarantined[-1]
+        self.quarantined[1:] = self.quarantined[:-1].copy()
+        self.quarantined[0] = 0.0
+        self.timers[INFECTION_STEPS + 1] += leaving_quarantine #recovered agents are released from quarantine
+
+        #worker_agent.introduce_infection keeps at least one infected worker in the factory
+        missing = 1.0 - self.count_health_status("infected")
+        if missing > 0 and self.susceptible + self.susceptible_prior > 0:
+            healthy = self.susceptible + self.susceptible_prior
+            self.timers[0] += missing
+            self.susceptible -= missing * self.susceptible / healthy
+            self.susceptible_prior -= missing * self.susceptible_prior / healthy
+
+    def calculate_productivity(self, step_factor, lost_recovered):
+        """Expected sum of current_production over the workforce (StatsCollector.calculate_productivity)"""
+        output = (
+            (self.susceptible + self.susceptible_prior) * HEALTH_PRODUCTION["healthy"] +
+            self.timers[:INFECTION_STEPS + 1].sum() * HEALTH_PRODUCTION["infected"] +
+            (self.timers[INFECTION_STEPS + 1:].sum() - lost_recovered) * HEALTH_PRODUCTION["recovered"]
+        )
+        output *= SHIFT_PENALTIES.get(self.shifts_per_day, 1.0)
+        output *= SPLITTING_LEVEL_PENALTIES.get(self.splitting_level, 1.0)
+        if self.mask_mandate:
+            output *= MASK_PRODUCTION_FACTOR
+        if self.social_distancing:
+            output *= DISTANCING_PRODUCTION_FACTOR
+        return output * step_factor
+
+    def step(self, action=None):
+        """Processes a single step, returns the same results dictionary as factory_model.step"""
+        self.current_step += 1
+        self.current_step_in_day = self.current_step % self.steps_per_day
+        if self.current_step_in_day == 0:
+            self.current_day += 1
+
+        cleaning_factor = self.process_cleaning()
+        testing_factor, recovered_positives = self.process_testing()
+        self.process_quarantine()
+
+        pre_step_infected = self.count_health_status("infected")
+        self.progress(self.transmission())
+        post_step_infected = self.count_health_status("infected")
+        new_infections = max(0.0, post_step_infected - pre_step_infected)
+
+        self.last_productivity = self.calculate_productivity(cleaning_factor * testing_factor, recovered_positives)
+        return {
+            'day': self.current_day,
+            'step_in_day': self.current_step_in_day,
+            'new_infections': new_infections,
+            'total_infected': post_step_infected,
+            'productivity': self.last_productivity,
+            'quarantined': self.quarantined.sum() + self.quarantined_healthy.sum(),
+            'base_production': self.last_productivity,
+            'infection_penalty': -2.0 * (new_infections / self.num_agents),
+        }
+
+    def update_config(self, action_dict):
+        """Same action dictionary as factory_model.update_config"""
+        if "cleaning_type" in action_dict:
+            self.initial_cleaning = action_dict["cleaning_type"]
+            self.current_cleaning = action_dict["cleaning_type"]
+            self.cleaning_steps_remaining = 0
+            self.cleaning_counter[action_dict["cleaning_type"]] += 1
+        if "splitting_level" in action_dict:
+            if action_dict["splitting_level"] != self.splitting_level:
+                self.section_level = 0.0 #GridManager resets section levels when the floor is re-split
+            self.splitting_level = action_dict["splitting_level"]
+            self.splitting_level_counter[str(action_dict["splitting_level"])] += 1
+        if "testing_level" in action_dict:
+            if action_dict["testing_level"] not in TESTING_LEVELS:
+                raise ValueError("Invalid testing level")
+            self.test_lvl = action_dict["testing_level"]
+            self.swab_testing_counter[action_dict["testing_level"]] += 1
+        if "social_distancing" in action_dict:
+            self.social_distancing = action_dict["social_distancing"]
+            self.social_distancing_counter[action_dict["social_distancing"]] += 1
+        if "mask_mandate" in action_dict:
+            self.mask_mandate = action_dict["mask_mandate"]
+            self.mask_counter[action_dict["mask_mandate"]] += 1
+        if "shifts_per_day" in action_dict:
+            self.shifts_per_day = action_dict["shifts_per_day"]
+            self.steps_per_shift = self.steps_per_day // self.shifts_per_day
+            self.shifts_counter[str(action_dict["shifts_per_day"])] += 1
@@ -0,0 +1,187 @@
+"""Headless replacements for the parts of Mesa the factory model uses: Model, Agent, MultiGrid, RandomActivation
+and DataCollector. They keep Mesa 2.4's semantics where the simulation depends on them (how the model's
+random generator is seeded, agent order in the schedule and in grid cells, neighbourhood order, toroidal
+moves), so seeded runs are identical to the Mesa-based model. Importing this module does not import Mesa.
+MesaAdapter.py exposes a headless model to Mesa's visualization server."""
+import itertools
+import random
+
+
+class Model:
+    """Base model. Like Mesa, the random generator is created before __init__ runs, from the seed keyword
+    argument of the constructor or, without one, from a draw of the global random module."""
+    def __new__(cls, *args, **kwargs):
+        obj = object.__new__(cls)
+        obj._seed = kwargs.get("seed")
+        if obj._seed is None:
+            obj._seed = random.random()
+        obj.random = random.Random(obj._seed)
+        return obj
+
+    def __init__(self, *args, **kwargs):
+        self.running = True
+        self.schedule = None
+        self.current_id = 0
+
+    def next_id(self):
+        self.current_id += 1
+        return self.current_id
+
+    def reset_randomizer(self, seed=None):
+        if seed is None:
+            seed = self._seed
+        self.random.seed(seed)
+        self._seed = seed
+
+
+class Agent:
+    """Base agent with an id, its model and a grid position. Agents are not registered with the model, the
+    schedule holds the only reference."""
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+
+    @property
+    def random(self):
+        return self.model.random
+
+    def step(self):
+        pass
+
+
+class RandomActivation:
+    """Schedule that keeps agents in insertion order. agents returns a copy, so callers may add or remove
+    agents while iterating it."""
+    def __init__(self, model):
+        self.model = model
+        self.steps = 0
+        self.time = 0
+        self._agents = {}
+
+    def add(self, agent):
+        if agent in self._agents:
+            raise ValueError("agent already added to scheduler")
+        self._agents[agent] = None
+
+    def remove(self, agent):
+        del self._agents[agent]
+
+    @property
+    def agents(self):
+        return list(self._agents)
+
+    def get_agent_count(self):
+        return len(self._agents)
+
+    def step(self):
+        """Steps every agent once in random order"""
+        agents = list(self._agents)
+        self.model.random.shuffle(agents)
+        for agent in agents:
+            if agent in self._agents:
+                agent.step()
+        self.steps += 1
+        self.time += 1
+
+
+class MultiGrid:
+    """Rectangular grid where a cell holds any number of agents, in the order they were placed"""
+    def __init__(self, width, height, torus):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.num_cells = width * height
+        self._grid = [[[] for _ in range(height)] for _ in range(width)]
+        self._neighborhood_cache = {}
+
+    def out_of_bounds(self, pos):
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def torus_adj(self, pos):
+        if not self.out_of_bounds(pos):
+            return pos
+        if not self.torus:
+            raise Exception("Point out of bounds, and space non-toroidal.")
+        return pos[0] % self.width, pos[1] % self.height
+
+    def place_agent(self, agent, pos):
+        x, y = pos
+        if agent.pos is None or agent not in self._grid[x][y]:
+            self._grid[x][y].append(agent)
+            agent.pos = pos
+
+    def remove_agent(self, agent):
+        x, y = agent.pos
+        self._grid[x][y].remove(agent)
+        agent.pos = None
+
+    def move_agent(self, agent, pos):
+        pos = self.torus_adj(pos)
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def is_cell_empty(self, pos):
+        x, y = pos
+        return not self._grid[x][y]
+
+    def iter_cell_list_contents(self, cell_list):
+        if isinstance(cell_list, tuple) and len(cell_list) == 2 and isinstance(cell_list[0], int):
+            cell_list = [cell_list] #a single position, like Mesa's accept_tuple_argument
+        return itertools.chain.from_iterable(self._grid[x][y] for x, y in cell_list)
+
+    def get_cell_list_contents(self, cell_list):
+        return list(self.iter_cell_list_contents(cell_list))
+
+    def get_neighborhood(self, pos, moore, include_center=False, radius=1):
+        """Cells around pos in the same order as Mesa, cached per position"""
+        cache_key = (pos, moore, include_center, radius)
+        neighborhood = self._neighborhood_cache.get(cache_key)
+        if neighborhood is not None:
+            return neighborhood
+        if self.out_of_bounds(pos):
+            raise Exception("The `pos` tuple passed is out of bounds.")
+
+        cells = {} #dict keeps insertion order and drops the duplicates torus wrapping creates
+        x, y = pos
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if not moore and abs(dx) + abs(dy) > radius:
+                    continue
+                new_x, new_y = x + dx, y + dy
+                if self.torus:
+                    new_x %= self.width
+                    new_y %= self.height
+                if not self.out_of_bounds((new_x, new_y)):
+                    cells[(new_x, new_y)] = True
+        if not include_center:
+            cells.pop(pos, None)
+
+        neighborhood = tuple(cells)
+        self._neighborhood_cache[cache_key] = neighborhood
+        return neighborhood
+
+    def coord_iter(self):
+        for x in range(self.width):
+            for y in range(self.height):
+                yield self._grid[x][y], (x, y)
+
+
+class DataCollector:
+    """Model-level reporters only. Every collect appends one value per reporter to model_vars, which is what
+    Mesa's ChartModule reads."""
+    def __init__(self, model_reporters=None):
+        self.model_reporters = dict(model_reporters or {})
+        self.model_vars = {name: [] for name in self.model_reporters}
+
+    def collect(self, model):
+        for name, reporter in self.model_reporters.items():
+            if isinstance(reporter, str):
+                self.model_vars[name].append(getattr(model, reporter))
+            else:
+                self.model_vars[name].append(reporter(model))
+
+    def get_model_vars_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.model_vars)
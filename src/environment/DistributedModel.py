@@ -0,0 +1,312 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import multiprocessing
+import multiprocessing.connection
+import threading
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+from src.environment.VectorizedModel import HEALTH_STATES, load_kernels, vectorized_model
+from src.environment.WorkerAgent import (BASE_INFECTION_PROBABILITIES, DISTANCING_TRANSMISSION_FACTOR,
+                                         HEALTH_PRODUCTION, INFECTION_STEPS, MASK_TRANSMISSION_FACTOR,
+                                         PRIOR_INFECTION_FACTOR, RECOVERY_STEPS)
+from src.environment.kernels.NumpyKernels import HEALTHY, INFECTED
+
+#Transmission reaches 3 cells (Manhattan), and a move reads at most 3 columns past a stripe: the 2x2
+#workspace plus the 5x5 window of social distancing
+HALO = 3
+#Stripes moving at the same time are one stripe apart, at least this wide their halos never overlap
+MIN_STRIPE_WIDTH = 2 * HALO
+MAX_SECTIONS = 8
+
+#Arrays of vectorized_model that the stripe processes read or write, kept in shared memory
+SHARED_ARRAYS = ("x", "y", "base_x", "base_y", "x_start", "x_end", "health", "infection_time", "had_covid",
+                 "quarantined", "current_production", "section_of_x", "occupancy")
+
+#Barrier phases of a step: start, even stripes moved, odd stripes moved, halos published, done
+PHASES = 5
+STEP, STOP = 0, 1
+BARRIER_TIMEOUT = 300 #the first step also waits for the stripe processes to start
+
+
+class SharedArrays:
+    """Named numpy arrays laid out in one shared memory block. specs is a list of (name, shape, dtype);
+    without a name a new block is created, with one an existing block is attached."""
+    def __init__(self, specs, name=None):
+        self.specs = specs
+        offsets = []
+        size = 0
+        for _, shape, dtype in specs:
+            offsets.append(size)
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+            size += -size % 8 #keep every array 8-byte aligned
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 8))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.arrays = {array_name: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+                       for (array_name, shape, dtype), offset in zip(specs, offsets)}
+
+    def close(self):
+        #drop the numpy views first, SharedMemory cannot close while they export its buffer
+        self.arrays = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class StripeWorker:
+    """One stripe process: the columns x0 to x1 of the floor, and read access to HALO columns on each side.
+
+    Moves are done by the stripe of a worker's base position. Its workspace is base_x and base_x + 1, so a
+    move touches at most one column past the stripe. Transmission, infection timers and production are done
+    by the stripe of the worker's current cell. Each stripe writes the infected workers on its cells to the
+    shared infection grid, and after the halo barrier reads the neighbours' halo strips of it, so infections
+    reach across stripe borders exactly as on one floor."""
+    def __init__(self, stripe, bounds, shared, backend, seed_sequence, width, height):
+        self.stripe = stripe
+        self.x0, self.x1 = bounds[stripe], bounds[stripe + 1]
+        self.w0, self.w1 = max(0, self.x0 - HALO), min(width, self.x1 + HALO)
+        self.height = height
+        self.arrays = shared.arrays
+        _, self.kernels = load_kernels(backend)
+        self.rng = np.random.default_rng(seed_sequence)
+        self.distance_probability = np.array([BASE_INFECTION_PROBABILITIES[d] for d in range(4)])
+        self.health_production = np.array([HEALTH_PRODUCTION[s] for s in ("healthy", "infected", "recovered", "death")])
+        self.mine = None
+
+    def move(self, distancing):
+        a = self.arrays
+        x, y, base_x = a["x"], a["y"], a["base_x"]
+        movers = np.flatnonzero(a["movers"] & (base_x >= self.x0) & (base_x < self.x1))
+        movers = movers[(x[movers] >= self.w0) & (x[movers] < self.w1)] #a worker stranded past the halo waits
+        if len(movers) == 0:
+            return
+        window = self.w1 - self.w0
+        local_x = x[movers] - self.w0
+        local_y = y[movers]
+        #a section corner past the halo (the fallback cell of a boxed in worker) is clipped to the halo
+        self.kernels.move(local_x, local_y, base_x[movers] - self.w0, a["base_y"][movers],
+                          np.clip(a["x_start"][movers] - self.w0, 0, window - 1),
+                          np.clip(a["x_end"][movers] - self.w0, 0, window), np.ones(len(movers), dtype=bool),
+                          a["occupancy"][self.w0:self.w1], distancing, self.rng.random((len(movers), 4)),
+                          self.rng.permutation(len(movers)))
+        x[movers] = local_x + self.w0
+        y[movers] = local_y
+
+    def publish_sources(self):
+        """Writes the stripe's infected workers on the floor to the infection grid and counts them by section"""
+        a = self.arrays
+        x = a["x"]
+        self.mine = np.flatnonzero((x >= self.x0) & (x < self.x1))
+        sources = self.mine[~a["quarantined"][self.mine] & (a["health"][self.mine] == INFECTED)]
+        cells = a["infected_cells"]
+        cells[self.x0:self.x1] = 0
+        np.add.at(cells, (x[sources], a["y"][sources]), 1)
+        a["source_counts"][self.stripe] = np.bincount(a["section_of_x"][x[sources]], minlength=MAX_SECTIONS)
+
+    def spread(self, modifier, production_factor):
+        """Transmission from every infected worker within the halo, then timers and production"""
+        a = self.arrays
+        x, y, health, had_covid = a["x"], a["y"], a["health"], a["had_covid"]
+        mine = self.mine
+        levels = np.minimum(a["levels"] + a["source_counts"].sum(axis=0), 10)
+        section_probability = 0.8 * np.minimum(1.0 + levels * 0.1, 2.0)
+
+        #the infection grid of the stripe and its halo, one entry per infected worker
+        window = a["infected_cells"][self.w0:self.w1]
+        source_x, source_y = np.nonzero(window)
+        counts = window[source_x, source_y]
+        source_x, source_y = np.repeat(source_x, counts), np.repeat(source_y, counts)
+        targets = mine[~a["quarantined"][mine] & (health[mine] == HEALTHY)]
+        k = len(targets)
+        infected = self.kernels.transmit(
+            np.concatenate([x[targets] - self.w0, source_x]), np.concatenate([y[targets], source_y]),
+            np.concatenate([np.full(k, HEALTHY, dtype=health.dtype), np.full(len(source_x), INFECTED, dtype=health.dtype)]),
+            np.concatenate([had_covid[targets], np.zeros(len(source_x), dtype=bool)]),
+            np.ones(k + len(source_x), dtype=bool), a["section_of_x"][self.w0:self.w1], section_probability,
+            self.distance_probability, modifier, PRIOR_INFECTION_FACTOR,
+            np.concatenate([self.rng.random(k), np.ones(len(source_x))]), self.w1 - self.w0, self.height)
+        newly_infected = targets[infected[:k]]
+
+        stripe_health = health[mine]
+        infection_time = a["infection_time"][mine]
+        stripe_had_covid = had_covid[mine]
+        self.kernels.progress(stripe_health, infection_time, stripe_had_covid, INFECTION_STEPS, RECOVERY_STEPS)
+        health[mine] = stripe_health
+        a["infection_time"][mine] = infection_time
+        had_covid[mine] = stripe_had_covid
+        health[newly_infected] = INFECTED
+        had_covid[newly_infected] = True
+        a["new_counts"][self.stripe] = np.bincount(a["section_of_x"][x[newly_infected]], minlength=MAX_SECTIONS)
+
+        production = np.empty(len(mine))
+        quarantined = a["quarantined"][mine]
+        self.kernels.production(health[mine], quarantined, self.health_production, production_factor, production)
+        a["current_production"][mine] = production
+        a["totals"][self.stripe] = np.concatenate([np.bincount(health[mine], minlength=4)[:4],
+                                                   [production.sum(), quarantined.sum()]])
+
+
+def run_stripe(stripe, bounds, name, specs, barrier, backend, seed_sequence, width, height):
+    """Stripe process entry point. Steps in lockstep with the model through the barrier until told to stop."""
+    shared = SharedArrays(specs, name)
+    worker = StripeWorker(stripe, bounds, shared, backend, seed_sequence, width, height)
+    control = shared.arrays["control"]
+    try:
+        while True:
+            barrier.wait()
+            if control[0] == STOP:
+                break
+            for colour in (0, 1):
+                if stripe % 2 == colour:
+                    worker.move(bool(control[1]))
+                barrier.wait()
+            worker.publish_sources()
+            barrier.wait()
+            worker.spread(control[2], control[3])
+            barrier.wait()
+    finally:
+        worker.arrays = None
+        shared.close()
+
+
+class StripePool:
+    """The stripe processes of one model and the shared memory they work on"""
+    def __init__(self, shared, bounds, backend, seed, width, height):
+        context = multiprocessing.get_context("spawn")
+        self.shared = shared
+        self.barrier = context.Barrier(len(bounds)) #every stripe and the model
+        seeds = np.random.SeedSequence(seed).spawn(len(bounds) - 1)
+        self.processes = [context.Process(target=run_stripe, daemon=True,
+                                          args=(stripe, bounds, shared.name, shared.specs, self.barrier, backend,
+                                                seeds[stripe], width, height))
+                          for stripe in range(len(bounds) - 1)]
+        for process in self.processes:
+            process.start()
+        self.closed = False
+        threading.Thread(target=self.watch, daemon=True).start()
+
+    def watch(self):
+        """Breaks the barrier as soon as a stripe process exits, so the model fails instead of waiting for
+        a process that will never arrive"""
+        multiprocessing.connection.wait([process.sentinel for process in self.processes])
+        if not self.closed:
+            self.barrier.abort()
+
+    def wait(self):
+        try:
+            self.barrier.wait(timeout=BARRIER_TIMEOUT)
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A stripe process of the distributed model exited or stopped responding")
+
+    def step(self):
+        for _ in range(PHASES):
+            self.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if all(process.is_alive() for process in self.processes):
+            self.shared.arrays["control"][0] = STOP
+            try:
+                self.wait()
+            except RuntimeError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.shared.close()
+        self.shared.unlink()
+
+
+class distributed_model(vectorized_model):
+    """vectorized_model of one large floor stepped by several processes, each owning a contiguous stripe of
+    columns (StripeWorker). The per-worker arrays and the occupancy grid live in shared memory.
+
+    The model process keeps the floor wide logic of vectorized_model: cleaning, testing, quarantine, shift
+    changes, re-splitting and stale workspaces. The stripes do the per-worker work in parallel. Even stripes
+    move first and odd stripes after them, so two stripes never write the same cells. Section infection
+    levels and the population counts behind get_state are merged from per-stripe sums (a reduction) instead
+    of scanning every worker. Results match the serial engine statistically, not draw for draw: every
+    stripe has its own random stream, workers at a stripe border move after their neighbours in the other
+    stripe instead of at the same time, and a boxed in worker whose section corner is beyond the halo falls
+    back to the edge of the halo. Call close(), or let the model be garbage collected, to stop the
+    processes."""
+    def __init__(self, width, height, N, visualization=False, config=None, seed=None, backend="auto",
+                 processes=None):
+        super(distributed_model, self).__init__(width, height, N, visualization, config, seed, backend)
+        processes = max(1, min(processes or os.cpu_count(), self.width // MIN_STRIPE_WIDTH))
+        self.bounds = np.linspace(0, self.width, processes + 1).astype(int).tolist()
+        specs = [(name, getattr(self, name).shape, getattr(self, name).dtype.str) for name in SHARED_ARRAYS]
+        specs += [("movers", (self.num_agents,), "|b1"), ("infected_cells", self.occupancy.shape, "<i4"),
+                  ("levels", (MAX_SECTIONS,), "<f8"), ("control", (4,), "<f8"),
+                  ("source_counts", (processes, MAX_SECTIONS), "<f8"),
+                  ("new_counts", (processes, MAX_SECTIONS), "<f8"), ("totals", (processes, 6), "<f8")]
+        self.shared = SharedArrays(specs)
+        self.share()
+        self.pool = StripePool(self.shared, self.bounds, self.backend, seed, self.width, self.height)
+        self.finalizer = weakref.finalize(self, self.pool.close)
+        self.health_totals = np.bincount(self.health, minlength=4)[:4]
+        self.production_total = float(self.current_production.sum())
+
+    @property
+    def processes(self):
+        return len(self.bounds) - 1
+
+    def close(self):
+        self.finalizer()
+
+    def share(self):
+        """Points the arrays the stripes use back at shared memory, copying the ones vectorized_model
+        replaced (it rebuilds the section bounds whenever workers change section)"""
+        for name in SHARED_ARRAYS:
+            shared = self.shared.arrays[name]
+            if getattr(self, name) is not shared:
+                shared[...] = getattr(self, name)
+                setattr(self, name, shared)
+
+    def count_health_status(self, status):
+        return int(self.health_totals[HEALTH_STATES[status]])
+
+    def calculate_productivity(self):
+        return self.production_total
+
+    def process_agent_steps(self, step_factor):
+        self.share()
+        a = self.shared.arrays
+        on_grid = ~self.quarantined
+        a["movers"][:] = on_grid & ~self.rebase_stale_workers(on_grid)
+        levels = self.section_infection_levels
+        a["levels"][:] = 0
+        a["levels"][:len(levels)] = levels
+        modifier = (MASK_TRANSMISSION_FACTOR if self.mask_mandate else 1.0) * \
+                   (DISTANCING_TRANSMISSION_FACTOR if self.social_distancing else 1.0)
+        production_factor = self.policy_production_factor() * step_factor
+        a["control"][:] = (STEP, bool(self.social_distancing), modifier, production_factor)
+        self.pool.step()
+
+        levels += a["source_counts"].sum(axis=0)[:len(levels)]
+        np.minimum(levels, 10, out=levels)
+        levels += a["new_counts"].sum(axis=0)[:len(levels)]
+        np.minimum(levels, 10, out=levels)
+        totals = a["totals"].sum(axis=0)
+        self.health_totals = totals[:4].astype(np.int64)
+        self.production_total = float(totals[4])
+
+        #worker_agent.introduce_infection keeps at least one infected worker in the factory
+        if self.health_totals[INFECTED] == 0 and self.health_totals[HEALTHY] > 0:
+            worker = self.rng.choice(np.flatnonzero(self.health == HEALTHY))
+            self.health[worker] = INFECTED
+            self.health_totals[HEALTHY] -= 1
+            self.health_totals[INFECTED] += 1
+            if not self.quarantined[worker]:
+                self.production_total -= self.current_production[worker]
+                self.current_production[worker] = self.health_production[INFECTED] * production_factor
+                self.production_total += self.current_production[worker]
@@ -1,3 +1,5 @@
+import itertools
+
 class FactoryConfig:
     """Class that handles the configuration for the simulation. Has base
       visualization and base rl visualizations that can be changed"""
@@ -61,4 +63,34 @@ class FactoryConfig:
             self.mask_mandate = mask_map[action_dict['mask_mandate']]
         if 'shifts' in action_dict:
             self.shifts_per_day = shifts_map[action_dict['shifts']]
-            self.steps_per_shift = self.steps_per_day // self.shifts_per_day
\ No newline at end of file
+            self.steps_per_shift = self.steps_per_day // self.shifts_per_day
+
+#Policy levers the RL agent and the evaluation tools choose between
+CLEANING_OPTIONS = ['light', 'medium', 'heavy']
+SPLITTING_OPTIONS = [0, 1, 2, 3]  # none, half, quarter, eighth
+TESTING_OPTIONS = ['none', 'light', 'medium', 'heavy']
+SOCIAL_DISTANCING_OPTIONS = [False, True]
+MASK_MANDATE_OPTIONS = [False, True]
+SHIFTS_OPTIONS = [1, 2, 3, 4]
+
+
+def build_action_space():
+    """Returns every combination of the policy levers as update_config action dictionaries (768 actions)"""
+    return [
+        {
+            'cleaning_type': cleaning,
+            'splitting_level': splitting,
+            'testing_level': testing,
+            'social_distancing': social_distancing,
+            'mask_mandate': mask_mandate,
+            'shifts_per_day': shifts
+        }
+        for cleaning, splitting, testing, social_distancing, mask_mandate, shifts in itertools.product(
+            CLEANING_OPTIONS,
+            SPLITTING_OPTIONS,
+            TESTING_OPTIONS,
+            SOCIAL_DISTANCING_OPTIONS,
+            MASK_MANDATE_OPTIONS,
+            SHIFTS_OPTIONS
+        )
+    ]
@@ -5,21 +5,25 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'
 
 
 import random
-from mesa import Model
-from mesa.space import MultiGrid
-from mesa.time import RandomActivation
-from mesa.datacollection import DataCollector
+from src.environment.Core import DataCollector, Model, MultiGrid, RandomActivation
 from src.environment.WorkerAgent import worker_agent
 from src.environment.infection_control.Quarantine import QuarantineManager
 from src.environment.FactoryConfig import FactoryConfig
 from src.environment.GridManager import GridManager
 from src.environment.Stats import StatsCollector
+from src.environment.Profiler import StepProfiler
+from src.environment.Recording import RunRecorder
 from src.environment.infection_control.SwabTesting import TestingManager
 
+#Bump when a change alters simulation results so cached runs are not reused across engine versions
+ENGINE_VERSION = 1
+
 class factory_model(Model):
     """Main class model that sets up the environment with provided parameters and agents"""
-    def __init__(self, width, height, N, visualization=False, config=None):
+    def __init__(self, width, height, N, visualization=False, config=None, seed=None):
         super().__init__()
+        if seed is not None: #Mesa seeds self.random from the seed kwarg, agents also draw from the global random module
+            random.seed(seed)
         if config is None:
             config = FactoryConfig(
                 width=width,
@@ -58,6 +62,9 @@ class factory_model(Model):
         self.current_step_in_day = 0
         self.current_day = 0
         self.current_shift = 0 
+
+        self.profiler = None #StepProfiler while profiling is enabled
+        self.recorder = None #RunRecorder while recording
             
         self.initialize_agents()
         self.initialize_datacollector()
@@ -128,8 +135,46 @@ class factory_model(Model):
         """Check if shift change should occur"""
         return self.current_step_in_day == self.next_shift_change
 
+    def enable_profiling(self, dump_path=None, dump_every=1000):
+        """Starts recording per-phase step times and event counters. With a dump_path the metrics are written
+        to that file every dump_every steps."""
+        if self.profiler is None:
+            self.profiler = StepProfiler(self, dump_path, dump_every)
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stops profiling, writing a final dump if a dump path was set, and returns the last metrics"""
+        if self.profiler is None:
+            return None
+        profiler, self.profiler = self.profiler, None
+        profiler.detach()
+        if profiler.dump_path:
+            profiler.dump()
+        return profiler.metrics()
+
+    def get_metrics(self):
+        """Profiling metrics since the last reset, None when profiling is disabled"""
+        return self.profiler.metrics() if self.profiler is not None else None
+
+    def enable_recording(self, path, keyframe_every=240):
+        """Starts recording the run to the directory path (see Recording.py). The current state becomes
+        frame 0 and every step adds a frame."""
+        if self.recorder is None:
+            self.recorder = RunRecorder(self, path, keyframe_every)
+        return self.recorder
+
+    def disable_recording(self):
+        """Stops recording and finalizes the recording, returning its path"""
+        if self.recorder is None:
+            return None
+        recorder, self.recorder = self.recorder, None
+        return recorder.close()
+
     def step(self, action=None):
         """Processes a single step in the model."""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_step()
         self.current_step += 1
         self.current_step_in_day = self.current_step % self.steps_per_day 
 
@@ -139,6 +184,8 @@ class factory_model(Model):
         self.process_scheduled_events()  # Runs all scheduled events for the current step
 
         pre_step_infected = self.stats.count_health_status("infected")
+        if profiler is not None:
+            profiler.lap("stats")
         self._process_agent_steps()  # Processes all agents' actions during this step
         post_step_infected = self.stats.count_health_status("infected")
 
@@ -147,30 +194,53 @@ class factory_model(Model):
 
         if self.current_step_in_day == self.steps_per_day - 1:
             self.stats.process_day_end()
+        if profiler is not None:
+            profiler.lap("stats")
 
         self.datacollector.collect(self)
+        if profiler is not None:
+            profiler.lap("datacollection")
 
         # Return results for training and visualization
-        return self._get_step_results(new_infections, post_step_infected)
+        results = self._get_step_results(new_infections, post_step_infected)
+        if profiler is not None:
+            profiler.lap("stats")
+            profiler.count("new_infections", new_infections)
+            profiler.end_step()
+        if self.recorder is not None:
+            self.recorder.capture()
+        return results
 
         
     def _process_agent_steps(self):
         """Method to call each agent to get them to move in the environment for a step"""
+        profiler = self.profiler
         for agent in self.schedule.agents:
             if self.social_distancing and agent.pos is not None: #if social distancing is on call this function before step
                 self.grid_manager.move_agent_social_distance(agent)
+                if profiler is not None:
+                    profiler.lap("distancing")
             agent.step() #step function in the agent class
     
     def process_scheduled_events(self):
         """Process all scheduled events in the correct order"""
+        profiler = self.profiler
         self.grid_manager.process_cleaning(self.current_step_in_day) #Call to process cleaning if correct day
+        if profiler is not None:
+            profiler.lap("cleaning")
         self.testing.process_testing(self.test_lvl)#If its a testing step, call the processing testing method in testing class
+        if profiler is not None:
+            profiler.lap("testing")
             
         self.quarantine.process_quarantine() #If an agent tests positive for the infection, throw them in quarantine, if they are ready to be taken out do that.
+        if profiler is not None:
+            profiler.lap("quarantine")
         
         if self.should_change_shift(): #Checks if we are on a shift change step.
             self.grid_manager.process_shift_change() #Processes the shift change in the grid manager class.
             self.next_shift_change = (self.current_step_in_day + self.steps_per_shift) % self.steps_per_day #Calculates the next shift change
+            if profiler is not None:
+                profiler.lap("shift_change")
 
     def get_steps_per_shift(self):
         """Helper function to get the steps per shift"""
@@ -0,0 +1,130 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import numpy as np
+from multiprocessing import shared_memory
+from src.environment.kernels.NumpyKernels import DEATH, HEALTHY, INFECTED, RECOVERED
+
+#Cell codes of a frame raster, the top layer of the visualization portrayals: an occupied cell shows the
+#highest code among its workers, so an infected worker is not hidden by a healthy one sharing its cell
+EMPTY = 0
+CELL_CODES = {"healthy": 1, "infected": 2, "recovered": 3, "death": 4}
+#Series streamed with every frame, from get_state() and the step results of either engine
+CHART_SERIES = ("Healthy", "Infected", "Recovered", "Death", "Quarantined", "Productivity")
+
+_VECTOR_CODES = np.zeros(max(HEALTHY, INFECTED, RECOVERED, DEATH) + 1, dtype=np.uint8)
+_VECTOR_CODES[[HEALTHY, INFECTED, RECOVERED, DEATH]] = [CELL_CODES[s] for s in ("healthy", "infected",
+                                                                                 "recovered", "death")]
+
+
+def cell_raster(model, out):
+    """Writes the model's floor into out, a uint8 array of shape (height, width) holding CELL_CODES.
+    Works with factory_model (agents on a grid) and vectorized_model (worker arrays)."""
+    out[:] = EMPTY
+    if hasattr(model, "schedule"):
+        workers = [agent for agent in model.schedule.agents if agent.pos is not None]
+        xs = np.fromiter((agent.pos[0] for agent in workers), dtype=np.intp, count=len(workers))
+        ys = np.fromiter((agent.pos[1] for agent in workers), dtype=np.intp, count=len(workers))
+        codes = np.fromiter((CELL_CODES[agent.health_status] for agent in workers), dtype=np.uint8,
+                            count=len(workers))
+    else:
+        on_grid = ~model.quarantined
+        xs, ys = model.x[on_grid], model.y[on_grid]
+        codes = _VECTOR_CODES[model.health[on_grid]]
+    np.maximum.at(out, (ys, xs), codes)
+    return out
+
+
+def chart_values(model, results):
+    state = model.get_state()
+    return state[:4] + [results["quarantined"], state[4]]
+
+
+class FrameRing:
+    """Fixed size ring of visualization frames in shared memory, written by the simulation process and read
+    by the server. The writer never waits: it overwrites the oldest slot, and a reader only ever asks for the
+    newest complete frame, so frames the server is too slow for are dropped.
+
+    Each slot holds its sequence number, the step, the chart values and the cell raster. The writer marks a
+    slot as being written (-1) before filling it and stores the sequence number after, and the reader
+    re-checks that number after copying, so a frame overwritten mid-copy is never returned torn."""
+    def __init__(self, width, height, slots=8, name=None, create=True):
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.cells = width * height
+        self.slot_bytes = 16 + 8 * len(CHART_SERIES) + self.cells
+        self.slot_bytes += -self.slot_bytes % 8 #keep every slot's header 8-byte aligned
+        size = 8 + slots * self.slot_bytes
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self.latest_seq = np.ndarray(1, dtype=np.int64, buffer=buf)
+        self.slot_header = []
+        self.slot_charts = []
+        self.slot_cells = []
+        for slot in range(slots):
+            offset = 8 + slot * self.slot_bytes
+            self.slot_header.append(np.ndarray(2, dtype=np.int64, buffer=buf, offset=offset))
+            self.slot_charts.append(np.ndarray(len(CHART_SERIES), dtype=np.float64, buffer=buf, offset=offset + 16))
+            self.slot_cells.append(np.ndarray((height, width), dtype=np.uint8, buffer=buf,
+                                              offset=offset + 16 + 8 * len(CHART_SERIES)))
+        if create:
+            self.latest_seq[0] = -1
+            for header in self.slot_header:
+                header[0] = -1
+
+    @classmethod
+    def attach(cls, name, width, height, slots=8):
+        return cls(width, height, slots, name=name, create=False)
+
+    def publish(self, step, charts, cells=None):
+        """Writes the next frame. Without cells the raster is expected to be already written into
+        next_cells(), which saves a copy."""
+        seq = int(self.latest_seq[0]) + 1
+        slot = seq % self.slots
+        header = self.slot_header[slot]
+        header[0] = -1
+        header[1] = step
+        self.slot_charts[slot][:] = charts
+        if cells is not None:
+            self.slot_cells[slot][:] = cells
+        header[0] = seq
+        self.latest_seq[0] = seq
+        return seq
+
+    def next_cells(self):
+        """Raster buffer of the slot the next publish() writes, to render into in place"""
+        slot = (int(self.latest_seq[0]) + 1) % self.slots
+        self.slot_header[slot][0] = -1
+        return self.slot_cells[slot]
+
+    def latest(self, cells_out, retries=4):
+        """Copies the newest frame's raster into cells_out and returns (seq, step, charts), or None when no
+        frame has been published yet or the writer kept overwriting the slot being read"""
+        for _ in range(retries):
+            seq = int(self.latest_seq[0])
+            if seq < 0:
+                return None
+            slot = seq % self.slots
+            header = self.slot_header[slot]
+            if header[0] != seq:
+                continue
+            step = int(header[1])
+            charts = self.slot_charts[slot].tolist()
+            cells_out[:] = self.slot_cells[slot]
+            if header[0] == seq:
+                return seq, step, charts
+        return None
+
+    def close(self):
+        #drop the numpy views first, SharedMemory cannot close while they export its buffer
+        self.latest_seq = self.slot_header = self.slot_charts = self.slot_cells = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
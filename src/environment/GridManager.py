@@ -1,31 +1,37 @@
+import copy
 import random
 
+#Cleaning types: how often they run (steps), how much they cut section infection levels per step,
+#how many steps they last and the productivity lost by agents in a section being cleaned
+CLEANING_SCHEDULE = {
+    'light': {
+        'frequency': 8, 
+        'infection_reduction': 0.35, 
+        'duration': 4,
+        'production_reduction': 0.05
+    },
+    'medium': {
+        'frequency': 16, 
+        'infection_reduction': 0.65, 
+        'duration': 6,
+        'production_reduction': 0.10
+    },
+    'heavy': {
+        'frequency': 16, 
+        'infection_reduction': 0.8, 
+        'duration': 6,
+        'production_reduction': 0.15
+    }
+}
+
+
 class GridManager:
     """Class that handles the "factory floor" and agent movement within this area"""
     def __init__(self, initial_splitting_level, model):
         self.model = model
         self._splitting_level = initial_splitting_level # 0 full grid, 1 half, 2 quarter, 3 eights
         self.section_boundaries = []
-        self.cleaning_schedule = {
-            'light': {
-                'frequency': 8, 
-                'infection_reduction': 0.35, 
-                'duration': 4,
-                'production_reduction': 0.05
-            },
-            'medium': {
-                'frequency': 16, 
-                'infection_reduction': 0.65, 
-                'duration': 6,
-                'production_reduction': 0.10
-            },
-            'heavy': {
-                'frequency': 16, 
-                'infection_reduction': 0.8, 
-                'duration': 6,
-                'production_reduction': 0.15
-            }
-        }
+        self.cleaning_schedule = copy.deepcopy(CLEANING_SCHEDULE)
         self.current_cleaning = self.model.initial_cleaning
         self.cleaning_steps_remaining = 0
         self.next_cleaning = { #dictionary for step intervals
@@ -144,6 +150,7 @@ class GridManager:
                         placed = True
                     break
                 attempts += 1
+            retries = attempts
 
             if not placed:
                 attempts = 0
@@ -161,10 +168,16 @@ class GridManager:
                         agent.last_section = current_section_index
                         placed = True
                     attempts += 1
+                retries += attempts - 1 if placed else attempts
 
                 if not placed:
                     self.model.grid.remove_agent(agent)
                     self.model.schedule.remove(agent)
+                    if self.model.profiler is not None:
+                        self.model.profiler.count("unplaced_agents")
+
+            if self.model.profiler is not None:
+                self.model.profiler.count("placement_retries", retries)
 
         self.model.next_shift_change = ((self.model.current_step_in_day + self.model.steps_per_shift) % self.model.steps_per_day)
             
@@ -0,0 +1,75 @@
+"""Exposes the headless factory model to Mesa's visualization server. This is the only simulation module
+that imports Mesa, and only the visualization scripts import it."""
+from mesa import Model as MesaModel
+from mesa.visualization.ModularVisualization import VisualizationElement
+from src.environment.Raster import FloorRaster
+
+
+def agent_portrayal(agent, radius=0.5):
+    """Defines how agents appear in the visualization."""
+    portrayal = {"Shape": "circle", "Filled": "true", "r": radius}
+
+    if agent.is_quarantined:
+        portrayal["Color"] = "brown"
+        portrayal["Layer"] = 5
+    elif agent.health_status == "healthy":
+        portrayal["Color"] = "green"
+        portrayal["Layer"] = 1
+    elif agent.health_status == "infected":
+        portrayal["Color"] = "red"
+        portrayal["Layer"] = 2
+    elif agent.health_status == "recovered":
+        portrayal["Color"] = "blue"
+        portrayal["Layer"] = 3
+    elif agent.health_status == "death":
+        portrayal["Color"] = "black"
+        portrayal["Layer"] = 4
+
+    return portrayal
+
+
+def mesa_view(factory):
+    """Wraps a function that builds a headless model into a Mesa model class for ModularServer. The server
+    constructs the class with the model parameters and reads grid, datacollector and any other attribute
+    (for text elements), which are all forwarded to the headless model."""
+    class MesaView(MesaModel):
+        description = factory.__doc__
+
+        def __init__(self, **model_params):
+            super().__init__()
+            self.model = factory(**model_params)
+            self.schedule = self.model.schedule
+
+        def step(self):
+            self.model.step()
+
+        def __getattr__(self, name):
+            model = self.__dict__.get("model")
+            if model is None:
+                raise AttributeError(name)
+            return getattr(model, name)
+
+    MesaView.__name__ = getattr(factory, "__name__", "MesaView")
+    return MesaView
+
+
+class RasterGrid(VisualizationElement):
+    """Drop-in alternative to CanvasGrid for large floors. Instead of one portrayal dictionary per agent it
+    sends one PNG of the floor per frame (see Raster.FloorRaster), which the browser scales to the canvas
+    size without smoothing."""
+    def __init__(self, grid_width, grid_height, canvas_width=500, canvas_height=250, **raster_options):
+        super().__init__()
+        self.raster = FloorRaster(grid_width, grid_height, **raster_options)
+        self.js_code = (
+            "elements.push(new (function (width, height) {"
+            " const image = document.createElement('img');"
+            " image.style.width = width + 'px'; image.style.height = height + 'px';"
+            " image.style.imageRendering = 'pixelated'; image.style.border = '1px solid #ccc';"
+            " document.getElementById('elements').appendChild(image);"
+            " this.render = function (data) { image.src = data; };"
+            " this.reset = function () { image.removeAttribute('src'); };"
+            f"}})({canvas_width}, {canvas_height}));"
+        )
+
+    def render(self, model):
+        return self.raster.render(model)
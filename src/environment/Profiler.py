@@ -0,0 +1,136 @@
+import json
+import os
+import time
+
+#Phases of factory_model.step in the order they run. The vectorized engines run movement through introduction
+#as one kernel, timed as agent_steps.
+PHASES = ("cleaning", "testing", "quarantine", "shift_change", "distancing", "movement", "transmission",
+          "progression", "production", "introduction", "agent_steps", "stats", "datacollection")
+COUNTERS = ("grid_lookups", "grid_moves", "placement_retries", "unplaced_agents", "tests_performed",
+            "new_infections")
+
+
+def tests_performed(model):
+    """Tests counted by factory_model's testing manager, or by a vectorized engine itself"""
+    testing = getattr(model, "testing", None)
+    return testing.tests_performed if testing is not None else model.tests_performed
+
+
+def gauges(model):
+    if hasattr(model, "schedule"):
+        return {"agents": len(model.schedule.agents), "quarantined": len(model.quarantine.quarantine_zone)}
+    return {"agents": model.num_agents, "quarantined": int(model.quarantined.sum())}
+
+
+class StepProfiler:
+    """Per-phase wall time and event counters for factory_model.step and the vectorized engines' step. The model only holds one while profiling
+    is enabled; otherwise every hook in the step is a single `is not None` check.
+
+    Phases are timed as laps: each call to lap(phase) charges the time since the previous lap to that phase,
+    so the phases of a step add up to its wall time. Grid lookups and moves are counted by wrapping the grid's
+    methods on the instance, which is undone by detach(); the vectorized engines have no grid to count."""
+    def __init__(self, model, dump_path=None, dump_every=1000):
+        self.model = model
+        self.dump_path = dump_path
+        self.dump_every = dump_every
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.steps = 0
+        self.step_seconds = 0.0
+        self.max_step_seconds = 0.0
+        self.step_start = 0.0
+        self.mark = 0.0
+        self.tests_at_reset = tests_performed(model)
+        self.attach()
+
+    def attach(self):
+        grid = getattr(self.model, "grid", None)
+        if grid is None:
+            return
+        get_cell_list_contents = grid.get_cell_list_contents
+        move_agent = grid.move_agent
+        counters = self.counters
+
+        def counted_lookup(cell_list):
+            counters["grid_lookups"] += 1
+            return get_cell_list_contents(cell_list)
+
+        def counted_move(agent, pos):
+            counters["grid_moves"] += 1
+            return move_agent(agent, pos)
+
+        grid.get_cell_list_contents = counted_lookup
+        grid.move_agent = counted_move
+
+    def detach(self):
+        """Removes the grid wrappers so the grid's own methods are used again"""
+        grid = getattr(self.model, "grid", None)
+        if grid is None:
+            return
+        for name in ("get_cell_list_contents", "move_agent"):
+            grid.__dict__.pop(name, None)
+
+    def start_step(self):
+        self.step_start = self.mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phase_seconds[phase] += now - self.mark
+        self.mark = now
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def end_step(self):
+        elapsed = time.perf_counter() - self.step_start
+        self.steps += 1
+        self.step_seconds += elapsed
+        self.max_step_seconds = max(self.max_step_seconds, elapsed)
+        if self.dump_path and self.dump_every and self.steps % self.dump_every == 0:
+            self.dump()
+
+    def reset(self):
+        """Starts a new measurement window"""
+        for phase in self.phase_seconds:
+            self.phase_seconds[phase] = 0.0
+        for counter in self.counters:
+            self.counters[counter] = 0
+        self.steps = 0
+        self.step_seconds = 0.0
+        self.max_step_seconds = 0.0
+        self.tests_at_reset = tests_performed(self.model)
+
+    def metrics(self):
+        """Totals since the last reset, plus per-step averages and each phase's share of the step time"""
+        steps = max(1, self.steps)
+        counters = dict(self.counters)
+        counters["tests_performed"] = tests_performed(self.model) - self.tests_at_reset
+        return {
+            "model_step": self.model.current_step,
+            "steps": self.steps,
+            "step_seconds": self.step_seconds,
+            "mean_step_ms": 1000 * self.step_seconds / steps,
+            "max_step_ms": 1000 * self.max_step_seconds,
+            "phases": {
+                phase: {
+                    "seconds": seconds,
+                    "mean_ms": 1000 * seconds / steps,
+                    "share": seconds / self.step_seconds if self.step_seconds else 0.0,
+                }
+                for phase, seconds in self.phase_seconds.items()
+            },
+            "counters": counters,
+            "per_step": {name: value / steps for name, value in counters.items()},
+            "gauges": gauges(self.model),
+        }
+
+    def dump(self, path=None):
+        """Writes the current metrics as JSON, replacing the file atomically so readers never see half a dump"""
+        path = path or self.dump_path
+        metrics = self.metrics()
+        metrics["timestamp"] = time.time()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(metrics, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
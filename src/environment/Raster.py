@@ -0,0 +1,143 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import base64
+import struct
+import zlib
+import numpy as np
+from src.environment.FrameBuffer import EMPTY, cell_raster
+from src.environment.kernels.NumpyKernels import INFECTED
+from src.environment.WorkerAgent import BASE_INFECTION_PROBABILITIES
+
+#RGB of each cell code (empty floor, healthy, infected, recovered, death)
+CELL_COLORS = np.array([(235, 235, 235), (46, 139, 87), (214, 39, 40), (31, 119, 180), (0, 0, 0)], dtype=np.uint8)
+EXPOSURE_COLOR = np.array([255, 140, 0], dtype=np.float32)
+BOUNDARY_COLOR = np.array([90, 90, 90], dtype=np.uint8)
+#Offsets within the transmission radius and their base probability, as used by worker_agent.infection
+EXPOSURE_KERNEL = [(dx, dy, BASE_INFECTION_PROBABILITIES[abs(dx) + abs(dy)])
+                   for dx in range(-3, 4) for dy in range(-3, 4) if abs(dx) + abs(dy) in BASE_INFECTION_PROBABILITIES]
+
+
+def infected_counts(model, out):
+    """Number of infected workers on each cell, shape (height, width)"""
+    out[:] = 0
+    if hasattr(model, "schedule"):
+        cells = [agent.pos for agent in model.schedule.agents
+                 if agent.pos is not None and agent.health_status == "infected"]
+        if cells:
+            xs, ys = np.array(cells, dtype=np.intp).T
+            np.add.at(out, (ys, xs), 1)
+    else:
+        infected = ~model.quarantined & (model.health == INFECTED)
+        np.add.at(out, (model.y[infected], model.x[infected]), 1)
+    return out
+
+
+def exposure(infected):
+    """Per cell sum of the base infection probabilities from every infected worker in range, the same
+    distance rule and floor edges as worker_agent.infection. Computed as shifted adds of the whole grid."""
+    height, width = infected.shape
+    total = np.zeros(infected.shape, dtype=np.float32)
+    for dx, dy, probability in EXPOSURE_KERNEL:
+        #cells (x, y) receive from infected workers at (x - dx, y - dy)
+        src_x, dst_x = slice(max(0, -dx), width - max(0, dx)), slice(max(0, dx), width - max(0, -dx))
+        src_y, dst_y = slice(max(0, -dy), height - max(0, dy)), slice(max(0, dy), height - max(0, -dy))
+        total[dst_y, dst_x] += probability * infected[src_y, src_x]
+    return total
+
+
+def section_layout(model, width):
+    """Start column and infection level of every section. Levels are None for models that do not track them."""
+    level = model.splitting_level
+    num_sections = 2 ** level if level > 0 else 1
+    section_width = max(1, width // num_sections)
+    starts = [min(i * section_width, width - 1) for i in range(num_sections)]
+    if hasattr(model, "grid_manager"):
+        levels = model.grid_manager.section_infection_levels
+    else:
+        levels = getattr(model, "section_infection_levels", None)
+    return starts, (list(levels) if levels is not None else None)
+
+
+def downsample(array, factor, reduce):
+    """Reduces factor x factor blocks of a 2D array with reduce (np.max, np.mean), padding the edges"""
+    if factor <= 1:
+        return array
+    height, width = array.shape
+    pad_h, pad_w = -height % factor, -width % factor
+    if pad_h or pad_w:
+        array = np.pad(array, ((0, pad_h), (0, pad_w)), mode="edge")
+    blocks = array.reshape(array.shape[0] // factor, factor, array.shape[1] // factor, factor)
+    return reduce(blocks, axis=(1, 3))
+
+
+def encode_png(rgb):
+    """Encodes an (height, width, 3) uint8 array as PNG bytes. zlib level 1 keeps encoding cheap; the
+    flat floor and large colour runs still compress well."""
+    height, width, _ = rgb.shape
+    rows = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 0] = 0 #filter type none
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows.tobytes(), 1)) +
+            chunk(b"IEND", b""))
+
+
+class FloorRaster:
+    """Renders a model's floor as one image: cells coloured by the health of the workers on them, empty floor
+    shaded by exposure to infected workers nearby, section boundaries drawn as darker columns and a strip
+    above the floor coloured by each section's infection level. Everything is computed on whole arrays from
+    the grid, so render time and image size depend on the floor size, not on the number of workers. Floors
+    wider or taller than max_pixels are reduced by whole blocks: health takes the block maximum, so an
+    infected worker stays visible, and exposure the block mean."""
+    def __init__(self, width, height, max_pixels=(800, 400), exposure_scale=1.0, show_exposure=True,
+                 show_sections=True):
+        self.width = width
+        self.height = height
+        self.factor = max(1, -(-width // max_pixels[0]), -(-height // max_pixels[1]))
+        self.exposure_scale = exposure_scale
+        self.show_exposure = show_exposure
+        self.show_sections = show_sections
+        self.codes = np.zeros((height, width), dtype=np.uint8)
+        self.infected = np.zeros((height, width), dtype=np.int32)
+
+    def render_rgb(self, model):
+        codes = downsample(cell_raster(model, self.codes), self.factor, np.max)
+        rgb = CELL_COLORS[codes]
+        if self.show_exposure:
+            heat = downsample(exposure(infected_counts(model, self.infected)), self.factor, np.mean)
+            alpha = np.minimum(heat / self.exposure_scale, 1.0)[..., None] * 0.85
+            empty = codes == EMPTY
+            rgb[empty] = (rgb[empty] * (1 - alpha[empty]) + EXPOSURE_COLOR * alpha[empty]).astype(np.uint8)
+        if self.show_sections:
+            starts, levels = section_layout(model, self.width)
+            columns = sorted({start // self.factor for start in starts if start > 0})
+            boundary = rgb[:, columns]
+            boundary[codes[:, columns] == EMPTY] = BOUNDARY_COLOR #workers on a boundary stay visible
+            rgb[:, columns] = boundary
+        rgb = rgb[::-1] #rows are stored with y = 0 first, Mesa draws y = 0 at the bottom
+        if self.show_sections:
+            if levels is not None:
+                rgb = np.concatenate([self.section_strip(starts, levels, rgb.shape[1]), rgb], axis=0)
+        return rgb
+
+    def strip_rows(self):
+        return max(1, -(-self.height // self.factor) // 20)
+
+    def section_strip(self, starts, levels, columns):
+        strip = np.empty((self.strip_rows(), columns, 3), dtype=np.uint8)
+        bounds = [start // self.factor for start in starts] + [columns]
+        for section, level in enumerate(levels):
+            share = min(float(level) / 10, 1.0) #levels are capped at 10 by GridManager.update_infection_level
+            color = (1 - share) * np.array([255, 255, 255]) + share * np.array([214, 39, 40])
+            strip[:, bounds[section]:bounds[section + 1]] = color.astype(np.uint8)
+        return strip
+
+    def render(self, model):
+        """PNG of the current frame as a data URI"""
+        return "data:image/png;base64," + base64.b64encode(encode_png(self.render_rgb(model))).decode()
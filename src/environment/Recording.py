@@ -0,0 +1,337 @@
+"""Compact recordings of factory_model runs, for reviewing episodes without re-simulating them.
+
+A recording is a directory of flat binary columns plus a meta.json. Frame 0 is the state before the first
+step and frame f the state after step f. Every frame stores only what changed since the previous one, in
+four event streams: moves (agent, dx, dy) for the usual short step on the floor, jumps (agent, x, y) for
+moves too long for an int8 offset and for leaving or re-entering the grid, health transitions (agent,
+status) and quarantine entries and exits (agent, quarantined). Each stream keeps one narrow-typed file per field and an offsets file with the
+end of every frame's events, so a frame's events are a slice of each column. Every keyframe_every frames the
+full agent state is written as a keyframe, which bounds the work of seeking to any frame. Configuration
+changes are rare and kept in meta.json, and the chart values collected every step are one float64 row per
+frame. The reader memory maps every column, so opening a long recording costs nothing until frames are read.
+"""
+import json
+import os
+import numpy as np
+from src.environment.Core import Agent, Model, MultiGrid, RandomActivation
+
+FORMAT_VERSION = 1
+HEALTH_STATUSES = ("healthy", "infected", "recovered", "death")
+HEALTH_CODES = {status: code for code, status in enumerate(HEALTH_STATUSES)}
+#Rows of the agent state held in keyframes, x is -1 while an agent is off the grid
+STATE_ROWS = ("x", "y", "health", "quarantined")
+STREAMS = {
+    "moves": (("agent", "<i4"), ("dx", "i1"), ("dy", "i1")),
+    "jumps": (("agent", "<i4"), ("x", "<i2"), ("y", "<i2")),
+    "health": (("agent", "<i4"), ("status", "i1")),
+    "quarantine": (("agent", "<i4"), ("quarantined", "i1")),
+}
+#model attribute -> update_config action key, compared after every step to record configuration changes
+CONFIG_FIELDS = {
+    "initial_cleaning": "cleaning_type",
+    "splitting_level": "splitting_level",
+    "test_lvl": "testing_level",
+    "social_distancing": "social_distancing",
+    "mask_mandate": "mask_mandate",
+    "shifts_per_day": "shifts_per_day",
+}
+
+
+def agent_state(agents):
+    """Current STATE_ROWS of a list of worker agents as an int16 array of shape (4, len(agents))"""
+    state = np.empty((len(STATE_ROWS), len(agents)), dtype=np.int16)
+    state[0] = [agent.pos[0] if agent.pos is not None else -1 for agent in agents]
+    state[1] = [agent.pos[1] if agent.pos is not None else -1 for agent in agents]
+    state[2] = [HEALTH_CODES[agent.health_status] for agent in agents]
+    state[3] = [agent.is_quarantined for agent in agents]
+    return state
+
+
+def model_config(model):
+    """The model's current configuration as an update_config action dict"""
+    config = {}
+    for attribute, key in CONFIG_FIELDS.items():
+        value = getattr(model, attribute)
+        config[key] = value.item() if isinstance(value, np.generic) else value
+    return config
+
+
+class RunRecorder:
+    """Writes a recording of a factory_model while it runs. Created by factory_model.enable_recording, which
+    captures a frame at the end of every step; close() writes meta.json, without which the recording cannot
+    be read. Columns are appended to open files as the run goes, so memory use does not grow with its length."""
+    def __init__(self, model, path, keyframe_every=240):
+        self.model = model
+        self.path = path
+        self.keyframe_every = keyframe_every
+        os.makedirs(path, exist_ok=True)
+        #Workers removed from the schedule (unplaced at a shift change) keep their slot, off the grid
+        self.agents = sorted(model.schedule.agents, key=lambda agent: agent.unique_id)
+        self.chart_labels = list(model.datacollector.model_reporters)
+        self.files = {}
+        self.counts = dict.fromkeys(STREAMS, 0)
+        self.frames = 0
+        self.config_changes = []
+        self.config = None
+        self.state = None
+        for stream, fields in STREAMS.items():
+            self.open(f"{stream}.offsets")
+            for field, _ in fields:
+                self.open(f"{stream}.{field}")
+            self.write(f"{stream}.offsets", np.zeros(1, dtype="<i8"))
+        self.open("keyframes")
+        self.open("charts")
+        self.capture()
+
+    def open(self, name):
+        self.files[name] = open(os.path.join(self.path, name + ".bin"), "wb")
+
+    def write(self, name, array):
+        self.files[name].write(np.ascontiguousarray(array).tobytes())
+
+    def capture(self):
+        """Appends the model's current state as the next frame"""
+        state = agent_state(self.agents)
+        frame = self.frames
+        offset = state[:2].astype(np.int32) - (self.state[:2] if self.state is not None else state[:2])
+        if self.state is None:
+            changed = {stream: np.zeros(0, dtype=np.intp) for stream in STREAMS}
+        else:
+            previous = self.state
+            moved = (offset[0] != 0) | (offset[1] != 0)
+            short = (previous[0] >= 0) & (state[0] >= 0) & (np.abs(offset).max(axis=0) <= 127)
+            changed = {
+                "moves": np.flatnonzero(moved & short),
+                "jumps": np.flatnonzero(moved & ~short),
+                "health": np.flatnonzero(state[2] != previous[2]),
+                "quarantine": np.flatnonzero(state[3] != previous[3]),
+            }
+        for stream, fields in STREAMS.items():
+            indices = changed[stream]
+            columns = {"agent": indices, "x": state[0, indices], "y": state[1, indices],
+                       "status": state[2, indices], "quarantined": state[3, indices]}
+            if stream == "moves":
+                columns["dx"], columns["dy"] = offset[:, indices]
+            for field, dtype in fields:
+                self.write(f"{stream}.{field}", columns[field].astype(dtype))
+            self.counts[stream] += len(indices)
+            self.write(f"{stream}.offsets", np.array([self.counts[stream]], dtype="<i8"))
+        if frame % self.keyframe_every == 0:
+            self.write("keyframes", state.astype("<i2"))
+
+        config = model_config(self.model)
+        if config != self.config:
+            self.config_changes.append([frame, config])
+            self.config = config
+        model_vars = self.model.datacollector.model_vars
+        row = [model_vars[label][-1] if model_vars[label] else 0 for label in self.chart_labels]
+        self.write("charts", np.array(row, dtype="<f8"))
+
+        self.state = state
+        self.frames += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "num_frames": self.frames,
+            "num_agents": len(self.agents),
+            "agent_ids": [agent.unique_id for agent in self.agents],
+            "width": self.model.grid.width,
+            "height": self.model.grid.height,
+            "steps_per_day": self.model.steps_per_day,
+            "keyframe_every": self.keyframe_every,
+            "health_statuses": list(HEALTH_STATUSES),
+            "chart_labels": self.chart_labels,
+            "event_counts": self.counts,
+            "config_changes": self.config_changes,
+        }
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+        return self.path
+
+
+class RunReplay:
+    """Reads a recording. Columns are memory mapped, state(frame) seeks from the nearest keyframe and
+    frames() plays the recording forward applying one frame of events at a time."""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording format {self.meta['format_version']}")
+        self.num_frames = self.meta["num_frames"]
+        self.num_agents = self.meta["num_agents"]
+        self.width = self.meta["width"]
+        self.height = self.meta["height"]
+        self.keyframe_every = self.meta["keyframe_every"]
+        self.chart_labels = self.meta["chart_labels"]
+        self.config_frames = [frame for frame, _ in self.meta["config_changes"]]
+
+        self.offsets = {stream: self.column(f"{stream}.offsets", "<i8") for stream in STREAMS}
+        self.streams = {stream: {field: self.column(f"{stream}.{field}", dtype) for field, dtype in fields}
+                        for stream, fields in STREAMS.items()}
+        self.keyframes = self.column("keyframes", "<i2").reshape(-1, len(STATE_ROWS), self.num_agents)
+        self.charts = self.column("charts", "<f8").reshape(self.num_frames, len(self.chart_labels))
+
+    def column(self, name, dtype):
+        file_path = os.path.join(self.path, name + ".bin")
+        if os.path.getsize(file_path) == 0: #numpy cannot map an empty file
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode="r")
+
+    def events(self, stream, frame):
+        """Columns of one stream's events in a frame, as a dict of array slices"""
+        start, end = self.offsets[stream][frame], self.offsets[stream][frame + 1]
+        return {field: column[start:end] for field, column in self.streams[stream].items()}
+
+    def apply(self, state, frame):
+        """Applies the events of a frame to a state array in place"""
+        moves = self.events("moves", frame)
+        state[0, moves["agent"]] += moves["dx"]
+        state[1, moves["agent"]] += moves["dy"]
+        jumps = self.events("jumps", frame)
+        state[0, jumps["agent"]] = jumps["x"]
+        state[1, jumps["agent"]] = jumps["y"]
+        health = self.events("health", frame)
+        state[2, health["agent"]] = health["status"]
+        quarantine = self.events("quarantine", frame)
+        state[3, quarantine["agent"]] = quarantine["quarantined"]
+        return state
+
+    def state(self, frame):
+        """Agent state at a frame, shape (4, num_agents) with the rows of STATE_ROWS"""
+        if not 0 <= frame < self.num_frames:
+            raise IndexError(f"Frame {frame} outside the recording (0-{self.num_frames - 1})")
+        keyframe = frame // self.keyframe_every
+        state = np.array(self.keyframes[keyframe])
+        for f in range(keyframe * self.keyframe_every + 1, frame + 1):
+            self.apply(state, f)
+        return state
+
+    def frames(self, start=0):
+        """Yields (frame, state) from start to the end. The state array is updated in place."""
+        state = self.state(start)
+        yield start, state
+        for frame in range(start + 1, self.num_frames):
+            yield frame, self.apply(state, frame)
+
+    def config(self, frame):
+        """Configuration in effect at a frame, as an update_config action dict"""
+        index = np.searchsorted(self.config_frames, frame, side="right") - 1
+        return dict(self.meta["config_changes"][max(index, 0)][1])
+
+    def chart_values(self, frame):
+        """Chart reporter values collected at the step that produced a frame"""
+        return dict(zip(self.chart_labels, self.charts[frame].tolist()))
+
+    def size_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+
+class ReplayAgent(Agent):
+    """Stand-in worker exposing what the portrayal functions read"""
+    def __init__(self, unique_id, model):
+        super().__init__(unique_id, model)
+        self.health_status = "healthy"
+        self.is_quarantined = False
+
+
+class ChartSeries:
+    """One recorded chart series up to the current frame. Items are Python floats, so Mesa can send them
+    to the browser as JSON."""
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index].tolist()
+
+
+class ReplayCharts:
+    """DataCollector stand-in whose model_vars are the recorded chart rows up to the current frame, which
+    is what Mesa's ChartModule reads"""
+    def __init__(self, replay):
+        self.replay = replay
+        self.frame = 0
+
+    @property
+    def model_vars(self):
+        #frame 0 has no collected values, like a fresh model's datacollector
+        rows = self.replay.charts[1:self.frame + 1]
+        return {label: ChartSeries(rows[:, i]) for i, label in enumerate(self.replay.chart_labels)}
+
+
+class ReplayModel(Model):
+    """Plays a recording back as a model with a grid, a schedule and a datacollector, so the visualization
+    scripts' CanvasGrid, ChartModule and text elements render it like the live model. step() advances one
+    frame and seek() jumps to any frame. Nothing is simulated."""
+    def __init__(self, path, start_frame=0):
+        super().__init__()
+        self.replay = RunReplay(path)
+        self.grid = MultiGrid(self.replay.width, self.replay.height, torus=True)
+        self.schedule = RandomActivation(self)
+        self.datacollector = ReplayCharts(self.replay)
+        self.steps_per_day = self.replay.meta["steps_per_day"]
+        self.workers = [ReplayAgent(unique_id, self) for unique_id in self.replay.meta["agent_ids"]]
+        for agent in self.workers:
+            self.schedule.add(agent)
+        self.frame = 0
+        self.seek(start_frame)
+
+    def seek(self, frame):
+        """Shows the recorded state at a frame"""
+        state = self.replay.state(frame)
+        for agent in self.workers:
+            if agent.pos is not None:
+                self.grid.remove_agent(agent)
+        self.show(np.arange(self.replay.num_agents), state)
+        self.frame = frame
+        self.apply_frame_metadata()
+
+    def step(self):
+        if self.frame + 1 >= self.replay.num_frames:
+            self.running = False
+            return
+        self.frame += 1
+        events = {stream: self.replay.events(stream, self.frame) for stream in STREAMS}
+        for index, status in zip(events["health"]["agent"].tolist(), events["health"]["status"].tolist()):
+            self.workers[index].health_status = HEALTH_STATUSES[status]
+        for index, flag in zip(events["quarantine"]["agent"].tolist(), events["quarantine"]["quarantined"].tolist()):
+            self.workers[index].is_quarantined = bool(flag)
+        for index, dx, dy in zip(events["moves"]["agent"].tolist(), events["moves"]["dx"].tolist(),
+                                 events["moves"]["dy"].tolist()):
+            x, y = self.workers[index].pos
+            self.place(self.workers[index], x + dx, y + dy)
+        for index, x, y in zip(events["jumps"]["agent"].tolist(), events["jumps"]["x"].tolist(),
+                               events["jumps"]["y"].tolist()):
+            self.place(self.workers[index], x, y)
+        self.apply_frame_metadata()
+
+    def show(self, indices, state):
+        for index in indices.tolist():
+            agent = self.workers[index]
+            agent.health_status = HEALTH_STATUSES[state[2, index]]
+            agent.is_quarantined = bool(state[3, index])
+            self.place(agent, int(state[0, index]), int(state[1, index]))
+
+    def place(self, agent, x, y):
+        if agent.pos is not None:
+            self.grid.remove_agent(agent)
+        if x >= 0:
+            self.grid.place_agent(agent, (x, y))
+
+    def apply_frame_metadata(self):
+        """Configuration attributes, clock and chart cursor for the current frame"""
+        config = self.replay.config(self.frame)
+        for attribute, key in CONFIG_FIELDS.items():
+            setattr(self, attribute, config[key])
+        self.current_step = self.frame
+        self.current_day = self.frame // self.steps_per_day
+        self.current_step_in_day = self.frame % self.steps_per_day
+        self.datacollector.frame = self.frame
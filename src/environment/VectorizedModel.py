@@ -0,0 +1,421 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import numpy as np
+from src.environment.FactoryConfig import FactoryConfig
+from src.environment.GridManager import CLEANING_SCHEDULE
+from src.environment.Profiler import StepProfiler
+from src.environment.WorkerAgent import (BASE_INFECTION_PROBABILITIES, DISTANCING_PRODUCTION_FACTOR,
+                                         DISTANCING_TRANSMISSION_FACTOR, HEALTH_PRODUCTION, INFECTION_STEPS,
+                                         MASK_PRODUCTION_FACTOR, MASK_TRANSMISSION_FACTOR, PRIOR_INFECTION_FACTOR,
+                                         RECOVERY_STEPS, SHIFT_PENALTIES, SPLITTING_LEVEL_PENALTIES)
+from src.environment.infection_control.Quarantine import QUARANTINE_DURATION
+from src.environment.infection_control.SwabTesting import FALSE_NEGATIVE_RATE, FALSE_POSITIVE_RATE, TESTING_LEVELS
+from src.environment.kernels.NumpyKernels import DEATH, HEALTHY, INFECTED, RECOVERED
+
+HEALTH_STATES = {"healthy": HEALTHY, "infected": INFECTED, "recovered": RECOVERED, "death": DEATH}
+
+
+def load_kernels(backend="auto"):
+    """Returns (name, module) of the kernel backend. "auto" uses Numba when it is installed and falls back
+    to NumPy otherwise."""
+    if backend in ("auto", "numba"):
+        try:
+            from src.environment.kernels import NumbaKernels
+            return "numba", NumbaKernels
+        except ImportError:
+            if backend == "numba":
+                raise
+    from src.environment.kernels import NumpyKernels
+    return "numpy", NumpyKernels
+
+
+class vectorized_model:
+    """Array based engine with the same rules and interface (get_state, update_config, step) as factory_model.
+
+    Workers are rows of numpy arrays instead of Mesa agents and the per-step agent work (movement,
+    transmission, timer progression and production) runs as whole-array kernels, either NumPy or Numba
+    compiled. Unlike the agent loop, all workers move and infect at the same time within a step: workers
+    choosing the same cell are resolved in a random priority order and infections made during a step only
+    spread from the next step on. Cleaning, testing, quarantine and shift changes follow GridManager,
+    TestingManager and QuarantineManager."""
+    def __init__(self, width, height, N, visualization=False, config=None, seed=None, backend="auto"):
+        if config is None:
+            config = FactoryConfig(width=width, height=height, num_agents=N, visualization=visualization)
+        self.backend, self.kernels = load_kernels(backend)
+        self.rng = np.random.default_rng(seed)
+        self.num_agents = config.num_agents
+        self.width = config.width
+        self.height = config.height
+        if self.num_agents > self.width * self.height:
+            raise ValueError("More workers than cells on the factory floor")
+
+        # Policy parameters, same names as factory_model
+        self.mask_mandate = config.mask_mandate
+        self.social_distancing = config.social_distancing
+        self.initial_cleaning = config.cleaning_type
+        self.test_lvl = config.testing_level
+        self._splitting_level = config.splitting_level
+
+        self.steps_per_day = config.steps_per_day
+        self.shifts_per_day = config.shifts_per_day
+        self.steps_per_shift = config.steps_per_shift
+        self.next_shift_change = self.steps_per_shift
+
+        self.current_step = 0
+        self.current_step_in_day = 0
+        self.current_day = 0
+        self.current_shift = 0
+        self.daily_infections = 0
+        self.tests_performed = 0
+        self.profiler = None #StepProfiler while profiling is enabled
+
+        # Cleaning and testing timing mirrors GridManager and TestingManager
+        self.current_cleaning = self.initial_cleaning
+        self.cleaning_steps_remaining = 0
+        self.next_cleaning = {level: schedule['frequency'] for level, schedule in CLEANING_SCHEDULE.items()}
+        self.next_test_steps = {level: 0 for level in TESTING_LEVELS}
+        self.impact_duration_remaining = 0
+        self.current_test_impact = 0
+        self.section_infection_levels = np.zeros(self.num_sections)
+
+        self.distance_probability = np.array([BASE_INFECTION_PROBABILITIES[d] for d in range(4)])
+        self.health_production = np.array([HEALTH_PRODUCTION[s] for s in ("healthy", "infected", "recovered", "death")])
+
+        self.initialize_agents()
+
+        self.swab_testing_counter = {"none": 0, "light": 0, "medium": 0, "heavy": 0}
+        self.cleaning_counter = {"light": 0, "medium": 0, "heavy": 0}
+        self.shifts_counter = {"1": 0, "2": 0, "3": 0, "4": 0}
+        self.mask_counter = {True: 0, False: 0}
+        self.social_distancing_counter = {True: 0, False: 0}
+        self.splitting_level_counter = {"0": 0, "1": 0, "2": 0, "3": 0}
+
+    @property
+    def num_sections(self):
+        return 2 ** self._splitting_level if self._splitting_level > 0 else 1
+
+    @property
+    def splitting_level(self):
+        return self._splitting_level
+
+    @splitting_level.setter
+    def splitting_level(self, value):
+        """Re-splits the floor and sends every worker to a random cell of its new section (GridManager.redistribute_agents)"""
+        if not isinstance(value, int) or value < 0 or value > 3:
+            raise ValueError("Splitting level must be an integer between 0 and 3")
+        if value == self._splitting_level:
+            return
+        self._splitting_level = value
+        self.section_infection_levels = np.zeros(self.num_sections)
+        self.section = np.minimum(np.arange(self.num_agents) // max(1, self.num_agents // self.num_sections),
+                                  self.num_sections - 1)
+        self.update_section_bounds()
+        on_grid = ~self.quarantined
+        self.x[on_grid] = self.rng.integers(self.x_start[on_grid], self.x_end[on_grid])
+        self.y[on_grid] = self.rng.integers(0, self.height, on_grid.sum())
+        self.set_base_position(on_grid)
+        self.rebuild_occupancy()
+
+    def section_width(self):
+        return max(1, self.width // self.num_sections)
+
+    def update_section_bounds(self):
+        """Caches the section of every column and the x range of every worker's section"""
+        section_width = self.section_width()
+        self.section_of_x = np.minimum(np.arange(self.width) // section_width, self.num_sections - 1)
+        self.section = np.minimum(self.section, self.num_sections - 1)
+        self.x_start = self.section * section_width
+        self.x_end = np.where(self.section == self.num_sections - 1, self.width, self.x_start + section_width)
+
+    def initialize_agents(self):
+        """Places workers on distinct random cells and infects one of them"""
+        n = self.num_agents
+        cells = self.rng.choice(self.width * self.height, size=n, replace=False)
+        self.x = (cells // self.height).astype(np.int64)
+        self.y = (cells % self.height).astype(np.int64)
+        self.base_x = self.x.copy()
+        self.base_y = self.y.copy()
+        self.steps_since_base_change = np.zeros(n, dtype=np.int64)
+        self.health = np.full(n, HEALTHY, dtype=np.int8)
+        self.health[self.rng.integers(n)] = INFECTED
+        self.infection_time = np.zeros(n, dtype=np.int32)
+        self.had_covid = np.zeros(n, dtype=bool)
+        self.quarantined = np.zeros(n, dtype=bool)
+        self.quarantine_timer = np.zeros(n, dtype=np.int32)
+        self.current_production = np.ones(n) #worker_agent starts at its base production
+        self.section = np.minimum(self.x // self.section_width(), self.num_sections - 1)
+        self.update_section_bounds()
+        self.occupancy = np.zeros((self.width, self.height), dtype=np.int32)
+        self.rebuild_occupancy()
+
+    def rebuild_occupancy(self):
+        self.occupancy[:] = 0
+        on_grid = ~self.quarantined
+        np.add.at(self.occupancy, (self.x[on_grid], self.y[on_grid]), 1)
+
+    def set_base_position(self, mask):
+        self.base_x[mask] = self.x[mask]
+        self.base_y[mask] = self.y[mask]
+        self.steps_since_base_change[mask] = 0
+
+    def count_health_status(self, status):
+        return int(np.count_nonzero(self.health == HEALTH_STATES[status]))
+
+    def calculate_productivity(self):
+        return float(self.current_production.sum())
+
+    def get_state(self):
+        """Same observation as factory_model.get_state"""
+        return [
+            self.count_health_status("healthy"),
+            self.count_health_status("infected"),
+            self.count_health_status("recovered"),
+            self.count_health_status("death"),
+            self.calculate_productivity(),
+            self.current_step_in_day,
+            int(self.social_distancing),
+            int(self.mask_mandate),
+        ]
+
+    def policy_production_factor(self):
+        factor = SHIFT_PENALTIES.get(self.shifts_per_day, 1.0) * SPLITTING_LEVEL_PENALTIES.get(self._splitting_level, 1.0)
+        if self.mask_mandate:
+            factor *= MASK_PRODUCTION_FACTOR
+        if self.social_distancing:
+            factor *= DISTANCING_PRODUCTION_FACTOR
+        return factor
+
+    def process_cleaning(self):
+        """GridManager.process_cleaning. Returns the production multiplier of this step's cleaning."""
+        schedule = CLEANING_SCHEDULE[self.current_cleaning]
+        if self.cleaning_steps_remaining > 0:
+            self.cleaning_steps_remaining -= 1
+        elif self.current_step_in_day == self.next_cleaning[self.current_cleaning]:
+            self.cleaning_steps_remaining = schedule['duration']
+            self.next_cleaning[self.current_cleaning] = (
+                (self.current_step_in_day + schedule['frequency']) % self.steps_per_day)
+        else:
+            return 1.0
+        self.section_infection_levels *= (1 - schedule['infection_reduction'])
+        return 1 - schedule['production_reduction']
+
+    def process_testing(self):
+        """TestingManager.process_testing. Returns the production multiplier of the testing impact."""
+        level = TESTING_LEVELS[self.test_lvl]
+        if self.test_lvl != 'none' and self.current_step_in_day == self.next_test_steps[self.test_lvl]:
+            self.next_test_steps[self.test_lvl] = (self.current_step_in_day + level['frequency']) % self.steps_per_day
+            free = np.flatnonzero(~self.quarantined)
+            tested = self.rng.choice(free, size=int(len(free) * level['proportion']), replace=False)
+            infected = self.health[tested] == INFECTED
+            positive_rate = np.where(infected, 1 - FALSE_NEGATIVE_RATE, FALSE_POSITIVE_RATE)
+            positives = tested[self.rng.random(len(tested)) < positive_rate]
+            self.quarantine(positives)
+            self.tests_performed += len(tested)
+            self.impact_duration_remaining = level['impact_duration']
+            self.current_test_impact = level['productivity_impact']
+
+        if self.impact_duration_remaining > 0:
+            self.impact_duration_remaining -= 1
+            return 1 - self.current_test_impact
+        return 1.0
+
+    def quarantine(self, workers):
+        """QuarantineManager.quarantine_agent: takes workers off the floor"""
+        workers = workers[~self.quarantined[workers]]
+        np.subtract.at(self.occupancy, (self.x[workers], self.y[workers]), 1)
+        self.section[workers] = self.section_of_x[self.x[workers]]
+        self.quarantined[workers] = True
+        self.quarantine_timer[workers] = 0
+
+    def process_quarantine(self):
+        """QuarantineManager.process_quarantine: releases recovered workers, healthy workers after the
+        quarantine duration and anyone after twice that, onto a random cell of their section"""
+        self.quarantine_timer[self.quarantined] += 1
+        timer = self.quarantine_timer
+        release = self.quarantined & ((self.health == RECOVERED) |
+                                      ((self.health == HEALTHY) & (timer >= QUARANTINE_DURATION)) |
+                                      (timer >= 2 * QUARANTINE_DURATION))
+        if not release.any():
+            return
+        self.update_section_bounds()
+        self.x[release] = self.rng.integers(self.x_start[release], self.x_end[release])
+        self.y[release] = self.rng.integers(0, self.height, release.sum())
+        self.quarantined[release] = False
+        self.set_base_position(release)
+        np.add.at(self.occupancy, (self.x[release], self.y[release]), 1)
+
+    def process_shift_change(self):
+        """GridManager.process_shift_change: every worker on the floor gets a new random cell in its section,
+        no two workers share a cell. With social distancing the cells of a checkerboard are used first, which
+        keeps workers at least 2 cells apart (Manhattan) as long as the section has room."""
+        self.current_shift = (self.current_shift + 1) % self.shifts_per_day
+        on_grid = np.flatnonzero(~self.quarantined)
+        self.section[on_grid] = self.section_of_x[self.x[on_grid]]
+        self.update_section_bounds()
+        for section in range(self.num_sections):
+            workers = on_grid[self.section[on_grid] == section]
+            if len(workers) == 0:
+                continue
+            columns = np.arange(self.x_start[workers[0]], self.x_end[workers[0]])
+            cells_x = np.repeat(columns, self.height)
+            cells_y = np.tile(np.arange(self.height), len(columns))
+            order = self.rng.permutation(len(cells_x))
+            if self.social_distancing:
+                order = order[np.argsort((cells_x[order] + cells_y[order]) % 2, kind="stable")]
+            if len(order) < len(workers):
+                order = np.concatenate([order, self.rng.choice(len(cells_x), len(workers) - len(order))])
+            chosen = order[:len(workers)]
+            self.x[workers] = cells_x[chosen]
+            self.y[workers] = cells_y[chosen]
+        self.set_base_position(on_grid)
+        self.rebuild_occupancy()
+        self.next_shift_change = (self.current_step_in_day + self.steps_per_shift) % self.steps_per_day
+
+    def rebase_stale_workers(self, on_grid):
+        """worker_agent.update_base_position for workers that missed a shift change. Returns them."""
+        self.steps_since_base_change[on_grid] += 1
+        stale = on_grid & (self.steps_since_base_change > self.steps_per_shift)
+        if stale.any():
+            new_x = self.x_start[stale] + 2 * self.rng.integers(0, np.maximum(1, (self.x_end[stale] - self.x_start[stale] + 1) // 2))
+            new_y = 2 * self.rng.integers(0, max(1, (self.height + 1) // 2), stale.sum())
+            np.subtract.at(self.occupancy, (self.x[stale], self.y[stale]), 1)
+            self.x[stale] = np.minimum(new_x, self.width - 1)
+            self.y[stale] = np.minimum(new_y, self.height - 1)
+            np.add.at(self.occupancy, (self.x[stale], self.y[stale]), 1)
+            self.set_base_position(stale)
+        return stale
+
+    def process_agent_steps(self, step_factor):
+        """Movement, transmission, infection progression and production of every worker"""
+        n = self.num_agents
+        on_grid = ~self.quarantined
+        movers = on_grid & ~self.rebase_stale_workers(on_grid)
+        self.kernels.move(self.x, self.y, self.base_x, self.base_y, self.x_start, self.x_end, movers, self.occupancy,
+                          bool(self.social_distancing), self.rng.random((n, 4)), self.rng.permutation(n))
+
+        #Every infected worker on the floor raises its section's infection level before spreading
+        sources = on_grid & (self.health == INFECTED)
+        levels = self.section_infection_levels
+        levels += np.bincount(self.section_of_x[self.x[sources]], minlength=len(levels))
+        np.minimum(levels, 10, out=levels)
+        section_probability = 0.8 * np.minimum(1.0 + levels * 0.1, 2.0)
+        modifier = (MASK_TRANSMISSION_FACTOR if self.mask_mandate else 1.0) * \
+                   (DISTANCING_TRANSMISSION_FACTOR if self.social_distancing else 1.0)
+        newly_infected = self.kernels.transmit(self.x, self.y, self.health, self.had_covid, on_grid, self.section_of_x,
+                                               section_probability, self.distance_probability, modifier,
+                                               PRIOR_INFECTION_FACTOR, self.rng.random(n), self.width, self.height)
+
+        self.kernels.progress(self.health, self.infection_time, self.had_covid, INFECTION_STEPS, RECOVERY_STEPS)
+        self.health[newly_infected] = INFECTED
+        self.had_covid[newly_infected] = True
+        levels += np.bincount(self.section_of_x[self.x[newly_infected]], minlength=len(levels))
+        np.minimum(levels, 10, out=levels)
+
+        #worker_agent.introduce_infection keeps at least one infected worker in the factory
+        if not np.any(self.health == INFECTED):
+            healthy = np.flatnonzero(self.health == HEALTHY)
+            if len(healthy):
+                self.health[self.rng.choice(healthy)] = INFECTED
+
+        self.kernels.production(self.health, self.quarantined, self.health_production,
+                                self.policy_production_factor() * step_factor, self.current_production)
+
+    def enable_profiling(self, dump_path=None, dump_every=1000):
+        """Same as factory_model.enable_profiling, with the agent kernels timed as one agent_steps phase"""
+        if self.profiler is None:
+            self.profiler = StepProfiler(self, dump_path, dump_every)
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stops profiling, writing a final dump if a dump path was set, and returns the last metrics"""
+        if self.profiler is None:
+            return None
+        profiler, self.profiler = self.profiler, None
+        profiler.detach()
+        if profiler.dump_path:
+            profiler.dump()
+        return profiler.metrics()
+
+    def get_metrics(self):
+        """Profiling metrics since the last reset, None when profiling is disabled"""
+        return self.profiler.metrics() if self.profiler is not None else None
+
+    def step(self, action=None):
+        """Processes a single step, returns the same results dictionary as factory_model.step"""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_step()
+        self.current_step += 1
+        self.current_step_in_day = self.current_step % self.steps_per_day
+        if self.current_step_in_day == 0:
+            self.current_day += 1
+
+        step_factor = self.process_cleaning()
+        if profiler is not None:
+            profiler.lap("cleaning")
+        step_factor *= self.process_testing()
+        if profiler is not None:
+            profiler.lap("testing")
+        self.process_quarantine()
+        if profiler is not None:
+            profiler.lap("quarantine")
+        if self.current_step_in_day == self.next_shift_change:
+            self.process_shift_change()
+            if profiler is not None:
+                profiler.lap("shift_change")
+
+        pre_step_infected = self.count_health_status("infected")
+        if profiler is not None:
+            profiler.lap("stats")
+        self.process_agent_steps(step_factor)
+        if profiler is not None:
+            profiler.lap("agent_steps")
+        post_step_infected = self.count_health_status("infected")
+        new_infections = max(0, post_step_infected - pre_step_infected)
+        self.daily_infections = new_infections
+
+        productivity = self.calculate_productivity()
+        if profiler is not None:
+            profiler.lap("stats")
+            profiler.count("new_infections", new_infections)
+            profiler.end_step()
+        return {
+            'day': self.current_day,
+            'step_in_day': self.current_step_in_day,
+            'new_infections': new_infections,
+            'total_infected': post_step_infected,
+            'productivity': productivity,
+            'quarantined': int(self.quarantined.sum()),
+            'base_production': productivity,
+            'infection_penalty': -2.0 * (new_infections / self.num_agents),
+        }
+
+    def update_config(self, action_dict):
+        """Same action dictionary as factory_model.update_config"""
+        if "cleaning_type" in action_dict:
+            self.initial_cleaning = action_dict["cleaning_type"]
+            self.current_cleaning = action_dict["cleaning_type"]
+            self.cleaning_steps_remaining = 0
+            self.cleaning_counter[action_dict["cleaning_type"]] += 1
+        if "splitting_level" in action_dict:
+            self.splitting_level = action_dict["splitting_level"]
+            self.splitting_level_counter[str(action_dict["splitting_level"])] += 1
+        if "testing_level" in action_dict:
+            if action_dict["testing_level"] not in TESTING_LEVELS:
+                raise ValueError("Invalid testing level")
+            self.test_lvl = action_dict["testing_level"]
+            self.swab_testing_counter[action_dict["testing_level"]] += 1
+        if "social_distancing" in action_dict:
+            self.social_distancing = action_dict["social_distancing"]
+            self.social_distancing_counter[action_dict["social_distancing"]] += 1
+        if "mask_mandate" in action_dict:
+            self.mask_mandate = action_dict["mask_mandate"]
+            self.mask_counter[action_dict["mask_mandate"]] += 1
+        if "shifts_per_day" in action_dict:
+            self.shifts_per_day = action_dict["shifts_per_day"]
+            self.steps_per_shift = self.steps_per_day // self.shifts_per_day
+            self.next_shift_change = (self.current_step_in_day + self.steps_per_shift) % self.steps_per_day
+            self.process_shift_change()
+            self.shifts_counter[str(action_dict["shifts_per_day"])] += 1
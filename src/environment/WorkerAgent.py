@@ -1,6 +1,35 @@
-from mesa import Agent
+from src.environment.Core import Agent
 import random
 
+#Chance a healthy agent is infected by a sick agent at a given Manhattan distance
+BASE_INFECTION_PROBABILITIES = {
+    0: 0.4,  # Same cell
+    1: 0.12,  # Adjacent cells
+    2: 0.08,  # Two cells away
+    3: 0.05   # Three cells away
+}
+MASK_TRANSMISSION_FACTOR = 0.7  # Masks reduce transmission by 30%
+DISTANCING_TRANSMISSION_FACTOR = 0.8  # Social distancing reduces transmission by 20%
+PRIOR_INFECTION_FACTOR = 0.5  # Agents that had covid are half as likely to catch it again
+INFECTION_STEPS = 40  # steps of illness to recover
+RECOVERY_STEPS = 80  # infection_time at which a recovered agent is healthy again
+
+HEALTH_PRODUCTION = {"healthy": 1.0, "infected": 0.2, "recovered": 0.95, "death": 0}
+SHIFT_PENALTIES = {
+    1: 0.8,   # One shift - 20% penalty
+    2: 0.9,   # Two shifts - 10% reduction
+    3: 0.95,   # Three shifts - 5% reduction
+    4: 1.0    # Four shifts - no reduction
+}
+SPLITTING_LEVEL_PENALTIES = {
+    0: 1.0,   # No penalty for full grid
+    1: 0.95,  # 5% penalty for half grid
+    2: 0.90,  # 10% penalty for quarter grid
+    3: 0.8   # 20% penalty for eighth grid
+}
+MASK_PRODUCTION_FACTOR = 0.95  # mask mandate reduces production by 5%
+DISTANCING_PRODUCTION_FACTOR = 0.90  # social distancing reduces production by 10%
+
 class worker_agent(Agent):
     """A worker agent with a health status and assigned section."""
     def __init__(self, unique_id, model, section):
@@ -195,14 +224,7 @@ class worker_agent(Agent):
 
     def get_infection_probability(self, distance, had_covid):
         """Calculate infection probability based on distance and immunity status."""
-        base_probabilities = {
-            0: 0.4,  # Same cell
-            1: 0.12,  # Adjacent cells
-            2: 0.08,  # Two cells away
-            3: 0.05   # Three cells away
-        }
-        
-        base_prob = base_probabilities.get(distance, 0)
+        base_prob = BASE_INFECTION_PROBABILITIES.get(distance, 0)
         section_index = self.model.grid_manager.get_section_index(self.pos[0])
         target_section_index = self.model.grid_manager.get_section_index(self.pos[0])
         if section_index != target_section_index: #Reduces transmission across sections (plexiglass shields dividing the factory)
@@ -210,11 +232,11 @@ class worker_agent(Agent):
 
         section_prob = self.model.grid_manager.get_infection_probability(section_index)
         if had_covid:
-            base_prob *= .5 
+            base_prob *= PRIOR_INFECTION_FACTOR
         if self.model.mask_mandate:
-            base_prob *= 0.7  # Masks reduce transmission by 30%
+            base_prob *= MASK_TRANSMISSION_FACTOR
         if self.model.social_distancing:
-            base_prob *= 0.8  # Social distancing reduces transmission by 20%
+            base_prob *= DISTANCING_TRANSMISSION_FACTOR
             
         return base_prob * section_prob
     
@@ -223,11 +245,11 @@ class worker_agent(Agent):
         if self.health_status == "infected":
             self.infection_time += 1
             self.had_covid = True
-            if self.infection_time > 40: #40 steps of illness to recover
+            if self.infection_time > INFECTION_STEPS: #40 steps of illness to recover
                 self.health_status = "recovered"
         elif self.health_status == "recovered":
             self.infection_time += 1
-            if self.infection_time > 80: #80 steps to go back to healthy.
+            if self.infection_time > RECOVERY_STEPS: #80 steps to go back to healthy.
                 self.health_status = "healthy"
                 self.infection_time = 0
         elif self.health_status == "death":
@@ -242,34 +264,21 @@ class worker_agent(Agent):
         if self.health_status == "healthy":
             production = self.base_production #healthy agents have base production
         elif self.health_status == "infected":
-            production *= 0.2 #20% production for sick agents.
+            production *= HEALTH_PRODUCTION["infected"] #20% production for sick agents.
         elif self.health_status == "recovered":
-            production *= 0.95 #95% production for recovered
+            production *= HEALTH_PRODUCTION["recovered"] #95% production for recovered
         elif self.health_status == "death":
             production *= 0
             self.current_production = 0
             return
         
-        shift_penalty = {
-            1: 0.8,   # One shift - 20% penalty
-            2: 0.9,   # Two shifts - 10% reduction
-            3: 0.95,   # Three shifts - 5% reduction
-            4: 1.0    # Four shifts - no reduction
-        }.get(self.model.shifts_per_day, 1.0)
-        production *= shift_penalty
-        
-        splitting_level_penalties = {
-            0: 1.0,   # No penalty for full grid
-            1: 0.95,  # 5% penalty for half grid
-            2: 0.90,  # 10% penalty for quarter grid
-            3: 0.8   # 20% penalty for eighth grid
-        }
-        production *= splitting_level_penalties.get(self.model.splitting_level, 1.0)
+        production *= SHIFT_PENALTIES.get(self.model.shifts_per_day, 1.0)
+        production *= SPLITTING_LEVEL_PENALTIES.get(self.model.splitting_level, 1.0)
 
         if self.model.mask_mandate:
-            production *= 0.95 #mask mandate reduces production by 5%
+            production *= MASK_PRODUCTION_FACTOR
         if self.model.social_distancing:
-            production *= 0.90  #social distancing reduces production by 10%
+            production *= DISTANCING_PRODUCTION_FACTOR
 
         if self.being_tested:
             production *= (1 - self.testing_impact)
@@ -338,10 +347,21 @@ class worker_agent(Agent):
             self.model.grid.remove_agent(self)
             return
 
+        profiler = self.model.profiler
         if not self.is_quarantined:
             self.move() #moves agent
+            if profiler is not None:
+                profiler.lap("movement")
             self.infection() #spreads disease
+            if profiler is not None:
+                profiler.lap("transmission")
         self.update_infection() #progresses disease
+        if profiler is not None:
+            profiler.lap("progression")
         self.update_production() #updates agent production output.
+        if profiler is not None:
+            profiler.lap("production")
         if self.model.schedule.steps % 50 == 0:
             self.introduce_infection()
+            if profiler is not None:
+                profiler.lap("introduction")
@@ -1,9 +1,12 @@
+QUARANTINE_DURATION = 40 #steps a quarantined agent that is not recovered stays out, doubled as a failsafe
+
+
 class QuarantineManager:
     """Class that handles how agents get sent to quarantine"""
     def __init__(self, model):
         self.model = model
         self.quarantine_zone = []
-        self.quarantine_duration = 40
+        self.quarantine_duration = QUARANTINE_DURATION
         self.quarantine_timers = {}
         self.quarantine_threshold = 1000 #Old functionality. Set this value to send any sick agents to quarentine after n steps of being sick.
         
@@ -61,6 +64,8 @@ class QuarantineManager:
                     0 <= pos[1] < self.model.grid.height):
                     valid_pos = pos
                 attempts += 1
+            if self.model.profiler is not None:
+                self.model.profiler.count("placement_retries", attempts - 1)
                 
             if valid_pos is None:
                 print(f"Warning: Could not find valid position for agent {agent.unique_id}")
@@ -1,45 +1,51 @@
+import copy
 import random
+
+FALSE_POSITIVE_RATE = 0.05
+FALSE_NEGATIVE_RATE = 0.14
+TESTING_LEVELS = { #Parameter dictionary for testing level. PRoportion is how many agents to test out of total pop
+    'none': {
+        'enabled': True,  # Default state
+        'proportion': 0,
+        'productivity_impact': 0,
+        'frequency': 0,
+        'impact_duration': 0
+    },
+    'light': {
+        'enabled': False,
+        'proportion': 0.2,
+        'productivity_impact': 0.15, #How much of an impact this testing schedule has on productivity
+        'frequency': 8, #How frequent the test schedule is ran
+        'impact_duration': 4
+    },
+    'medium': {
+        'enabled': False,
+        'proportion': 0.4,
+        'productivity_impact': 0.25,
+        'frequency': 10,
+        'impact_duration': 8
+    },
+    'heavy': {
+        'enabled': False,
+        'proportion': 0.65,
+        'productivity_impact': 0.40,
+        'frequency': 14,
+        'impact_duration': 10
+    }
+}
+
 class TestingManager:
     def __init__(self, model):
         self.model = model
-        self.false_positive_rate = 0.05
-        self.false_negative_rate = 0.14
+        self.false_positive_rate = FALSE_POSITIVE_RATE
+        self.false_negative_rate = FALSE_NEGATIVE_RATE
         self.tests_performed = 0
         self.last_test_step = -1
         self.impact_duration_remaining = 0  # Track remaining impact steps
         self.current_test_impact = 0  
         
         
-        self.testing_levels = { #Parameter dictionary for testing level. PRoportion is how many agents to test out of total pop
-            'none': {
-                'enabled': True,  # Default state
-                'proportion': 0,
-                'productivity_impact': 0,
-                'frequency': 0,
-                'impact_duration': 0
-            },
-            'light': {
-                'enabled': False,
-                'proportion': 0.2,
-                'productivity_impact': 0.15, #How much of an impact this testing schedule has on productivity
-                'frequency': 8, #How frequent the test schedule is ran
-                'impact_duration': 4
-            },
-            'medium': {
-                'enabled': False,
-                'proportion': 0.4,
-                'productivity_impact': 0.25,
-                'frequency': 10,
-                'impact_duration': 8
-            },
-            'heavy': {
-                'enabled': False,
-                'proportion': 0.65,
-                'productivity_impact': 0.40,
-                'frequency': 14,
-                'impact_duration': 10
-            }
-        }
+        self.testing_levels = copy.deepcopy(TESTING_LEVELS)
         
         self.next_test_steps = {
             level: 0
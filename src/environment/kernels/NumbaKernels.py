@@ -0,0 +1,180 @@
+"""Numba compiled versions of the NumpyKernels phases. Same signatures, same random draws and the same
+results (up to floating point rounding in the infection probabilities). Compiled functions are cached
+on disk (cache=True) so only the first run on a machine pays the compilation time."""
+import math
+import numba
+import numpy as np
+from src.environment.kernels.NumpyKernels import (HEALTHY, INFECTED, RECOVERED, INFECTION_DISTANCES,
+                                                  INFECTION_OFFSETS, MOVE_OFFSETS)
+
+
+@numba.njit(cache=True)
+def _occupied(occupancy, cx, cy):
+    width, height = occupancy.shape
+    return 0 <= cx < width and 0 <= cy < height and occupancy[cx, cy] > 0
+
+
+@numba.njit(cache=True)
+def move(x, y, base_x, base_y, x_start, x_end, movers, occupancy, distancing, choice_u, priority):
+    width, height = occupancy.shape
+    n = len(x)
+    target_x = x.copy()
+    target_y = y.copy()
+    fallback = np.zeros(n, dtype=np.bool_)
+    valid = np.zeros(4, dtype=np.bool_)
+    nearby = np.zeros(4, dtype=np.int64)
+
+    for i in range(n):
+        if not movers[i]:
+            continue
+        any_valid = False
+        any_spaced = False
+        fewest = 1 << 30
+        for k in range(4):
+            cx = base_x[i] + MOVE_OFFSETS[k, 0]
+            cy = base_y[i] + MOVE_OFFSETS[k, 1]
+            valid[k] = False
+            if cx < x_start[i] or cx >= x_end[i] or cx < 0 or cx >= width or cy < 0 or cy >= height:
+                continue
+            count = occupancy[cx, cy]
+            if count == 0 or (count == 1 and cx == x[i] and cy == y[i]):
+                valid[k] = True
+                any_valid = True
+                if distancing:
+                    crowded = (_occupied(occupancy, cx - 1, cy) or _occupied(occupancy, cx + 1, cy) or
+                               _occupied(occupancy, cx, cy - 1) or _occupied(occupancy, cx, cy + 1))
+                    if not crowded:
+                        any_spaced = True
+                    nearby[k] = 0
+                    for dx in range(-2, 3):
+                        for dy in range(-2, 3):
+                            if (dx != 0 or dy != 0) and _occupied(occupancy, cx + dx, cy + dy):
+                                nearby[k] += 1
+                    if nearby[k] < fewest:
+                        fewest = nearby[k]
+
+        if not any_valid:
+            fallback[i] = True
+            target_x[i] = x_start[i]
+            target_y[i] = 0
+            continue
+
+        best = -1.0
+        for k in range(4):
+            if not valid[k]:
+                continue
+            cx = base_x[i] + MOVE_OFFSETS[k, 0]
+            cy = base_y[i] + MOVE_OFFSETS[k, 1]
+            if distancing:
+                crowded = (_occupied(occupancy, cx - 1, cy) or _occupied(occupancy, cx + 1, cy) or
+                           _occupied(occupancy, cx, cy - 1) or _occupied(occupancy, cx, cy + 1))
+                if any_spaced and crowded:
+                    continue
+                if not any_spaced and nearby[k] != fewest:
+                    continue
+            if choice_u[i, k] > best:
+                best = choice_u[i, k]
+                target_x[i] = cx
+                target_y[i] = cy
+
+    claimed = np.zeros(width * height, dtype=np.bool_)
+    for j in range(n):
+        i = priority[j]
+        if not movers[i]:
+            continue
+        if not fallback[i]:
+            if target_x[i] == x[i] and target_y[i] == y[i]:
+                continue
+            cell = target_x[i] * height + target_y[i]
+            if claimed[cell]:
+                continue
+            claimed[cell] = True
+        occupancy[x[i], y[i]] -= 1
+        x[i] = target_x[i]
+        y[i] = target_y[i]
+        occupancy[x[i], y[i]] += 1
+
+
+@numba.njit(cache=True)
+def transmit(x, y, health, had_covid, on_grid, section_of_x, section_probability, distance_probability,
+             modifier, prior_factor, infection_u, width, height):
+    n = len(x)
+    infected = np.zeros(n, dtype=np.bool_)
+
+    #Bucket the healthy workers on the floor by cell (counting sort)
+    cell_start = np.zeros(width * height + 1, dtype=np.int64)
+    for i in range(n):
+        if on_grid[i] and health[i] == HEALTHY:
+            cell_start[x[i] * height + y[i] + 1] += 1
+    for c in range(width * height):
+        cell_start[c + 1] += cell_start[c]
+    fill = cell_start[:-1].copy()
+    members = np.empty(cell_start[-1], dtype=np.int64)
+    for i in range(n):
+        if on_grid[i] and health[i] == HEALTHY:
+            cell = x[i] * height + y[i]
+            members[fill[cell]] = i
+            fill[cell] += 1
+
+    log_escape = np.zeros(n)
+    for s in range(n):
+        if not on_grid[s] or health[s] != INFECTED:
+            continue
+        source_probability = section_probability[section_of_x[x[s]]] * modifier
+        for k in range(len(INFECTION_DISTANCES)):
+            tx = x[s] + INFECTION_OFFSETS[k, 0]
+            ty = y[s] + INFECTION_OFFSETS[k, 1]
+            if tx < 0 or tx >= width or ty < 0 or ty >= height:
+                continue
+            exposure = distance_probability[INFECTION_DISTANCES[k]] * source_probability
+            cell = tx * height + ty
+            for m in range(cell_start[cell], cell_start[cell + 1]):
+                i = members[m]
+                if had_covid[i]:
+                    log_escape[i] += math.log1p(-exposure * prior_factor)
+                else:
+                    log_escape[i] += math.log1p(-exposure)
+
+    for i in range(n):
+        if on_grid[i] and health[i] == HEALTHY and infection_u[i] < -math.expm1(log_escape[i]):
+            infected[i] = True
+    return infected
+
+
+@numba.njit(cache=True)
+def progress(health, infection_time, had_covid, infection_steps, recovery_steps):
+    for i in range(len(health)):
+        if health[i] == INFECTED:
+            infection_time[i] += 1
+            had_covid[i] = True
+            if infection_time[i] > infection_steps:
+                health[i] = RECOVERED
+        elif health[i] == RECOVERED:
+            infection_time[i] += 1
+            if infection_time[i] > recovery_steps:
+                health[i] = HEALTHY
+                infection_time[i] = 0
+
+
+@numba.njit(cache=True)
+def production(health, quarantined, health_production, step_factor, out):
+    for i in range(len(health)):
+        out[i] = 0.0 if quarantined[i] else health_production[health[i]] * step_factor
+
+
+def warmup():
+    """Compiles (or loads from the on-disk cache) every kernel on a tiny floor"""
+    n = 2
+    x = np.array([0, 1], dtype=np.int64)
+    y = np.array([0, 1], dtype=np.int64)
+    occupancy = np.zeros((4, 4), dtype=np.int32)
+    occupancy[0, 0] = occupancy[1, 1] = 1
+    movers = np.ones(n, dtype=np.bool_)
+    move(x, y, x.copy(), y.copy(), np.zeros(n, dtype=np.int64), np.full(n, 4, dtype=np.int64), movers, occupancy,
+         True, np.random.random((n, 4)), np.arange(n))
+    health = np.array([HEALTHY, INFECTED], dtype=np.int8)
+    had_covid = np.zeros(n, dtype=np.bool_)
+    transmit(x, y, health, had_covid, movers, np.zeros(4, dtype=np.int64), np.ones(1), np.full(4, 0.1),
+             1.0, 0.5, np.random.random(n), 4, 4)
+    progress(health, np.zeros(n, dtype=np.int32), had_covid, 40, 80)
+    production(health, np.zeros(n, dtype=np.bool_), np.ones(4), 1.0, np.zeros(n))
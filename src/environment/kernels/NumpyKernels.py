@@ -0,0 +1,129 @@
+import numpy as np
+
+#Health states of the vectorized engine
+HEALTHY, INFECTED, RECOVERED, DEATH = 0, 1, 2, 3
+
+#2x2 workspace offsets in the same order as worker_agent.get_valid_positions
+MOVE_OFFSETS = np.array([(0, 0), (0, 1), (1, 0), (1, 1)], dtype=np.int64)
+
+#Cell offsets within Manhattan distance 3 of an infected worker and their distances
+INFECTION_OFFSETS = np.array([(dx, dy) for dx in range(-3, 4) for dy in range(-3, 4) if abs(dx) + abs(dy) <= 3],
+                             dtype=np.int64)
+INFECTION_DISTANCES = np.abs(INFECTION_OFFSETS).sum(axis=1)
+
+
+def neighbour_counts(occupied, radius, manhattan_limit):
+    """Number of occupied cells around every cell within the given window, center excluded. Cells off the
+    grid count as empty."""
+    width, height = occupied.shape
+    padded = np.zeros((width + 2 * radius, height + 2 * radius), dtype=np.int32)
+    padded[radius:radius + width, radius:radius + height] = occupied
+    counts = np.zeros((width, height), dtype=np.int32)
+    for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+            if (dx == 0 and dy == 0) or abs(dx) + abs(dy) > manhattan_limit:
+                continue
+            counts += padded[radius + dx:radius + dx + width, radius + dy:radius + dy + height]
+    return counts
+
+
+def move(x, y, base_x, base_y, x_start, x_end, movers, occupancy, distancing, choice_u, priority):
+    """Moves every mover to a random free cell of its 2x2 workspace (worker_agent.move).
+
+    All movers choose at the same time from the occupancy at the start of the phase. With social distancing,
+    cells with an occupied 4-neighbour are avoided and, if every cell has one, the cells with the fewest
+    occupied cells in the surrounding 5x5 window are used. Workers with no free workspace cell fall back
+    to the corner of their section like the agent model. When several workers pick the same cell the one
+    earliest in `priority` gets it and the others stay put. Updates x, y and occupancy in place."""
+    width, height = occupancy.shape
+    cand_x = base_x[:, None] + MOVE_OFFSETS[:, 0]
+    cand_y = base_y[:, None] + MOVE_OFFSETS[:, 1]
+    in_bounds = ((cand_x >= x_start[:, None]) & (cand_x < x_end[:, None]) & (cand_x >= 0) & (cand_x < width) &
+                 (cand_y >= 0) & (cand_y < height))
+    safe_x = np.clip(cand_x, 0, width - 1)
+    safe_y = np.clip(cand_y, 0, height - 1)
+    cell_count = occupancy[safe_x, safe_y]
+    own = (cand_x == x[:, None]) & (cand_y == y[:, None])
+    valid = in_bounds & ((cell_count == 0) | (own & (cell_count == 1))) & movers[:, None]
+
+    if distancing:
+        occupied = occupancy > 0
+        crowded = neighbour_counts(occupied, 1, 1)[safe_x, safe_y] > 0
+        nearby = neighbour_counts(occupied, 2, 4)[safe_x, safe_y]
+        spaced = valid & ~crowded
+        fewest = np.where(valid, nearby, np.iinfo(np.int32).max).min(axis=1)
+        least_crowded = valid & (nearby == fewest[:, None])
+        candidates = np.where(spaced.any(axis=1)[:, None], spaced, least_crowded)
+    else:
+        candidates = valid
+
+    choice = np.argmax(np.where(candidates, choice_u, -1.0), axis=1)
+    rows = np.arange(len(x))
+    target_x = cand_x[rows, choice]
+    target_y = cand_y[rows, choice]
+    fallback = movers & ~candidates.any(axis=1)
+    target_x[fallback] = x_start[fallback]
+    target_y[fallback] = 0
+
+    #Resolve workers heading for the same free cell in priority order
+    contested = movers & ~fallback & ((target_x != x) | (target_y != y))
+    ordered = priority[contested[priority]]
+    cells = target_x[ordered] * height + target_y[ordered]
+    _, first = np.unique(cells, return_index=True)
+    winners = np.zeros(len(x), dtype=bool)
+    winners[ordered[first]] = True
+    moving = fallback | winners
+
+    np.subtract.at(occupancy, (x[moving], y[moving]), 1) #several movers can leave one stacked cell
+    x[moving] = target_x[moving]
+    y[moving] = target_y[moving]
+    np.add.at(occupancy, (x[moving], y[moving]), 1)
+
+
+def transmit(x, y, health, had_covid, on_grid, section_of_x, section_probability, distance_probability,
+             modifier, prior_factor, infection_u, width, height):
+    """Returns the healthy workers infected this step (worker_agent.infection). Every infected worker on the
+    floor exposes the healthy workers within Manhattan distance 3 with the distance probability scaled by
+    the infection level of its own section and the policy modifier. A healthy worker escapes each exposure
+    independently and is infected when infection_u is below one minus its total escape probability."""
+    sources = np.flatnonzero(on_grid & (health == INFECTED))
+    infected = np.zeros(len(x), dtype=bool)
+    if len(sources) == 0:
+        return infected
+
+    target_x = (x[sources, None] + INFECTION_OFFSETS[:, 0]).ravel()
+    target_y = (y[sources, None] + INFECTION_OFFSETS[:, 1]).ravel()
+    exposure = (distance_probability[INFECTION_DISTANCES][None, :] *
+                section_probability[section_of_x[x[sources]]][:, None] * modifier).ravel()
+    inside = (target_x >= 0) & (target_x < width) & (target_y >= 0) & (target_y < height)
+    cells = target_x[inside] * height + target_y[inside]
+    exposure = exposure[inside]
+
+    targets = np.flatnonzero(on_grid & (health == HEALTHY))
+    target_cells = x[targets] * height + y[targets]
+    log_escape = np.bincount(cells, weights=np.log1p(-exposure), minlength=width * height)[target_cells]
+    log_escape_prior = np.bincount(cells, weights=np.log1p(-exposure * prior_factor),
+                                   minlength=width * height)[target_cells]
+    log_escape = np.where(had_covid[targets], log_escape_prior, log_escape)
+    infected[targets] = infection_u[targets] < -np.expm1(log_escape)
+    return infected
+
+
+def progress(health, infection_time, had_covid, infection_steps, recovery_steps):
+    """Advances infection timers in place (worker_agent.update_infection)"""
+    infected = health == INFECTED
+    recovered = health == RECOVERED
+    infection_time[infected] += 1
+    had_covid[infected] = True
+    health[infected & (infection_time > infection_steps)] = RECOVERED
+
+    infection_time[recovered] += 1
+    back_to_healthy = recovered & (infection_time > recovery_steps)
+    health[back_to_healthy] = HEALTHY
+    infection_time[back_to_healthy] = 0
+
+
+def production(health, quarantined, health_production, step_factor, out):
+    """Writes every worker's current production into out (worker_agent.update_production)"""
+    np.multiply(health_production[health], step_factor, out=out)
+    out[quarantined] = 0.0
@@ -0,0 +1,182 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import json
+import math
+import statistics
+from concurrent.futures import ProcessPoolExecutor, wait
+from src.evaluation.Evaluator import OUTCOMES, run_batch
+
+#Outcomes where bigger is better, everything else is ranked smallest first
+MAXIMIZED = ("productivity",)
+
+
+class RunningStats:
+    """Streaming mean and variance of one outcome (Welford's algorithm)"""
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else float("inf")
+
+    def half_width(self, confidence=0.95):
+        """Half width of the normal approximation confidence interval of the mean"""
+        if self.n < 2:
+            return float("inf")
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        return z * math.sqrt(self.variance / self.n)
+
+    def interval(self, confidence=0.95):
+        half_width = self.half_width(confidence)
+        return self.mean - half_width, self.mean + half_width
+
+
+class EnsembleCandidate:
+    """One config/policy pair of an ensemble with the running statistics of every outcome"""
+    def __init__(self, name, policy, config=None, base_seed=0):
+        self.name = name
+        self.policy = policy
+        self.config = config
+        self.next_seed = base_seed
+        self.stats = {outcome: RunningStats() for outcome in OUTCOMES}
+
+    @property
+    def replicates(self):
+        return self.stats[OUTCOMES[0]].n
+
+    def take_seeds(self, count):
+        seeds = list(range(self.next_seed, self.next_seed + count))
+        self.next_seed += count
+        return seeds
+
+    def add(self, record):
+        for outcome in OUTCOMES:
+            self.stats[outcome].update(record[outcome])
+
+    def precise(self, precision, relative=True, confidence=0.95):
+        """Checks if every outcome in precision reached its requested confidence interval half width"""
+        for outcome, target in precision.items():
+            stats = self.stats[outcome]
+            limit = target * abs(stats.mean) if relative else target
+            if stats.half_width(confidence) > limit:
+                return False
+        return True
+
+    def summary(self, confidence=0.95):
+        """Same layout as Evaluator.summarize_results so print_summary works on ensemble results"""
+        result = {"episodes": self.replicates}
+        for outcome, stats in self.stats.items():
+            low, high = stats.interval(confidence) if stats.n > 1 else (stats.mean, stats.mean)
+            result[outcome] = {"mean": stats.mean, "low": low, "high": high}
+        return result
+
+
+def uncertain_candidates(candidates, objective, top_k=None, confidence=0.95):
+    """Candidates whose rank on the objective is still undecided.
+
+    Without top_k a candidate is uncertain while its confidence interval overlaps any other candidate's.
+    With top_k only the top-k boundary matters: candidates that are clearly inside (lower bound above the
+    (k+1)-th best upper bound) or clearly outside (upper bound below the k-th best lower bound) are settled.
+    A lone candidate is never settled by ranking, only by its precision target."""
+    if len(candidates) == 1:
+        return list(candidates)
+    sign = 1 if objective in MAXIMIZED else -1
+    #Work on sign adjusted intervals so bigger is always better
+    intervals = {}
+    for c in candidates:
+        low, high = c.stats[objective].interval(confidence)
+        intervals[c.name] = (low, high) if sign > 0 else (-high, -low)
+
+    if top_k is None or top_k >= len(candidates):
+        uncertain = []
+        for c in candidates:
+            low, high = intervals[c.name]
+            if any(other.name != c.name and intervals[other.name][0] <= high and low <= intervals[other.name][1]
+                   for other in candidates):
+                uncertain.append(c)
+        return uncertain
+
+    lows = sorted((interval[0] for interval in intervals.values()), reverse=True)
+    highs = sorted((interval[1] for interval in intervals.values()), reverse=True)
+    kth_low = lows[top_k - 1]
+    next_high = highs[top_k]
+    return [c for c in candidates
+            if not (intervals[c.name][0] > next_high or intervals[c.name][1] < kth_low)]
+
+
+def adaptive_sweep(candidates, objective="productivity", precision=None, relative=True, top_k=None,
+                   num_days=10, batch_size=8, min_replicates=8, max_replicates=200, max_episodes=None,
+                   confidence=0.95, workers=None, cache_dir=None, output=None):
+    """Runs replicates of several candidates in batches and stops each one adaptively.
+
+    candidates is a list of EnsembleCandidate. Every round, candidates whose objective ranking is still
+    uncertain (see uncertain_candidates) and whose confidence intervals are wider than `precision`
+    (outcome -> half width, a fraction of the mean when relative) get another batch of replicates. By default
+    that is 2% of the objective's mean; absolute half widths depend on each outcome's scale, so they must be
+    given. Candidates that are clearly better or worse than the rest stop early, so replicates go where they
+    change the ranking. Returns {name: summary}."""
+    if precision is None:
+        if not relative:
+            raise ValueError("Absolute precision targets depend on the outcome's scale, give them per outcome")
+        precision = {objective: 0.02}
+    workers = workers or os.cpu_count()
+    total = 0
+    out = open(output, "a") if output else None
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        round_number = 0
+        while True:
+            unresolved = [c for c in candidates if c.replicates < min_replicates]
+            if not unresolved:
+                unresolved = [c for c in uncertain_candidates(candidates, objective, top_k, confidence)
+                              if not c.precise(precision, relative, confidence)]
+            active = [c for c in unresolved if c.replicates < max_replicates]
+            if not active or (max_episodes is not None and total >= max_episodes):
+                break
+
+            #Split the round into enough tasks to keep every worker busy, but no smaller than needed
+            chunk = max(1, (batch_size * len(active)) // (2 * workers))
+            futures = {}
+            for candidate in active:
+                count = batch_size if candidate.replicates >= min_replicates else min_replicates - candidate.replicates
+                seeds = candidate.take_seeds(count)
+                for i in range(0, len(seeds), chunk):
+                    future = executor.submit(run_batch, candidate.name, candidate.policy, seeds[i:i + chunk],
+                                             candidate.config, num_days, cache_dir)
+                    futures[future] = candidate
+
+            wait(futures)
+            for future, candidate in futures.items():
+                for record in future.result():
+                    candidate.add(record)
+                    total += 1
+                    if out is not None:
+                        out.write(json.dumps(record) + "\n")
+            if out is not None:
+                out.flush()
+
+            round_number += 1
+            print(f"Round {round_number}: {len(active)} candidates still uncertain, {total} episodes run")
+
+    if out is not None:
+        out.close()
+    return {c.name: c.summary(confidence) for c in candidates}
+
+
+def run_ensemble(policy, config=None, precision=None, relative=True, name="ensemble", **kwargs):
+    """Runs replicates of a single config/policy until every outcome in precision reaches its confidence
+    interval half width (relative to its mean unless relative is False). Returns the summary of the ensemble."""
+    candidate = EnsembleCandidate(name, policy, config, kwargs.pop("base_seed", 0))
+    objective = next(iter(precision)) if precision else "productivity"
+    result = adaptive_sweep([candidate], objective=objective, precision=precision, relative=relative, **kwargs)
+    return result[name]
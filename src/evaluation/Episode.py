@@ -0,0 +1,219 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import contextlib
+import numpy as np
+from src.environment.FactoryModel import factory_model
+from src.environment.FactoryConfig import FactoryConfig, build_action_space
+
+#Per-day metrics recorded for every episode, in column order
+DAILY_METRICS = ("healthy", "infected", "recovered", "death", "productivity", "new_infections", "quarantined")
+
+#Base environment used by Train.py (config=None with a 50x25 floor and 100 workers)
+DEFAULT_CONFIG = {"width": 50, "height": 25, "num_agents": 100}
+
+
+class StaticPolicy:
+    """Applies the same action dictionary every day"""
+    def __init__(self, action):
+        self.action = dict(action)
+        self.schedule = [self.action]
+
+    def reset(self):
+        pass
+
+    def __call__(self, state):
+        return self.action
+
+
+class SchedulePolicy:
+    """Open loop policy that applies schedule[day] at the start of each day. The last entry is held once the
+    schedule runs out and None entries keep the current configuration."""
+    def __init__(self, schedule):
+        self.schedule = [dict(action) if action is not None else None for action in schedule]
+        self.day = 0
+
+    def reset(self):
+        self.day = 0
+
+    def __call__(self, state):
+        action = self.schedule[min(self.day, len(self.schedule) - 1)]
+        self.day += 1
+        return action
+
+
+class CallablePolicy:
+    """Wraps a function of the model state. The function returns an action dictionary, an index into
+    the action space or None to keep the current configuration. Must be a module level function so it
+    can be sent to worker processes."""
+    def __init__(self, fn, action_space=None):
+        self.fn = fn
+        self.action_space = action_space
+
+    def reset(self):
+        pass
+
+    def __call__(self, state):
+        action = self.fn(state)
+        if action is None or isinstance(action, dict):
+            return action
+        if self.action_space is None:
+            self.action_space = build_action_space()
+        return self.action_space[int(action)]
+
+
+class NetworkPolicy:
+    """Greedy policy of an exported DQN (a QNetwork state_dict saved with DQNAgent.save_model, or a Q network
+    ensemble saved with EnsembleDQNAgent.save_model, which acts by majority vote).
+    The network is loaded lazily so the policy stays cheap to pickle. With cache its greedy actions are
+    memoized by observation (CachedPolicy), and the hit rate is in cache.stats()."""
+    def __init__(self, path, state_dim=8, cache=True):
+        self.path = path
+        self.state_dim = state_dim
+        self.use_cache = cache
+        self.action_space = None
+        self.agent = None
+        self.cache = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['agent'] = None
+        state['cache'] = None
+        return state
+
+    def reset(self):
+        if self.agent is not None:
+            #DQNAgent normalizes against the first state it sees, same as a freshly loaded agent in Run.py
+            self.agent.state_mean = None
+            self.agent.state_std = None
+
+    def __call__(self, state):
+        if self.agent is None:
+            import torch
+            from src.model.ensemble_dqn_agent import load_agent
+            torch.set_num_threads(1) #one intra-op thread per worker process, the pool already uses every core
+            self.action_space = build_action_space()
+            self.agent = load_agent(self.path, self.state_dim, len(self.action_space))
+            if self.use_cache:
+                from src.model.policy_cache import CachedPolicy
+                self.cache = CachedPolicy(self.agent)
+        actor = self.cache if self.cache is not None else self.agent
+        return self.action_space[actor.select_action(state, train=False)]
+
+
+def action_name(action):
+    """Short readable key for an action dictionary"""
+    return (f"clean={action['cleaning_type']},split={action['splitting_level']},test={action['testing_level']},"
+            f"sd={int(action['social_distancing'])},mask={int(action['mask_mandate'])},shifts={action['shifts_per_day']}")
+
+
+def static_policies(action_space=None):
+    """One StaticPolicy per action of the 768 configuration action space, keyed by action_name"""
+    action_space = action_space if action_space is not None else build_action_space()
+    return {action_name(action): StaticPolicy(action) for action in action_space}
+
+
+def config_changed(model, action):
+    """Checks if an action differs from the model's current configuration"""
+    return (
+        action.get('cleaning_type', model.initial_cleaning) != model.initial_cleaning or
+        action.get('splitting_level', model.splitting_level) != model.splitting_level or
+        action.get('testing_level', model.test_lvl) != model.test_lvl or
+        action.get('social_distancing', model.social_distancing) != model.social_distancing or
+        action.get('mask_mandate', model.mask_mandate) != model.mask_mandate or
+        action.get('shifts_per_day', model.shifts_per_day) != model.shifts_per_day
+    )
+
+
+def apply_action(model, action):
+    """Applies an action to a running model. Splitting changes re-place the active workers on the new
+    floor layout first, same as the DQN runner in Run.py. Models without a grid (the compartmental
+    surrogate) only get update_config."""
+    if not config_changed(model, action):
+        return False
+    if ('splitting_level' in action and hasattr(model, 'grid_manager') and
+            action['splitting_level'] != model.grid_manager.splitting_level):
+        active_agents = [agent for agent in model.schedule.agents
+                         if not agent.is_dead and not agent.is_quarantined]
+        for agent in active_agents:
+            if agent.pos is not None:
+                model.grid.remove_agent(agent)
+                agent.pos = None
+
+        model.splitting_level = action['splitting_level']
+        positions = model.grid_manager.get_random_positions(len(active_agents))
+        for agent, new_pos in zip(active_agents, positions):
+            if model.grid.is_cell_empty(new_pos):
+                model.grid.place_agent(agent, new_pos)
+                agent.set_base_position(new_pos)
+
+    model.update_config(action)
+    return True
+
+
+@contextlib.contextmanager
+def silenced(quiet=True):
+    """Suppresses the model's progress prints (cleaning, testing, config changes) during batch runs"""
+    if not quiet:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def build_model(config=None, seed=None):
+    """Creates a headless factory_model from FactoryConfig keyword arguments"""
+    config = FactoryConfig(**{**DEFAULT_CONFIG, **(config or {}), "visualization": False})
+    return factory_model(config.width, config.height, config.num_agents, config=config, seed=seed)
+
+
+def iter_episode(policy=None, config=None, seed=None, num_days=10, model=None):
+    """Generator form of run_episode that yields each day's row of DAILY_METRICS as soon as the day ends, so
+    callers can stream results or step several episodes in lockstep. Does not silence the model."""
+    if model is None:
+        model = build_model(config, seed)
+    if policy is not None:
+        policy.reset()
+    steps_per_day = model.steps_per_day
+
+    for day in range(num_days):
+        if policy is not None:
+            action = policy(model.get_state())
+            if action is not None:
+                apply_action(model, action)
+
+        productivity = 0.0
+        new_infections = 0
+        quarantined = 0
+        for _ in range(steps_per_day):
+            results = model.step()
+            productivity += results['productivity']
+            new_infections += results['new_infections']
+            quarantined += results['quarantined']
+
+        state = model.get_state()[:4] #healthy, infected, recovered, death
+        yield state + [productivity / steps_per_day, new_infections, quarantined / steps_per_day]
+
+
+def run_episode(policy=None, config=None, seed=None, num_days=10, quiet=True, model=None):
+    """Runs one headless episode. The policy is queried with model.get_state() at the start of every day
+    and its action is applied when it changes the configuration. A prebuilt model (for example a
+    compartmental_model) can be passed instead of a config. Returns a dict of per-day numpy arrays
+    keyed by DAILY_METRICS."""
+    daily = np.zeros((num_days, len(DAILY_METRICS)))
+    with silenced(quiet):
+        for day, row in enumerate(iter_episode(policy, config, seed, num_days, model)):
+            daily[day] = row
+    return {name: daily[:, i] for i, name in enumerate(DAILY_METRICS)}
+
+
+def summarize_episode(daily):
+    """Reduces per-day arrays to the episode outcomes: productivity (worker-days of output), infections,
+    deaths and quarantine days"""
+    return {
+        "productivity": float(np.sum(daily["productivity"])),
+        "infections": float(np.sum(daily["new_infections"])),
+        "deaths": float(daily["death"][-1]) if len(daily["death"]) else 0.0,
+        "quarantine_days": float(np.sum(daily["quarantined"])),
+    }
@@ -0,0 +1,186 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import hashlib
+import json
+import math
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from src.evaluation.Episode import NetworkPolicy, run_episode, static_policies, summarize_episode
+from src.environment.FactoryModel import ENGINE_VERSION
+from src.evaluation.ResultCache import ResultCache, canonical_config
+
+OUTCOMES = ("productivity", "infections", "deaths", "quarantine_days")
+
+
+def run_batch(name, policy, seeds, config, num_days, cache_dir=None):
+    """Worker process entry point. Runs one policy over a batch of seeds and returns one record per episode.
+    Open loop policies (static configs and schedules) are served from the result cache when one is given."""
+    cache = ResultCache(cache_dir) if cache_dir and hasattr(policy, "schedule") else None
+    records = []
+    for seed in seeds:
+        start = time.perf_counter()
+        if cache is not None:
+            daily = cache.get_or_run(config, policy.schedule, seed, num_days)
+        else:
+            daily = run_episode(policy, config=config, seed=seed, num_days=num_days)
+        record = {"policy": name, "seed": seed, **summarize_episode(daily)}
+        record["seconds"] = time.perf_counter() - start
+        records.append(record)
+    if cache is not None:
+        cache.close()
+    return records
+
+
+def setup_key(config, num_days):
+    """Hash of everything besides the policy and seed that an evaluation's episodes depend on"""
+    setup = {"config": canonical_config(config), "num_days": num_days, "engine": ENGINE_VERSION}
+    encoded = json.dumps(setup, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def policy_version(policy):
+    """Content hash of a network policy's model file, so a retrained network under the same name does not
+    reuse the old network's episodes. None for policies defined by their name alone."""
+    path = getattr(policy, "path", None)
+    if path is None:
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def load_records(path):
+    """Reads the episode records written by evaluate_policies. Tolerates a truncated last line from an interrupted run."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def evaluate_policies(policies, replicates=30, num_days=10, config=None, base_seed=0, workers=None,
+                      output="evaluation_results.jsonl", batch_size=4, cache_dir=None):
+    """Evaluates every policy over the same `replicates` seeds (common random numbers) on a process pool.
+
+    policies maps a name to a StaticPolicy, CallablePolicy or NetworkPolicy. Each finished episode is
+    appended to `output` as a JSON line, so an interrupted evaluation resumes where it stopped. Records
+    carry num_days, a hash of the config (setup_key) and, for network policies, a hash of the model file
+    (policy_version): episodes of another setup or another network in the same file are neither reused
+    nor summarized. With cache_dir set, static and scheduled policies reuse results from
+    the on disk ResultCache. Returns the summary produced by summarize_results over the requested policies
+    and seeds."""
+    workers = workers or os.cpu_count()
+    seeds = [base_seed + i for i in range(replicates)]
+    setup = setup_key(config, num_days)
+    versions = {name: policy_version(policy) for name, policy in policies.items()}
+
+    def current(records):
+        wanted = set(seeds)
+        return [r for r in records if r.get("setup") == setup and r["policy"] in policies and r["seed"] in wanted
+                and r.get("policy_version") == versions[r["policy"]]]
+
+    done = {(r["policy"], r["seed"]) for r in current(load_records(output))}
+    batches = []
+    for name, policy in policies.items():
+        pending = [seed for seed in seeds if (name, seed) not in done]
+        for i in range(0, len(pending), batch_size):
+            batches.append((name, policy, pending[i:i + batch_size]))
+
+    total = sum(len(b[2]) for b in batches)
+    print(f"Evaluating {len(policies)} policies x {replicates} replicates: {total} episodes to run, {len(done)} already done")
+
+    finished = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(output, "a") as f:
+        pending_futures = set()
+        batch_iter = iter(batches)
+        # Keep a bounded number of batches in flight so 100k episode runs don't queue every task up front
+        for batch in batch_iter:
+            pending_futures.add(executor.submit(run_batch, *batch, config, num_days, cache_dir))
+            if len(pending_futures) >= 2 * workers:
+                break
+
+        while pending_futures:
+            completed, pending_futures = wait(pending_futures, return_when=FIRST_COMPLETED)
+            for future in completed:
+                for record in future.result():
+                    f.write(json.dumps({**record, "num_days": num_days, "setup": setup,
+                                        "policy_version": versions[record["policy"]]}) + "\n")
+                finished += len(future.result())
+                next_batch = next(batch_iter, None)
+                if next_batch is not None:
+                    pending_futures.add(executor.submit(run_batch, *next_batch, config, num_days, cache_dir))
+            f.flush()
+            elapsed = time.perf_counter() - start
+            print(f"  {finished}/{total} episodes ({finished / max(elapsed, 1e-9):.2f} episodes/sec)")
+
+    return summarize_results(current(load_records(output)))
+
+
+def confidence_interval(values, confidence=0.95):
+    """Mean and normal approximation confidence interval of a list of values"""
+    n = len(values)
+    mean = statistics.fmean(values)
+    if n < 2:
+        return mean, mean, mean
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z * statistics.stdev(values) / math.sqrt(n)
+    return mean, mean - half_width, mean + half_width
+
+
+def summarize_results(records, confidence=0.95):
+    """Groups episode records by policy and reports mean and confidence interval of every outcome"""
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record["policy"], []).append(record)
+
+    summary = {}
+    for name, group in grouped.items():
+        summary[name] = {"episodes": len(group)}
+        for outcome in OUTCOMES:
+            mean, low, high = confidence_interval([r[outcome] for r in group], confidence)
+            summary[name][outcome] = {"mean": mean, "low": low, "high": high}
+    return summary
+
+
+def print_summary(summary, sort_by="productivity", top=20):
+    """Prints the best policies by the mean of one outcome"""
+    ranked = sorted(summary.items(), key=lambda item: item[1][sort_by]["mean"], reverse=sort_by == "productivity")
+    for name, stats in ranked[:top]:
+        line = ", ".join(f"{o}={stats[o]['mean']:.2f} [{stats[o]['low']:.2f}, {stats[o]['high']:.2f}]" for o in OUTCOMES)
+        print(f"{name} (n={stats['episodes']}): {line}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the trained DQN against every static configuration")
+    parser.add_argument("--model", default="dqn_factory_model.pth", help="exported QNetwork to evaluate, empty to skip")
+    parser.add_argument("--replicates", type=int, default=30)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="evaluation_results.jsonl")
+    parser.add_argument("--cache", default=None, help="result cache directory for static policies")
+    args = parser.parse_args(argv)
+
+    policies = static_policies()
+    if args.model:
+        policies["dqn"] = NetworkPolicy(args.model)
+    summary = evaluate_policies(policies, replicates=args.replicates, num_days=args.days,
+                                base_seed=args.seed, workers=args.workers, output=args.output,
+                                cache_dir=args.cache)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
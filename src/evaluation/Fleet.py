@@ -0,0 +1,344 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import multiprocessing
+import time
+import traceback
+import numpy as np
+from src.evaluation.Episode import DAILY_METRICS
+
+#Engines a site can run on. Sites are daemon processes, which cannot start the distributed engine's stripes.
+SITE_ENGINES = ("python", "numpy", "numba", "compartmental")
+
+
+def load_fleet(path):
+    """Reads a fleet spec (JSON) and checks it.
+
+    {"days": 30, "seed": 0, "mixing": 0.0005,
+     "links": [{"from": "plant_a", "to": "warehouse", "rate": 0.01}],
+     "fleet_policy": {"threshold": 0.1, "action": 575},
+     "sites": [{"name": "plant_a", "config": {"num_agents": 300, "width": 80, "height": 40}, "action": 5},
+               {"name": "warehouse", "engine": "numpy", "schedule": [0, null, 12]},
+               {"name": "plant_b", "model": "dqn_factory_model.pth"}]}
+
+    A link's rate is the expected number of infections carried from one site to the other per day per
+    infected worker at the source (shared contractors, drivers, transfers). mixing is a rate added between
+    every pair of sites. Each site has its own FactoryConfig, engine and seed (seed + site index by
+    default) and optionally its own policy: a static action, a schedule or a saved network. Compartmental
+    sites can name a fitted parameter file (SurrogateFit) under "params". fleet_policy
+    (see FleetThresholdPolicy) overrides the site policies while it is active."""
+    with open(path) as f:
+        spec = json.load(f)
+    spec.setdefault("days", 10)
+    spec.setdefault("seed", 0)
+    spec.setdefault("mixing", 0.0)
+    spec.setdefault("links", [])
+    sites = spec.get("sites") or []
+    if not sites:
+        raise ValueError("A fleet needs at least one site")
+    names = [site.get("name") for site in sites]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError("Every site needs a unique name")
+    for i, site in enumerate(sites):
+        site.setdefault("config", {})
+        site.setdefault("engine", "python")
+        site.setdefault("seed", spec["seed"] + i)
+        if site["engine"] not in SITE_ENGINES:
+            raise ValueError(f"Site {site['name']}: unknown engine {site['engine']!r}, expected one of {SITE_ENGINES}")
+        if sum(key in site for key in ("action", "schedule", "model")) > 1:
+            raise ValueError(f"Site {site['name']}: give one of action, schedule or model")
+    for link in spec["links"]:
+        if link.get("from") not in names or link.get("to") not in names:
+            raise ValueError(f"Link {link} names a site that is not in the fleet")
+    return spec
+
+
+def rate_matrix(spec):
+    """rates[i, j]: expected infections carried from site i to site j per day per infected worker at i"""
+    names = [site["name"] for site in spec["sites"]]
+    rates = np.full((len(names), len(names)), float(spec["mixing"]))
+    np.fill_diagonal(rates, 0.0)
+    for link in spec["links"]:
+        rates[names.index(link["from"]), names.index(link["to"])] += link["rate"]
+    return rates
+
+
+def import_infections(model, count):
+    """Infects up to count healthy workers on the floor, chosen with the model's own random generator.
+    Returns how many were infected. Works for factory_model, vectorized_model and compartmental_model."""
+    if count <= 0:
+        return 0
+    if hasattr(model, "schedule"):
+        healthy = [agent for agent in model.schedule.agents
+                   if agent.health_status == "healthy" and not agent.is_quarantined and not agent.is_dead]
+        chosen = model.random.sample(healthy, min(count, len(healthy)))
+        for agent in chosen:
+            agent.health_status = "infected"
+            agent.had_covid = True
+        return len(chosen)
+    if hasattr(model, "health"):
+        from src.environment.kernels.NumpyKernels import HEALTHY, INFECTED
+        healthy = np.flatnonzero((model.health == HEALTHY) & ~model.quarantined)
+        chosen = model.rng.choice(healthy, size=min(count, len(healthy)), replace=False)
+        model.health[chosen] = INFECTED
+        model.had_covid[chosen] = True
+        return len(chosen)
+    #compartmental_model: move the expected number from both healthy compartments into new infections
+    healthy = model.susceptible + model.susceptible_prior
+    moved = min(float(count), healthy)
+    if moved > 0:
+        model.timers[0] += moved
+        model.susceptible -= moved * model.susceptible / healthy
+        model.susceptible_prior -= moved * model.susceptible_prior / healthy
+    return moved
+
+
+class SiteController:
+    """Policy handed to a site's iter_episode. At the start of each day it infects the workers imported
+    from other sites, then returns the coordinator's action when there is one and the site's own policy's
+    otherwise. The configuration the site would have without the override (its configuration before the
+    override, updated by every action its own policy issued meanwhile) is restored on the day the
+    override clears, so a site whose policy returns None does not keep the override."""
+    def __init__(self, model, policy=None):
+        self.model = model
+        self.policy = policy
+        self.imports = 0
+        self.imported = 0
+        self.action = None
+        self.own_config = None #set while overridden
+
+    def reset(self):
+        self.own_config = None
+        if self.policy is not None:
+            self.policy.reset()
+
+    def __call__(self, state):
+        from src.environment.Recording import model_config
+
+        self.imported = import_infections(self.model, self.imports)
+        if self.imported:
+            state = self.model.get_state()
+        own = self.policy(state) if self.policy is not None else None
+        if self.action is not None:
+            if self.own_config is None:
+                self.own_config = model_config(self.model)
+                #FactoryConfig defaults to mask_mandate=2, which models treat as on but update_config cannot count
+                self.own_config["mask_mandate"] = bool(self.own_config["mask_mandate"])
+            if own is not None:
+                self.own_config.update(own)
+            return self.action
+        if self.own_config is not None:
+            own, self.own_config = {**self.own_config, **(own or {})}, None
+        return own
+
+
+def site_policy(site):
+    from src.environment.FactoryConfig import build_action_space
+    from src.evaluation.Episode import NetworkPolicy, SchedulePolicy, StaticPolicy
+
+    def resolve(action):
+        return build_action_space()[action] if isinstance(action, int) else action
+    if "action" in site:
+        return StaticPolicy(resolve(site["action"]))
+    if "schedule" in site:
+        return SchedulePolicy([resolve(action) for action in site["schedule"]])
+    if "model" in site:
+        return NetworkPolicy(site["model"])
+    return None
+
+
+def run_site(connection, site, num_days):
+    """Site process. Builds the site's model and simulates one day per message from the coordinator:
+    (imported infections, action or None), answered with the day's metrics and the model state."""
+    from src.cli import build_engine
+    from src.environment.FactoryConfig import FactoryConfig
+    from src.evaluation.Episode import DEFAULT_CONFIG, iter_episode, silenced
+
+    try:
+        with silenced():
+            config = FactoryConfig(**{**DEFAULT_CONFIG, **site["config"], "visualization": False})
+            model = build_engine(site["engine"], config, site["seed"], params=site.get("params"))
+            controller = SiteController(model, site_policy(site))
+            days = iter_episode(controller, num_days=num_days, model=model)
+            connection.send({"workers": config.num_agents})
+            while True:
+                message = connection.recv()
+                if message is None:
+                    break
+                controller.imports, controller.action = message
+                row = next(days)
+                connection.send({"row": [float(value) for value in row], "state": model.get_state(),
+                                 "imported": controller.imported})
+    except Exception:
+        connection.send({"error": traceback.format_exc()})
+    finally:
+        connection.close()
+
+
+class FleetThresholdPolicy:
+    """Fleet-wide policy: once the share of infected workers across all sites reaches threshold, every site
+    gets action (an index into the action space or an action dictionary) until it falls below
+    release_threshold (threshold by default). Otherwise the sites follow their own policies."""
+    def __init__(self, threshold, action, release_threshold=None):
+        from src.environment.FactoryConfig import build_action_space
+        self.threshold = threshold
+        self.release_threshold = threshold if release_threshold is None else release_threshold
+        self.action = build_action_space()[action] if isinstance(action, int) else action
+        self.active = False
+
+    def __call__(self, day, states):
+        infected = sum(state[1] for state in states.values())
+        workers = sum(sum(state[:4]) for state in states.values())
+        prevalence = infected / max(workers, 1)
+        self.active = prevalence >= (self.release_threshold if self.active else self.threshold)
+        return {name: self.action for name in states} if self.active else {}
+
+
+class FleetRun:
+    """Coordinator of a fleet: one process per site, stepped a day at a time in lockstep.
+
+    At every day boundary each site reports its day and its state. The coordinator then draws the
+    infections imported into each site for the next day, Poisson with mean sum over sources of rate times
+    infected workers, and asks the fleet policy for overrides. All sites simulate their days in parallel.
+    Reproducible for a given spec: each site has its own seed and the importations come from the
+    coordinator's generator."""
+    def __init__(self, spec, fleet_policy=None):
+        self.spec = spec
+        self.names = [site["name"] for site in spec["sites"]]
+        self.rates = rate_matrix(spec)
+        self.rng = np.random.default_rng(spec["seed"])
+        if fleet_policy is None and spec.get("fleet_policy"):
+            fleet_policy = FleetThresholdPolicy(**spec["fleet_policy"])
+        self.fleet_policy = fleet_policy
+        self.connections = []
+        self.processes = []
+        self.workers = {}
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        for site in self.spec["sites"]:
+            parent, child = context.Pipe()
+            process = context.Process(target=run_site, args=(child, site, self.spec["days"]), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        for name, reply in zip(self.names, self.receive()):
+            self.workers[name] = reply["workers"]
+
+    def receive(self):
+        replies = []
+        for name, connection in zip(self.names, self.connections):
+            try:
+                reply = connection.recv()
+            except EOFError:
+                raise RuntimeError(f"Site {name} exited")
+            if "error" in reply:
+                raise RuntimeError(f"Site {name} failed:\n{reply['error']}")
+            replies.append(reply)
+        return replies
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def days(self):
+        """Yields one record per day: every site's metrics, its imported infections and the fleet totals"""
+        imports = np.zeros(len(self.names), dtype=np.int64)
+        states = None
+        for day in range(self.spec["days"]):
+            actions = self.fleet_policy(day, states) if self.fleet_policy is not None and states else {}
+            for i, (name, connection) in enumerate(zip(self.names, self.connections)):
+                connection.send((int(imports[i]), actions.get(name)))
+            replies = self.receive()
+            states = {name: reply["state"] for name, reply in zip(self.names, replies)}
+            sites = {name: {**dict(zip(DAILY_METRICS, reply["row"])), "imported": reply["imported"],
+                            "overridden": name in actions}
+                     for name, reply in zip(self.names, replies)}
+            yield {"day": day, "sites": sites,
+                   "fleet": {metric: sum(site[metric] for site in sites.values())
+                             for metric in DAILY_METRICS + ("imported",)}}
+
+            infected = np.array([state[1] for state in states.values()], dtype=float)
+            imports = self.rng.poisson(infected @ self.rates)
+
+
+class FleetTotals:
+    """Streaming aggregate of a fleet run: episode outcomes per site and for the whole fleet, updated one
+    day record at a time so a long run never keeps its days in memory"""
+    def __init__(self, names):
+        self.totals = {name: {"productivity": 0.0, "infections": 0.0, "deaths": 0.0, "quarantine_days": 0.0,
+                              "imported": 0.0, "peak_infected": 0.0} for name in names + ["fleet"]}
+
+    def add(self, record):
+        for name, metrics in list(record["sites"].items()) + [("fleet", record["fleet"])]:
+            totals = self.totals[name]
+            totals["productivity"] += metrics["productivity"]
+            totals["infections"] += metrics["new_infections"]
+            totals["deaths"] = metrics["death"]
+            totals["quarantine_days"] += metrics["quarantined"]
+            totals["imported"] += metrics["imported"]
+            totals["peak_infected"] = max(totals["peak_infected"], metrics["infected"])
+
+
+def run_fleet(spec, output=None, fleet_policy=None, quiet=False):
+    """Runs a fleet spec, appending every day's record to output (JSON lines) as soon as it is complete, and
+    returns the per-site and fleet totals"""
+    fleet = FleetRun(spec, fleet_policy)
+    totals = FleetTotals(fleet.names)
+    out = open(output, "w") if output else None
+    start = time.perf_counter()
+    try:
+        fleet.start()
+        if not quiet:
+            print(f"Fleet of {len(fleet.names)} sites, {sum(fleet.workers.values())} workers, started in "
+                  f"{time.perf_counter() - start:.1f}s")
+        for record in fleet.days():
+            totals.add(record)
+            if out is not None:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+            if not quiet:
+                day = record["fleet"]
+                overridden = sum(site["overridden"] for site in record["sites"].values())
+                print(f"  day {record['day']}: infected {day['infected']:.0f}, new {day['new_infections']:.0f}, "
+                      f"imported {day['imported']:.0f}, productivity {day['productivity']:.1f}"
+                      + (f", fleet policy on {overridden} sites" if overridden else ""))
+    finally:
+        fleet.close()
+        if out is not None:
+            out.close()
+    return totals.totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a fleet of sites that carry infections between them")
+    parser.add_argument("spec", help="fleet spec (JSON), see load_fleet")
+    parser.add_argument("--days", type=int, default=None, help="override the spec's number of days")
+    parser.add_argument("--seed", type=int, default=None, help="override the spec's seed")
+    parser.add_argument("--output", default=None, help="stream the daily records to this JSON lines file")
+    args = parser.parse_args(argv)
+
+    spec_overrides = {key: value for key, value in (("days", args.days), ("seed", args.seed)) if value is not None}
+    spec = load_fleet(args.spec)
+    if "seed" in spec_overrides:
+        for i, site in enumerate(spec["sites"]):
+            site["seed"] = spec_overrides["seed"] + i
+    spec.update(spec_overrides)
+    totals = run_fleet(spec, args.output)
+    for name, outcome in totals.items():
+        print(f"{name}: " + ", ".join(f"{key}={value:.1f}" for key, value in outcome.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import random
+import time
+import numpy as np
+from src.evaluation.Evaluator import OUTCOMES
+from src.evaluation.Sweep import SweepStore, from_unit, load_manifest, run_points, run_sweep
+
+
+class FeatureSpace:
+    """Encodes sweep points as network inputs. Numeric parameters are scaled to [0, 1] over their manifest
+    range or values, parameters with non numeric values (cleaning_type, booleans) are one hot encoded."""
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.columns = []
+        for name, spec in parameters.items():
+            values = spec.get("values")
+            if values is not None and not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+                self.columns.append((name, "onehot", list(values)))
+            else:
+                low, high = spec["range"] if "range" in spec else (min(values), max(values))
+                self.columns.append((name, "scale", (low, high)))
+        self.width = sum(len(c[2]) if c[1] == "onehot" else 1 for c in self.columns)
+
+    def encode(self, points):
+        x = np.zeros((len(points), self.width), dtype=np.float32)
+        for row, point in enumerate(points):
+            col = 0
+            for name, kind, spec in self.columns:
+                if name not in point:
+                    raise ValueError(f"Missing parameter {name}, the surrogate needs {list(self.parameters)}")
+                if kind == "onehot":
+                    if point[name] not in spec:
+                        raise ValueError(f"{name}={point[name]!r} was not swept, expected one of {spec}")
+                    x[row, col + spec.index(point[name])] = 1.0
+                    col += len(spec)
+                else:
+                    low, high = spec
+                    x[row, col] = (point[name] - low) / (high - low) if high > low else 0.0
+                    col += 1
+        return x
+
+    def sample(self, count, rng):
+        return [{name: from_unit(spec, rng.random()) for name, spec in self.parameters.items()}
+                for _ in range(count)]
+
+
+def fit_ensemble(x, y, members=5, hidden=64, epochs=1500, lr=3e-3, weight_decay=1e-4, seed=0):
+    """Trains `members` small MLPs on bootstrap resamples of (x, y) and returns their weights as numpy
+    arrays stacked over members: [(w1, b1), (w2, b2), (w3, b3)] with w of shape (members, in, out).
+    Targets are expected to be standardized."""
+    import torch
+
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    inputs, targets = torch.from_numpy(x), torch.from_numpy(y)
+    stacked = []
+    for _ in range(members):
+        sample = torch.from_numpy(rng.integers(0, len(x), len(x)))
+        net = torch.nn.Sequential(
+            torch.nn.Linear(x.shape[1], hidden), torch.nn.Tanh(),
+            torch.nn.Linear(hidden, hidden), torch.nn.Tanh(),
+            torch.nn.Linear(hidden, y.shape[1]),
+        )
+        optimizer = torch.optim.Adam(net.parameters(), lr=lr, weight_decay=weight_decay)
+        #A sweep is at most a few thousand runs, so every epoch is one full batch step
+        for _ in range(epochs):
+            optimizer.zero_grad()
+            loss = torch.mean((net(inputs[sample]) - targets[sample]) ** 2)
+            loss.backward()
+            optimizer.step()
+        layers = [module for module in net if isinstance(module, torch.nn.Linear)]
+        stacked.append([(l.weight.detach().numpy().T.copy(), l.bias.detach().numpy().copy()) for l in layers])
+    return [(np.stack([m[i][0] for m in stacked]), np.stack([m[i][1] for m in stacked]))
+            for i in range(len(stacked[0]))]
+
+
+class OutcomeSurrogate:
+    """Ensemble of small MLPs mapping sweep parameters to expected episode outcomes (productivity,
+    infections, deaths, quarantine days). The ensemble mean is the prediction and the spread between members
+    its uncertainty, which is large away from the simulated points. Prediction is a few numpy matrix
+    products, so a query takes well under a millisecond and torch is only needed to fit."""
+    def __init__(self, space, layers, y_mean, y_std, meta=None):
+        self.space = space
+        self.layers = layers
+        self.y_mean = y_mean
+        self.y_std = y_std
+        self.meta = meta or {}
+
+    @classmethod
+    def fit(cls, space, rows, members=5, hidden=64, epochs=1500, seed=0, meta=None):
+        """Fits to finished sweep runs, as returned by SweepStore.results"""
+        x = space.encode(rows)
+        y = np.array([[row[o] for o in OUTCOMES] for row in rows], dtype=np.float32)
+        y_mean, y_std = y.mean(axis=0), y.std(axis=0) + 1e-6
+        layers = fit_ensemble(x, (y - y_mean) / y_std, members, hidden, epochs, seed=seed)
+        return cls(space, layers, y_mean, y_std, meta)
+
+    def members_output(self, x):
+        """Standardized predictions of every member, shape (members, points, outcomes)"""
+        h = np.broadcast_to(x, (self.layers[0][0].shape[0],) + x.shape)
+        for i, (w, b) in enumerate(self.layers):
+            h = h @ w + b[:, None, :]
+            if i < len(self.layers) - 1:
+                h = np.tanh(h)
+        return h
+
+    def predict_batch(self, points):
+        """Mean and standard deviation across members of every outcome, each of shape (points, outcomes)"""
+        out = self.members_output(self.space.encode(points)) * self.y_std + self.y_mean
+        return out.mean(axis=0), out.std(axis=0)
+
+    def predict(self, point):
+        mean, std = self.predict_batch([point])
+        return {o: {"mean": float(mean[0, i]), "std": float(std[0, i])} for i, o in enumerate(OUTCOMES)}
+
+    def uncertainty(self, points):
+        """Acquisition score for active learning: member spread summed over the standardized outcomes"""
+        return self.members_output(self.space.encode(points)).std(axis=0).sum(axis=1)
+
+    def save(self, path):
+        arrays = {f"w{i}": w for i, (w, _) in enumerate(self.layers)}
+        arrays.update({f"b{i}": b for i, (_, b) in enumerate(self.layers)})
+        meta = {**self.meta, "parameters": self.space.parameters, "outcomes": list(OUTCOMES)}
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, y_mean=self.y_mean, y_std=self.y_std, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            layers = [(data[f"w{i}"], data[f"b{i}"]) for i in range(sum(k.startswith("w") for k in data.files))]
+            return cls(FeatureSpace(meta["parameters"]), layers, data["y_mean"], data["y_std"], meta)
+
+
+def holdout_report(space, rows, holdout=0.2, seed=0, **fit_args):
+    """R^2 of each outcome on a random share of the points held out from fitting. Runs of the same point are
+    kept together, so the score measures generalization to parameters that were not simulated."""
+    def key(row):
+        return json.dumps({name: row[name] for name in space.parameters}, sort_keys=True)
+
+    keys = sorted({key(row) for row in rows})
+    random.Random(seed).shuffle(keys)
+    held = set(keys[:max(1, int(len(keys) * holdout))])
+    train = [row for row in rows if key(row) not in held]
+    test = [row for row in rows if key(row) in held]
+    surrogate = OutcomeSurrogate.fit(space, train, seed=seed, **fit_args)
+    mean, _ = surrogate.predict_batch(test)
+    truth = np.array([[row[o] for o in OUTCOMES] for row in test])
+    residual = ((truth - mean) ** 2).sum(axis=0)
+    total = ((truth - truth.mean(axis=0)) ** 2).sum(axis=0)
+    return {o: float(1 - residual[i] / total[i]) if total[i] > 0 else 0.0 for i, o in enumerate(OUTCOMES)}
+
+
+def active_learning(manifest, db_path="sweep.sqlite", rounds=3, batch=16, candidates=2000, workers=None,
+                    output="outcome_surrogate.npz", members=5, epochs=1500):
+    """Fits a surrogate to a sweep and refines it where it is least certain.
+
+    The manifest's sweep is run first (resuming whatever is already in the store). Every round then fits
+    the ensemble, scores `candidates` random points of the manifest's parameter space by member
+    disagreement and simulates only the `batch` most uncertain ones, stored as the sweep "<name>:active".
+    The final surrogate is written to `output`."""
+    space = FeatureSpace(manifest["parameters"])
+    run_sweep(manifest, db_path, workers)
+    store = SweepStore(db_path)
+    active = f"{manifest['name']}:active"
+    seeds = [manifest["seed"] + i for i in range(manifest["replicates"])]
+    rng = random.Random(manifest["seed"])
+    meta = {"sweep": manifest["name"], "fixed": manifest["fixed"], "num_days": manifest["num_days"]}
+
+    def rows():
+        return store.results(manifest["name"]) + store.results(active)
+
+    for round_ in range(rounds):
+        surrogate = OutcomeSurrogate.fit(space, rows(), members, epochs=epochs, seed=round_, meta=meta)
+        pool = space.sample(candidates, rng)
+        scores = surrogate.uncertainty(pool)
+        chosen = [pool[i] for i in np.argsort(scores)[::-1][:batch]]
+        print(f"Round {round_ + 1}: {len(rows())} runs, mean uncertainty {scores.mean():.3f}, "
+              f"simulating {len(chosen)} points up to {scores.max():.3f}")
+        run_points(store, active, [{**manifest["fixed"], **point} for point in chosen], seeds,
+                   manifest["num_days"], workers)
+
+    final_rows = rows()
+    meta["runs"] = len(final_rows)
+    meta["holdout_r2"] = holdout_report(space, final_rows, members=members, epochs=epochs)
+    surrogate = OutcomeSurrogate.fit(space, final_rows, members, epochs=epochs, meta=meta)
+    surrogate.save(output)
+    store.close()
+    print(f"Wrote {output}, fitted on {len(final_rows)} runs, held out R^2 {meta['holdout_r2']}")
+    return surrogate
+
+
+def parse_point(assignments):
+    """KEY=VALUE strings to a parameter dict, values parsed as JSON where possible"""
+    point = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        try:
+            point[name] = json.loads(value)
+        except json.JSONDecodeError:
+            point[name] = value
+    return point
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Learned surrogate of sweep outcomes with active learning")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fit = commands.add_parser("fit", help="run the sweep, refine it by active learning and fit the surrogate")
+    fit.add_argument("manifest", help="sweep manifest (JSON), see src/evaluation/Sweep.py")
+    fit.add_argument("--db", default="sweep.sqlite")
+    fit.add_argument("--rounds", type=int, default=3, help="active learning rounds")
+    fit.add_argument("--batch", type=int, default=16, help="points simulated per round")
+    fit.add_argument("--candidates", type=int, default=2000, help="random points scored per round")
+    fit.add_argument("--members", type=int, default=5, help="networks in the ensemble")
+    fit.add_argument("--epochs", type=int, default=1500)
+    fit.add_argument("--workers", type=int, default=None)
+    fit.add_argument("--output", default="outcome_surrogate.npz")
+    predict = commands.add_parser("predict", help="predict the outcomes of one point")
+    predict.add_argument("surrogate")
+    predict.add_argument("point", nargs="+", help="parameters as NAME=VALUE")
+    args = parser.parse_args(argv)
+
+    if args.command == "fit":
+        active_learning(load_manifest(args.manifest), args.db, args.rounds, args.batch, args.candidates,
+                        args.workers, args.output, args.members, args.epochs)
+        return 0
+    surrogate = OutcomeSurrogate.load(args.surrogate)
+    point = parse_point(args.point)
+    start = time.perf_counter()
+    prediction = surrogate.predict(point)
+    elapsed = time.perf_counter() - start
+    for outcome, value in prediction.items():
+        print(f"{outcome}: {value['mean']:.2f} +/- {value['std']:.2f}")
+    print(f"({elapsed * 1000:.2f} ms, fitted on {surrogate.meta.get('runs')} runs of sweep {surrogate.meta.get('sweep')})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from src.environment.FactoryConfig import (CLEANING_OPTIONS, MASK_MANDATE_OPTIONS, SHIFTS_OPTIONS,
+                                           SOCIAL_DISTANCING_OPTIONS, SPLITTING_OPTIONS, TESTING_OPTIONS,
+                                           build_action_space)
+from src.environment.FactoryModel import ENGINE_VERSION
+from src.evaluation.Episode import SchedulePolicy
+from src.evaluation.Evaluator import run_batch
+from src.evaluation.ResultCache import canonical_config
+
+#Genes of one schedule segment, one per policy lever, each an index into its options
+LEVERS = (("cleaning_type", CLEANING_OPTIONS), ("splitting_level", SPLITTING_OPTIONS),
+          ("testing_level", TESTING_OPTIONS), ("social_distancing", SOCIAL_DISTANCING_OPTIONS),
+          ("mask_mandate", MASK_MANDATE_OPTIONS), ("shifts_per_day", SHIFTS_OPTIONS))
+#Objectives as (outcome, sign): every objective is minimized, productivity through its negative
+OBJECTIVES = (("productivity", -1), ("infections", 1), ("deaths", 1))
+
+
+def decode(genome, num_days):
+    """Schedule of a genome: its segments spread evenly over the episode, one action per day"""
+    actions = [{name: options[gene] for (name, options), gene in zip(LEVERS, segment)} for segment in genome]
+    return [actions[day * len(actions) // num_days] for day in range(num_days)]
+
+
+def genome_name(genome):
+    return "|".join("".join(str(gene) for gene in segment) for segment in genome)
+
+
+def random_genome(segments, rng):
+    return tuple(tuple(rng.randrange(len(options)) for _, options in LEVERS) for _ in range(segments))
+
+
+def crossover(a, b, rng):
+    """Uniform crossover of whole segments"""
+    return tuple(sa if rng.random() < 0.5 else sb for sa, sb in zip(a, b))
+
+
+def mutate(genome, rng, rate):
+    """Resamples each gene with probability rate, and always at least one"""
+    genes = [list(segment) for segment in genome]
+    forced = (rng.randrange(len(genes)), rng.randrange(len(LEVERS)))
+    for s, segment in enumerate(genes):
+        for g, (_, options) in enumerate(LEVERS):
+            if (s, g) == forced or rng.random() < rate:
+                segment[g] = rng.randrange(len(options))
+    return tuple(tuple(segment) for segment in genes)
+
+
+def dominates(a, b):
+    return all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+
+def nondominated_sort(objectives):
+    """Fast non-dominated sort of NSGA-II. Returns the fronts as lists of indices, best first."""
+    dominated_by = [[] for _ in objectives]
+    counts = [0] * len(objectives)
+    fronts = [[]]
+    for i, a in enumerate(objectives):
+        for j, b in enumerate(objectives):
+            if dominates(a, b):
+                dominated_by[i].append(j)
+            elif dominates(b, a):
+                counts[i] += 1
+        if counts[i] == 0:
+            fronts[0].append(i)
+    while fronts[-1]:
+        next_front = []
+        for i in fronts[-1]:
+            for j in dominated_by[i]:
+                counts[j] -= 1
+                if counts[j] == 0:
+                    next_front.append(j)
+        fronts.append(next_front)
+    return fronts[:-1]
+
+
+def crowding_distance(objectives, front):
+    """Crowding distance of every index of a front, infinite at the ends of each objective"""
+    distance = {i: 0.0 for i in front}
+    for m in range(len(objectives[front[0]])):
+        ordered = sorted(front, key=lambda i: objectives[i][m])
+        low, high = objectives[ordered[0]][m], objectives[ordered[-1]][m]
+        distance[ordered[0]] = distance[ordered[-1]] = float("inf")
+        if high == low:
+            continue
+        for k in range(1, len(ordered) - 1):
+            distance[ordered[k]] += (objectives[ordered[k + 1]][m] - objectives[ordered[k - 1]][m]) / (high - low)
+    return distance
+
+
+def rank_population(objectives):
+    """Front index and crowding distance of every member"""
+    rank, crowding = {}, {}
+    for r, front in enumerate(nondominated_sort(objectives)):
+        crowding.update(crowding_distance(objectives, front))
+        rank.update({i: r for i in front})
+    return rank, crowding
+
+
+def select_survivors(genomes, objectives, size):
+    """Elitist NSGA-II selection: whole fronts best first, the last one cut by crowding distance"""
+    survivors = []
+    for front in nondominated_sort(objectives):
+        if len(survivors) + len(front) <= size:
+            survivors.extend(front)
+        else:
+            crowding = crowding_distance(objectives, front)
+            survivors.extend(sorted(front, key=lambda i: -crowding[i])[:size - len(survivors)])
+            break
+    return [genomes[i] for i in survivors]
+
+
+class ParetoSearch:
+    """NSGA-II over time varying policy schedules. A genome is a few segments of lever settings spread over
+    the episode, so a schedule can for example start with heavy testing and relax it later. Every candidate
+    is scored by the mean outcomes over the same replicate seeds (common random numbers), evaluated on a
+    process pool in batches of seeds. Scores are kept per genome, so survivors and duplicate offspring are
+    never simulated twice, and the search is checkpointed after every generation."""
+    def __init__(self, population=32, segments=3, replicates=4, num_days=10, config=None, mutation_rate=None,
+                 base_seed=0, seed=0, workers=None, batch_size=2, cache_dir=None,
+                 checkpoint="pareto_checkpoint.json"):
+        self.population_size = population
+        self.segments = segments
+        self.seeds = [base_seed + i for i in range(replicates)]
+        self.num_days = num_days
+        self.config = config
+        self.mutation_rate = mutation_rate if mutation_rate is not None else 1.0 / (segments * len(LEVERS))
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.checkpoint = checkpoint
+        self.rng = random.Random(seed)
+        self.generation = 0
+        self.population = []
+        self.scores = {} #genome -> mean outcomes
+        self.evaluations = 0
+
+    def settings(self):
+        """Everything the scores depend on, a checkpoint of other settings cannot be resumed"""
+        return {"segments": self.segments, "num_days": self.num_days, "seeds": self.seeds,
+                "config": canonical_config(self.config), "engine": ENGINE_VERSION}
+
+    def objectives(self, genome):
+        return tuple(sign * self.scores[genome][outcome] for outcome, sign in OBJECTIVES)
+
+    def evaluate(self, genomes):
+        """Scores every genome not scored yet"""
+        pending = list(dict.fromkeys(g for g in genomes if g not in self.scores))
+        if not pending:
+            return
+        records = {g: [] for g in pending}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for genome in pending:
+                policy = SchedulePolicy(decode(genome, self.num_days))
+                for i in range(0, len(self.seeds), self.batch_size):
+                    future = executor.submit(run_batch, genome_name(genome), policy,
+                                             self.seeds[i:i + self.batch_size], self.config, self.num_days,
+                                             self.cache_dir)
+                    futures[future] = genome
+            wait(futures)
+            for future, genome in futures.items():
+                records[genome].extend(future.result())
+        for genome, runs in records.items():
+            self.scores[genome] = {outcome: sum(r[outcome] for r in runs) / len(runs) for outcome, _ in OBJECTIVES}
+        self.evaluations += len(pending) * len(self.seeds)
+
+    def offspring(self):
+        objectives = [self.objectives(g) for g in self.population]
+        rank, crowding = rank_population(objectives)
+
+        def tournament():
+            i, j = self.rng.randrange(len(self.population)), self.rng.randrange(len(self.population))
+            better = i if (rank[i], -crowding[i]) <= (rank[j], -crowding[j]) else j
+            return self.population[better]
+
+        return [mutate(crossover(tournament(), tournament(), self.rng), self.rng, self.mutation_rate)
+                for _ in range(self.population_size)]
+
+    def front(self):
+        """Non-dominated schedules among every genome scored so far, by productivity"""
+        genomes = list(self.scores)
+        objectives = [self.objectives(g) for g in genomes]
+        best = [genomes[i] for i in nondominated_sort(objectives)[0]]
+        return sorted(best, key=lambda g: -self.scores[g]["productivity"])
+
+    def save(self):
+        state = {
+            "settings": self.settings(),
+            "generation": self.generation,
+            "population": self.population,
+            "scores": [[genome, score] for genome, score in self.scores.items()],
+            "evaluations": self.evaluations,
+            "rng": self.rng.getstate(),
+            "front": [{"genome": genome_name(g), "schedule": decode(g, self.num_days), **self.scores[g]}
+                      for g in self.front()],
+        }
+        tmp = f"{self.checkpoint}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint)
+
+    def load(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return False
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        saved = state.get("settings")
+        if saved != json.loads(json.dumps(self.settings(), default=str)):
+            raise ValueError(f"Checkpoint {self.checkpoint} was written with other settings ({saved}), "
+                             f"use another --checkpoint or the same settings")
+        as_genome = lambda genome: tuple(tuple(segment) for segment in genome)
+        self.generation = state["generation"]
+        self.population = [as_genome(g) for g in state["population"]]
+        self.scores = {as_genome(g): score for g, score in state["scores"]}
+        self.evaluations = state["evaluations"]
+        version, internal, gauss = state["rng"]
+        self.rng.setstate((version, tuple(internal), gauss))
+        return True
+
+    def run(self, generations):
+        if self.load():
+            print(f"Resuming from generation {self.generation} ({len(self.scores)} schedules scored)")
+        else:
+            self.population = [random_genome(self.segments, self.rng) for _ in range(self.population_size)]
+            self.evaluate(self.population)
+            self.save()
+        start = time.perf_counter()
+        while self.generation < generations:
+            children = self.offspring()
+            self.evaluate(children)
+            merged = list(dict.fromkeys(self.population + children))
+            self.population = select_survivors(merged, [self.objectives(g) for g in merged], self.population_size)
+            self.generation += 1
+            self.save()
+            print(f"Generation {self.generation}: {len(self.front())} schedules on the front, "
+                  f"{self.evaluations} episodes run ({time.perf_counter() - start:.1f}s)")
+        return self.front()
+
+
+def print_front(search, front):
+    for genome in front:
+        score = search.scores[genome]
+        print(f"{genome_name(genome)}: " + ", ".join(f"{outcome}={score[outcome]:.1f}" for outcome, _ in OBJECTIVES))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NSGA-II search for Pareto optimal policy schedules")
+    parser.add_argument("--generations", type=int, default=20)
+    parser.add_argument("--population", type=int, default=32)
+    parser.add_argument("--segments", type=int, default=3, help="policy changes per episode")
+    parser.add_argument("--replicates", type=int, default=4)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=2, help="replicates per worker task")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", default=None, help="result cache directory for the episodes")
+    parser.add_argument("--checkpoint", default="pareto_checkpoint.json",
+                        help="written after every generation, the search resumes from it")
+    args = parser.parse_args(argv)
+
+    search = ParetoSearch(args.population, args.segments, args.replicates, args.days, seed=args.seed,
+                          workers=args.workers, batch_size=args.batch_size, cache_dir=args.cache,
+                          checkpoint=args.checkpoint)
+    front = search.run(args.generations)
+    exhaustive = len(build_action_space()) ** args.segments * args.replicates
+    print(f"Pareto front after {search.evaluations} episodes (an exhaustive search would need {exhaustive}):")
+    print_front(search, front)
+
+
+if __name__ == "__main__":
+    main()
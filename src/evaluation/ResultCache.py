@@ -0,0 +1,164 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import hashlib
+import io
+import json
+import sqlite3
+import time
+import numpy as np
+from src.environment.FactoryConfig import FactoryConfig
+from src.environment.FactoryModel import ENGINE_VERSION
+from src.evaluation.Episode import DAILY_METRICS, DEFAULT_CONFIG, SchedulePolicy, run_episode
+
+
+def canonical_config(config=None):
+    """Full FactoryConfig parameters of a run as a sorted dict, so defaults and explicit values hash the same"""
+    params = vars(FactoryConfig(**{**DEFAULT_CONFIG, **(config or {})})).copy()
+    params.pop("visualization", None)
+    return dict(sorted(params.items()))
+
+
+def canonical_schedule(schedule, num_days):
+    """Expands a per-day action schedule to exactly num_days entries, holding the last entry like SchedulePolicy"""
+    if not schedule:
+        return [None] * num_days
+    return [schedule[min(day, len(schedule) - 1)] for day in range(num_days)]
+
+
+def scenario_key(config, schedule, seed, num_days):
+    """Content hash of everything that determines a run's results"""
+    params = canonical_config(config)
+    scenario = {
+        "config": params,
+        "schedule": [dict(sorted(a.items())) if a else None for a in canonical_schedule(schedule, num_days)],
+        "seed": seed,
+        "steps": num_days * params["steps_per_day"],
+        "engine": ENGINE_VERSION,
+    }
+    encoded = json.dumps(scenario, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResultCache:
+    """Content addressed store of per-day episode metrics. An SQLite index tracks the size and last access of
+    every entry and the arrays are kept as .npy blobs next to it. Entries are evicted least recently used
+    first once the store grows past max_bytes. Safe to share between worker processes."""
+    def __init__(self, path="sim_cache", max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(path, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, size INTEGER, created REAL, last_access REAL, hits INTEGER DEFAULT 0)""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def blob_path(self, key):
+        return os.path.join(self.blob_dir, key[:2], key + ".npy")
+
+    def _count(self, name, amount=1):
+        self.db.execute("INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                        (name, amount, amount))
+
+    def get(self, key):
+        """Returns the cached per-day arrays for a key or None"""
+        row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        daily = None
+        if row is not None:
+            try:
+                data = np.load(self.blob_path(key))
+                daily = {name: data[:, i] for i, name in enumerate(DAILY_METRICS)}
+            except (OSError, ValueError):
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,)) #blob went missing or is corrupt
+        if daily is None:
+            self.misses += 1
+            self._count("misses")
+            return None
+        self.hits += 1
+        self._count("hits")
+        self.db.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return daily
+
+    def put(self, key, daily):
+        """Stores per-day arrays under a key and evicts old entries if the store is over its size limit"""
+        data = np.column_stack([np.asarray(daily[name], dtype=np.float64) for name in DAILY_METRICS])
+        buffer = io.BytesIO()
+        np.save(buffer, data)
+        blob = buffer.getvalue()
+
+        path = self.blob_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path) #atomic so readers in other processes never see a partial blob
+
+        now = time.time()
+        self.db.execute("INSERT OR REPLACE INTO entries (key, size, created, last_access, hits) VALUES (?, ?, ?, ?, 0)",
+                        (key, len(blob), now, now))
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the store fits in max_bytes"""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.remove(self.blob_path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+            self._count("evictions")
+
+    def get_or_run(self, config=None, schedule=None, seed=None, num_days=10):
+        """Returns the per-day arrays of a scenario, simulating and storing it on a miss. Unseeded runs are a
+        fresh random realization every time, so they bypass the cache."""
+        policy = SchedulePolicy(schedule) if schedule else None
+        if seed is None:
+            return run_episode(policy, config=config, num_days=num_days)
+        key = scenario_key(config, schedule, seed, num_days)
+        daily = self.get(key)
+        if daily is None:
+            daily = run_episode(policy, config=config, seed=seed, num_days=num_days)
+            self.put(key, daily)
+        return daily
+
+    def stats(self):
+        """Hit/miss statistics for this session and for the lifetime of the store"""
+        entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lifetime = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lifetime_hits": lifetime.get("hits", 0),
+            "lifetime_misses": lifetime.get("misses", 0),
+            "lifetime_evictions": lifetime.get("evictions", 0),
+        }
+
+    def clear(self):
+        """Deletes every cached entry"""
+        for (key,) in self.db.execute("SELECT key FROM entries").fetchall():
+            try:
+                os.remove(self.blob_path(key))
+            except FileNotFoundError:
+                pass
+        self.db.execute("DELETE FROM entries")
+
+    def close(self):
+        self.db.close()
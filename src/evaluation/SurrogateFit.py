@@ -0,0 +1,160 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import math
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from src.environment.CompartmentalModel import DEFAULT_PARAMS, compartmental_model
+from src.environment.FactoryConfig import FactoryConfig, build_action_space
+from src.evaluation.Episode import DEFAULT_CONFIG, StaticPolicy, run_episode
+from src.evaluation.ResultCache import ResultCache
+
+#Daily metrics the surrogate is fitted on, all compared as fractions of the workforce
+FIT_METRICS = ("infected", "recovered", "productivity")
+
+#Search ranges of the fitted parameters, beta is searched in log space
+PARAM_BOUNDS = {"beta": (1e-3, 10.0), "alpha": (0.2, 1.2)}
+LOG_PARAMS = ("beta",)
+
+
+def abm_mean_daily(action, config, seeds, num_days, cache_dir=None):
+    """Worker process entry point. Mean per-day metrics of a static action over factory_model replicates."""
+    cache = ResultCache(cache_dir) if cache_dir else None
+    runs = []
+    for seed in seeds:
+        if cache is not None:
+            runs.append(cache.get_or_run(config, [action], seed, num_days))
+        else:
+            runs.append(run_episode(StaticPolicy(action), config=config, seed=seed, num_days=num_days))
+    if cache is not None:
+        cache.close()
+    return {name: np.mean([run[name] for run in runs], axis=0) for name in FIT_METRICS}
+
+
+def abm_targets(actions, config=None, replicates=8, num_days=10, workers=None, cache_dir=None):
+    """Ensemble mean trajectories of the agent based model for every action, run on a process pool"""
+    seeds = list(range(replicates))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(abm_mean_daily, action, config, seeds, num_days, cache_dir) for action in actions]
+        return [future.result() for future in futures]
+
+
+def surrogate_daily(action, config=None, params=None, num_days=10):
+    """Per-day metrics of the compartmental surrogate under a static action"""
+    config = FactoryConfig(**{**DEFAULT_CONFIG, **(config or {})})
+    model = compartmental_model(config.width, config.height, config.num_agents, config=config, params=params)
+    return run_episode(StaticPolicy(action), num_days=num_days, model=model)
+
+
+def fit_report(params, actions, targets, config=None, num_days=10):
+    """RMSE and R^2 of the surrogate against the ABM ensemble means, per metric and per action.
+    Errors are in fractions of the workforce."""
+    num_agents = FactoryConfig(**{**DEFAULT_CONFIG, **(config or {})}).num_agents
+    predicted = [surrogate_daily(action, config, params, num_days) for action in actions]
+
+    report = {"metrics": {}, "actions": []}
+    for name in FIT_METRICS:
+        truth = np.concatenate([t[name] for t in targets]) / num_agents
+        guess = np.concatenate([p[name] for p in predicted]) / num_agents
+        residual = np.sum((truth - guess) ** 2)
+        total = np.sum((truth - truth.mean()) ** 2)
+        report["metrics"][name] = {
+            "rmse": float(np.sqrt(residual / len(truth))),
+            "r2": float(1 - residual / total) if total > 0 else 0.0,
+        }
+    for action, target, prediction in zip(actions, targets, predicted):
+        errors = [np.mean((target[name] - prediction[name]) ** 2) / num_agents ** 2 for name in FIT_METRICS]
+        report["actions"].append({"action": action, "rmse": float(np.sqrt(np.mean(errors)))})
+    report["loss"] = float(np.mean([a["rmse"] ** 2 for a in report["actions"]]))
+    return report
+
+
+def golden_section(fn, low, high, iterations=20):
+    """Minimizes a one dimensional function on [low, high]"""
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = low, high
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    fc, fd = fn(c), fn(d)
+    for _ in range(iterations):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = fn(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = fn(d)
+    return (a + b) / 2
+
+
+def fit_surrogate(actions=None, num_actions=24, holdout=0.25, config=None, replicates=8, num_days=10,
+                  sweeps=3, workers=None, cache_dir=None, seed=0, output=None):
+    """Fits the surrogate's beta and alpha to ABM ensembles of a random sample of static actions.
+
+    Parameters are found by coordinate wise golden section search on the mean squared error of the
+    daily infected, recovered and productivity fractions. A share of the actions is held out to report
+    how well the fitted surrogate generalizes. Returns {"params", "train", "validation"} and writes it
+    to `output` as JSON when given (load it with CompartmentalModel.load_params)."""
+    if actions is None:
+        actions = random.Random(seed).sample(build_action_space(), num_actions)
+    split = max(1, int(len(actions) * (1 - holdout)))
+    print(f"Running ABM ensembles: {len(actions)} actions x {replicates} replicates")
+    targets = abm_targets(actions, config, replicates, num_days, workers, cache_dir)
+    train_actions, train_targets = actions[:split], targets[:split]
+
+    params = dict(DEFAULT_PARAMS)
+    for sweep in range(sweeps):
+        for name, (low, high) in PARAM_BOUNDS.items():
+            def loss(value):
+                trial = {**params, name: math.exp(value) if name in LOG_PARAMS else value}
+                return fit_report(trial, train_actions, train_targets, config, num_days)["loss"]
+            if name in LOG_PARAMS:
+                params[name] = math.exp(golden_section(loss, math.log(low), math.log(high)))
+            else:
+                params[name] = golden_section(loss, low, high)
+        train_loss = fit_report(params, train_actions, train_targets, config, num_days)["loss"]
+        print(f"Sweep {sweep + 1}: {params}, train loss {train_loss:.5f}")
+
+    result = {
+        "params": params,
+        "train": fit_report(params, train_actions, train_targets, config, num_days),
+        "validation": fit_report(params, actions[split:], targets[split:], config, num_days) if split < len(actions) else None,
+        "config": config or {},
+        "replicates": replicates,
+        "num_days": num_days,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def print_report(result):
+    for part in ("train", "validation"):
+        if result.get(part):
+            metrics = ", ".join(f"{name}: rmse={m['rmse']:.3f} r2={m['r2']:.2f}" for name, m in result[part]["metrics"].items())
+            print(f"{part}: {metrics}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the compartmental surrogate to factory_model ensembles")
+    parser.add_argument("--actions", type=int, default=24, help="number of static actions sampled from the action space")
+    parser.add_argument("--replicates", type=int, default=8)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache", default=None, help="result cache directory for the ABM runs")
+    parser.add_argument("--output", default="surrogate_params.json")
+    args = parser.parse_args(argv)
+
+    result = fit_surrogate(num_actions=args.actions, replicates=args.replicates, num_days=args.days,
+                           workers=args.workers, cache_dir=args.cache, output=args.output)
+    print(f"Fitted parameters: {result['params']}")
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
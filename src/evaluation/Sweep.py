@@ -0,0 +1,305 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from src.environment.FactoryModel import ENGINE_VERSION
+from src.evaluation.Episode import DAILY_METRICS, build_model, run_episode, summarize_episode
+from src.evaluation.Evaluator import OUTCOMES
+
+#Parameters passed to FactoryConfig
+CONFIG_PARAMETERS = ("width", "height", "num_agents", "steps_per_day", "shifts_per_day", "cleaning_type",
+                     "splitting_level", "testing_level", "social_distancing", "mask_mandate")
+
+
+def set_testing(field, cast=float):
+    def apply(model, value):
+        for level, settings in model.testing.testing_levels.items():
+            if level != "none":
+                settings[field] = cast(value)
+    return apply
+
+
+#Parameters that are not part of FactoryConfig, applied to the model's managers after it is built
+MODEL_PARAMETERS = {
+    "quarantine_duration": lambda model, value: setattr(model.quarantine, "quarantine_duration", int(value)),
+    "false_positive_rate": lambda model, value: setattr(model.testing, "false_positive_rate", value),
+    "false_negative_rate": lambda model, value: setattr(model.testing, "false_negative_rate", value),
+    "testing_proportion": set_testing("proportion"), #share of workers tested, for every testing level
+    "testing_frequency": set_testing("frequency", int), #steps between tests, for every testing level
+}
+#Parameters that only take whole numbers. Testing runs when the step of the day equals the next test step,
+#so a fractional frequency would test once and never again.
+INTEGER_PARAMETERS = ("width", "height", "num_agents", "steps_per_day", "shifts_per_day", "splitting_level",
+                      "quarantine_duration", "testing_frequency")
+SAMPLING = ("grid", "random", "lhs")
+
+
+def load_manifest(path):
+    """Reads a sweep manifest (JSON) and checks its parameters.
+
+    {"name": "...", "sampling": "grid" | "random" | "lhs", "samples": 100, "seed": 0, "replicates": 3,
+     "num_days": 10, "fixed": {"height": 25},
+     "parameters": {"num_agents": {"values": [100, 500]},
+                    "testing_proportion": {"range": [0.1, 0.6], "steps": 3},
+                    "quarantine_duration": {"range": [20, 80], "type": "int"}}}
+
+    Each parameter either lists its values or gives a range. Grid sampling uses the listed values, or
+    `steps` evenly spaced points of a range; random and Latin hypercube sampling draw `samples` points."""
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    manifest.setdefault("sampling", "grid")
+    manifest.setdefault("seed", 0)
+    manifest.setdefault("replicates", 1)
+    manifest.setdefault("num_days", 10)
+    manifest.setdefault("fixed", {})
+    if manifest["sampling"] not in SAMPLING:
+        raise ValueError(f"Unknown sampling {manifest['sampling']!r}, expected one of {SAMPLING}")
+    if manifest["sampling"] != "grid" and "samples" not in manifest:
+        raise ValueError(f"{manifest['sampling']} sampling needs a number of samples")
+    names = list(manifest["parameters"]) + list(manifest["fixed"])
+    unknown = [name for name in names if name not in CONFIG_PARAMETERS and name not in MODEL_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {unknown}")
+    for name, spec in manifest["parameters"].items():
+        if ("values" in spec) == ("range" in spec):
+            raise ValueError(f"Parameter {name} needs either values or a range")
+        if manifest["sampling"] == "grid" and "range" in spec and "steps" not in spec:
+            raise ValueError(f"Parameter {name} needs steps for grid sampling of its range")
+        if name in INTEGER_PARAMETERS:
+            if "range" in spec and spec.get("type") != "int":
+                raise ValueError(f"Parameter {name} takes whole numbers, give its range \"type\": \"int\"")
+            if not all(is_integer(value) for value in spec.get("values", spec.get("range"))):
+                raise ValueError(f"Parameter {name} takes whole numbers, got {spec}")
+    for name, value in manifest["fixed"].items():
+        if name in INTEGER_PARAMETERS and not is_integer(value):
+            raise ValueError(f"Parameter {name} takes whole numbers, got {value!r}")
+    return manifest
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def from_unit(spec, u):
+    """Maps u in [0, 1) to a parameter value"""
+    if "values" in spec:
+        return spec["values"][min(int(u * len(spec["values"])), len(spec["values"]) - 1)]
+    low, high = spec["range"]
+    if spec.get("type") == "int":
+        return min(int(low + u * (high - low + 1)), high)
+    return low + u * (high - low)
+
+
+def grid_values(spec):
+    if "values" in spec:
+        return list(spec["values"])
+    low, high = spec["range"]
+    steps = spec["steps"]
+    values = [low + (high - low) * i / (steps - 1) for i in range(steps)] if steps > 1 else [low]
+    return [int(round(v)) for v in values] if spec.get("type") == "int" else values
+
+
+def expand(manifest):
+    """Points of the sweep as a list of parameter dicts. Deterministic for a given manifest, so a resumed
+    sweep expands to the same points."""
+    parameters = manifest["parameters"]
+    names = list(parameters)
+    rng = random.Random(manifest["seed"])
+    if manifest["sampling"] == "grid":
+        rows = itertools.product(*(grid_values(parameters[name]) for name in names))
+        points = [dict(zip(names, row)) for row in rows]
+    elif manifest["sampling"] == "random":
+        points = [{name: from_unit(parameters[name], rng.random()) for name in names}
+                  for _ in range(manifest["samples"])]
+    else:
+        #Latin hypercube: every parameter's range is cut into `samples` strata and each stratum is used once
+        n = manifest["samples"]
+        columns = {}
+        for name in names:
+            strata = list(range(n))
+            rng.shuffle(strata)
+            columns[name] = [from_unit(parameters[name], (s + rng.random()) / n) for s in strata]
+        points = [{name: columns[name][i] for name in names} for i in range(n)]
+    return [{**manifest["fixed"], **point} for point in points]
+
+
+def point_key(params, num_days):
+    """Content hash of a point, everything that determines its runs except the seed"""
+    encoded = json.dumps({"params": params, "num_days": num_days, "engine": ENGINE_VERSION},
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def run_point(key, params, seed, num_days):
+    """Worker process entry point. Runs one replicate of a point and returns its row for the store."""
+    start = time.perf_counter()
+    try:
+        config = {name: value for name, value in params.items() if name in CONFIG_PARAMETERS}
+        model = build_model(config, seed)
+        for name, value in params.items():
+            if name in MODEL_PARAMETERS:
+                MODEL_PARAMETERS[name](model, value)
+        daily = run_episode(num_days=num_days, model=model)
+        return {"key": key, "seed": seed, "status": "done", "outcomes": summarize_episode(daily),
+                "daily": {name: daily[name].tolist() for name in DAILY_METRICS},
+                "seconds": time.perf_counter() - start}
+    except Exception:
+        return {"key": key, "seed": seed, "status": "failed", "error": traceback.format_exc(),
+                "seconds": time.perf_counter() - start}
+
+
+class SweepStore:
+    """SQLite store of sweep points and finished runs. Only the parent process writes to it, one
+    transaction per finished run, so a crash loses at most the runs that were still in flight. Runs are keyed
+    by the point's content hash and seed, so sweeps that share a point share its runs."""
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS points (
+            sweep TEXT, key TEXT, params TEXT, num_days INTEGER, created REAL, PRIMARY KEY (sweep, key))""")
+        self.db.execute(f"""CREATE TABLE IF NOT EXISTS runs (
+            key TEXT, seed INTEGER, status TEXT, {", ".join(f"{o} REAL" for o in OUTCOMES)},
+            daily TEXT, error TEXT, seconds REAL, host TEXT, finished REAL, PRIMARY KEY (key, seed))""")
+
+    def add_points(self, sweep, points, num_days):
+        now = time.time()
+        rows = [(sweep, point_key(params, num_days), json.dumps(params, sort_keys=True), num_days, now)
+                for params in points]
+        self.db.execute("BEGIN")
+        self.db.executemany("INSERT OR IGNORE INTO points VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.execute("COMMIT")
+        return [row[1] for row in rows]
+
+    def finished(self, include_failed=True):
+        statuses = ("done", "failed") if include_failed else ("done",)
+        rows = self.db.execute(f"SELECT key, seed FROM runs WHERE status IN ({', '.join('?' * len(statuses))})",
+                               statuses)
+        return set(rows)
+
+    def record(self, result):
+        outcomes = result.get("outcomes", {})
+        self.db.execute(
+            f"INSERT OR REPLACE INTO runs VALUES (?, ?, ?, {', '.join('?' * len(OUTCOMES))}, ?, ?, ?, ?, ?)",
+            (result["key"], result["seed"], result["status"], *(outcomes.get(o) for o in OUTCOMES),
+             json.dumps(result["daily"]) if "daily" in result else None, result.get("error"),
+             result["seconds"], os.uname().nodename if hasattr(os, "uname") else None, time.time()))
+
+    def status(self, sweep=None):
+        where, args = ("WHERE p.sweep = ?", (sweep,)) if sweep else ("", ())
+        rows = self.db.execute(f"""SELECT p.sweep, COUNT(DISTINCT p.key),
+            SUM(r.status = 'done'), SUM(r.status = 'failed'), SUM(r.seconds)
+            FROM points p LEFT JOIN runs r ON r.key = p.key {where} GROUP BY p.sweep""", args)
+        return [{"sweep": s, "points": n, "done": done or 0, "failed": failed or 0, "seconds": seconds or 0.0}
+                for s, n, done, failed, seconds in rows]
+
+    def results(self, sweep=None):
+        """One dict per finished run with the point's parameters and the run's outcomes"""
+        where, args = ("AND p.sweep = ?", (sweep,)) if sweep else ("", ())
+        rows = self.db.execute(f"""SELECT p.sweep, p.params, r.seed, {", ".join(f"r.{o}" for o in OUTCOMES)}
+            FROM runs r JOIN points p ON p.key = r.key WHERE r.status = 'done' {where}
+            ORDER BY p.sweep, p.key, r.seed""", args)
+        return [{"sweep": row[0], **json.loads(row[1]), "seed": row[2], **dict(zip(OUTCOMES, row[3:]))}
+                for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def run_points(store, sweep, points, seeds, num_days, workers=None, retry_failed=False):
+    """Stores points under a sweep name and runs every replicate not already in the store on a process pool.
+    Returns the number of runs completed and failed."""
+    workers = workers or os.cpu_count()
+    keys = store.add_points(sweep, points, num_days)
+    finished = store.finished(include_failed=not retry_failed)
+    tasks = [(key, params, seed, num_days) for key, params in zip(keys, points) for seed in seeds
+             if (key, seed) not in finished]
+    done = len(points) * len(seeds) - len(tasks)
+    print(f"Sweep {sweep}: {len(points)} points x {len(seeds)} replicates, "
+          f"{len(tasks)} runs to go, {done} already finished")
+
+    completed = failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        task_iter = iter(tasks)
+        #Keep a bounded number of runs in flight, like evaluate_policies
+        in_flight = {executor.submit(run_point, *task) for task in itertools.islice(task_iter, 2 * workers)}
+        while in_flight:
+            ready, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in ready:
+                result = future.result()
+                store.record(result)
+                completed += 1
+                if result["status"] == "failed":
+                    failed += 1
+                    print(f"  run {result['key'][:12]} seed {result['seed']} failed:\n{result['error']}")
+                next_task = next(task_iter, None)
+                if next_task is not None:
+                    in_flight.add(executor.submit(run_point, *next_task))
+            elapsed = time.perf_counter() - start
+            print(f"  {completed}/{len(tasks)} runs ({failed} failed, {completed / max(elapsed, 1e-9):.2f} runs/sec)")
+    return completed, failed
+
+
+def run_sweep(manifest, db_path="sweep.sqlite", workers=None, retry_failed=False):
+    """Expands a manifest, stores its points and runs every replicate not already in the store on a process
+    pool. Safe to rerun after an interruption: finished runs are skipped."""
+    store = SweepStore(db_path)
+    seeds = [manifest["seed"] + i for i in range(manifest["replicates"])]
+    completed, failed = run_points(store, manifest["name"], expand(manifest), seeds, manifest["num_days"], workers,
+                                   retry_failed)
+    store.close()
+    return completed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumable parameter sweeps over the factory model")
+    parser.add_argument("manifest", nargs="?", help="sweep manifest (JSON)")
+    parser.add_argument("--db", default="sweep.sqlite", help="SQLite results store")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--retry-failed", action="store_true", help="rerun runs that raised an error")
+    parser.add_argument("--dry-run", action="store_true", help="print the expanded points without running them")
+    parser.add_argument("--status", action="store_true", help="print the progress of every sweep in the store")
+    parser.add_argument("--export", default=None, help="write finished runs to this CSV file")
+    args = parser.parse_args(argv)
+
+    if args.status or args.export:
+        store = SweepStore(args.db)
+        if args.status:
+            for row in store.status():
+                print(f"{row['sweep']}: {row['points']} points, {row['done']} runs done, {row['failed']} failed, "
+                      f"{row['seconds'] / 3600:.2f} CPU hours")
+        if args.export:
+            import csv
+            rows = store.results()
+            fields = sorted({field for row in rows for field in row}, key=lambda f: (f in OUTCOMES, f))
+            with open(args.export, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(rows)
+            print(f"Wrote {len(rows)} runs to {args.export}")
+        store.close()
+        return 0
+    if not args.manifest:
+        parser.error("a manifest is needed to run a sweep")
+
+    manifest = load_manifest(args.manifest)
+    if args.dry_run:
+        for params in expand(manifest):
+            print(json.dumps(params, sort_keys=True))
+        return 0
+    _, failed = run_sweep(manifest, args.db, args.workers, args.retry_failed)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
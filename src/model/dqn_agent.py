@@ -11,7 +11,8 @@ from src.model.qNetwork import QNetwork
 
 class DQNAgent:
     """Deep Q Network Agent that selections actions based on generated Q values."""
-    def __init__(self, state_dim, action_dim):
+    def __init__(self, state_dim, action_dim, lr=0.0001, gamma=0.99, epsilon_decay=0.995, epsilon_min=0.05,
+                 batch_size=128, tau=0.001, reward_scale=1e-4):
         self.state_dim = state_dim
         self.action_dim = action_dim
         self.q_network = QNetwork(state_dim, action_dim)
@@ -20,15 +21,17 @@ class DQNAgent:
         self.target_network.eval()
 
         #Hyper Params
-        self.optimizer = optim.Adam(self.q_network.parameters(), lr=0.0001)
+        self.optimizer = optim.Adam(self.q_network.parameters(), lr=lr)
         self.replay_buffer = deque(maxlen=100000)
-        self.gamma = 0.99
+        self.experiences_stored = 0 #every experience ever stored, including those the buffer has dropped
+        self.gamma = gamma
         self.epsilon = 1.0
-        self.epsilon_decay = 0.995
-        self.epsilon_min = 0.05
-        self.batch_size = 128
+        self.epsilon_decay = epsilon_decay
+        self.epsilon_min = epsilon_min
+        self.batch_size = batch_size
+        self.tau = tau #soft target update rate
         
-        self.reward_scale = 1e-4  # Scale factor for rewards
+        self.reward_scale = reward_scale  # Scale factor for rewards
         
         #state normalization
         self.state_mean = None
@@ -42,6 +45,9 @@ class DQNAgent:
         
         self.grad_clip = 1.0
 
+    def begin_episode(self):
+        """Called by the training loop before every episode"""
+
     def normalize_state(self, state):
         state = np.array(state)
         if self.state_mean is None:
@@ -61,11 +67,21 @@ class DQNAgent:
             with torch.no_grad():
                 return torch.argmax(self.q_network(state)).item()
 
+    def greedy_action(self, q_values):
+        return int(torch.argmax(q_values))
+
+    def q_values(self, state):
+        """Q values of every action for one raw state"""
+        state = torch.FloatTensor(self.normalize_state(state)).unsqueeze(0)
+        with torch.no_grad():
+            return self.q_network(state)[0]
+
     def store_experience(self, state, action, reward, next_state, done):
         state = self.normalize_state(state)
         next_state = self.normalize_state(next_state)
         reward = self.scale_reward(reward)
         self.replay_buffer.append((state, action, reward, next_state, done))
+        self.experiences_stored += 1
 
     def sample_experiences(self):
         batch = random.sample(self.replay_buffer, min(self.batch_size, len(self.replay_buffer)))
@@ -105,9 +121,37 @@ class DQNAgent:
         self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
 
     def update_target_network(self):
-        tau = 0.001
         for target_param, local_param in zip(self.target_network.parameters(), self.q_network.parameters()):
-            target_param.data.copy_(tau * local_param.data + (1.0 - tau) * target_param.data)
+            target_param.data.copy_(self.tau * local_param.data + (1.0 - self.tau) * target_param.data)
+
+    def training_state(self):
+        """Everything needed to continue training except the replay buffer, see training_checkpoint.py"""
+        return {
+            "q_network": self.q_network.state_dict(),
+            "target_network": self.target_network.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "epsilon": self.epsilon,
+            "state_mean": self.state_mean,
+            "state_std": self.state_std,
+            "experiences_stored": self.experiences_stored,
+            "q_values_history": self.q_values_history,
+            "losses_history": self.losses_history,
+            "epsilons_history": self.epsilons_history,
+            "rewards_history": self.rewards_history,
+        }
+
+    def load_training_state(self, state):
+        self.q_network.load_state_dict(state["q_network"])
+        self.target_network.load_state_dict(state["target_network"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.epsilon = state["epsilon"]
+        self.state_mean = state["state_mean"]
+        self.state_std = state["state_std"]
+        self.experiences_stored = state["experiences_stored"]
+        self.q_values_history = list(state["q_values_history"])
+        self.losses_history = list(state["losses_history"])
+        self.epsilons_history = list(state["epsilons_history"])
+        self.rewards_history = list(state["rewards_history"])
 
     def save_model(self, path):
         torch.save(self.q_network.state_dict(), path)
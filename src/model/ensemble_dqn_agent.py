@@ -0,0 +1,133 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import torch
+import torch.optim as optim
+import random
+import numpy as np
+from src.model.dqn_agent import DQNAgent
+from src.model.qNetwork import QNetworkEnsemble
+
+class EnsembleDQNAgent(DQNAgent):
+    """Bootstrapped DQN. members Q networks share one replay buffer, and every experience carries a bootstrap
+    mask that decides which members learn from it, so each member is trained on its own resample of the
+    data. All members are evaluated and updated together in batched tensor operations, which makes K
+    members cost little more than one network.
+
+    While training each episode follows one member picked at random (deep exploration), or with
+    exploration="ucb" the action maximizing mean + ucb_coef * std of the members' Q values. Greedy actions
+    are the members' majority vote. The epsilon schedule of DQNAgent still applies on top."""
+    def __init__(self, state_dim, action_dim, members=10, mask_probability=0.5, exploration="bootstrap",
+                 ucb_coef=1.0, **hyperparameters):
+        super(EnsembleDQNAgent, self).__init__(state_dim, action_dim, **hyperparameters)
+        self.members = members
+        self.mask_probability = mask_probability
+        self.exploration = exploration
+        self.ucb_coef = ucb_coef
+        self.q_network = QNetworkEnsemble(state_dim, action_dim, members)
+        self.target_network = QNetworkEnsemble(state_dim, action_dim, members)
+        self.target_network.load_state_dict(self.q_network.state_dict())
+        self.target_network.eval()
+        self.optimizer = optim.Adam(self.q_network.parameters(), lr=self.optimizer.defaults["lr"])
+        self.active_member = random.randrange(members)
+
+    def begin_episode(self):
+        self.active_member = random.randrange(self.members)
+
+    def q_values(self, state):
+        """Q values of every member for one raw state, shape (members, actions)"""
+        state = torch.FloatTensor(self.normalize_state(state)).unsqueeze(0)
+        with torch.no_grad():
+            return self.q_network(state)[:, 0]
+
+    def select_action(self, state, train=True):
+        if train and random.random() < self.epsilon:
+            self.normalize_state(state) #the first state seen still fixes the normalization, like DQNAgent
+            return random.randint(0, self.action_dim - 1)
+        q_values = self.q_values(state)
+        if not train:
+            return self.greedy_action(q_values)
+        if self.exploration == "ucb":
+            return (q_values.mean(dim=0) + self.ucb_coef * q_values.std(dim=0)).argmax().item()
+        return q_values[self.active_member].argmax().item()
+
+    def greedy_action(self, q_values):
+        """Majority vote of the members, ties broken by the mean Q value"""
+        votes = torch.bincount(q_values.argmax(dim=1), minlength=self.action_dim)
+        tied = votes == votes.max()
+        return torch.where(tied, q_values.mean(dim=0), torch.tensor(-float("inf"))).argmax().item()
+
+    def action_uncertainty(self, state):
+        """Standard deviation of the members' Q values of every action"""
+        return self.q_values(state).std(dim=0).numpy()
+
+    def store_experience(self, state, action, reward, next_state, done):
+        state = self.normalize_state(state)
+        next_state = self.normalize_state(next_state)
+        reward = self.scale_reward(reward)
+        mask = (np.random.random(self.members) < self.mask_probability).astype(np.float32)
+        self.replay_buffer.append((state, action, reward, next_state, done, mask))
+        self.experiences_stored += 1
+
+    def sample_experiences(self):
+        batch = random.sample(self.replay_buffer, min(self.batch_size, len(self.replay_buffer)))
+        states, actions, rewards, next_states, dones, masks = zip(*batch)
+        return (torch.FloatTensor(np.array(states)), torch.LongTensor(actions),
+                torch.FloatTensor(rewards), torch.FloatTensor(np.array(next_states)),
+                torch.FloatTensor(dones), torch.from_numpy(np.array(masks).T.copy()))
+
+    def train(self):
+        if len(self.replay_buffer) < self.batch_size:
+            return
+
+        states, actions, rewards, next_states, dones, masks = self.sample_experiences()
+        actions = actions.unsqueeze(0).expand(self.members, -1).unsqueeze(2)
+
+        #Double DQN for every member at once, shapes (members, batch)
+        with torch.no_grad():
+            next_actions = self.q_network(next_states).argmax(dim=2, keepdim=True)
+            next_q_values = self.target_network(next_states).gather(2, next_actions).squeeze(2)
+            target_q_values = rewards + self.gamma * next_q_values * (1 - dones)
+
+        current_q_values = self.q_network(states).gather(2, actions).squeeze(2)
+
+        #Huber loss of every member over the experiences in its bootstrap sample
+        losses = torch.nn.functional.smooth_l1_loss(current_q_values, target_q_values, reduction="none")
+        loss = ((losses * masks).sum(dim=1) / masks.sum(dim=1).clamp(min=1)).sum()
+
+        # tracking
+        self.q_values_history.append(current_q_values.mean().item())
+        self.losses_history.append(loss.item() / self.members)
+        self.epsilons_history.append(self.epsilon)
+
+        self.optimizer.zero_grad()
+        loss.backward()
+
+        #the global norm spans every member, scale the limit so each member gets about grad_clip
+        torch.nn.utils.clip_grad_norm_(self.q_network.parameters(), self.grad_clip * self.members ** 0.5)
+
+        self.optimizer.step()
+        self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
+
+    def save_model(self, path):
+        torch.save({"members": self.members, "state_dict": self.q_network.state_dict()}, path)
+
+    def load_model(self, path):
+        self.q_network.load_state_dict(torch.load(path)["state_dict"])
+        self.q_network.eval()
+
+    def export_member(self, member, path):
+        """Saves one member as a plain QNetwork, loadable by DQNAgent and NetworkPolicy"""
+        torch.save(self.q_network.member_state_dict(member), path)
+
+
+def load_agent(path, state_dim, action_dim):
+    """DQNAgent or EnsembleDQNAgent for a model saved by either, depending on what the file holds"""
+    saved = torch.load(path)
+    if isinstance(saved, dict) and "members" in saved:
+        agent = EnsembleDQNAgent(state_dim, action_dim, members=saved["members"])
+    else:
+        agent = DQNAgent(state_dim, action_dim)
+    agent.load_model(path)
+    return agent
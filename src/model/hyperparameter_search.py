@@ -0,0 +1,221 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import json
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+#Search space of the DQNAgent keyword arguments: (kind, low, high) or ("choice", values)
+SEARCH_SPACE = {
+    "lr": ("log", 1e-5, 1e-2),
+    "gamma": ("uniform", 0.9, 0.999),
+    "epsilon_decay": ("uniform", 0.98, 0.999),
+    "batch_size": ("choice", [32, 64, 128, 256]),
+    "tau": ("log", 1e-4, 1e-1),
+    "reward_scale": ("log", 1e-5, 1e-2),
+}
+
+
+def sample_config(rng, space=SEARCH_SPACE):
+    config = {}
+    for name, spec in space.items():
+        if spec[0] == "choice":
+            config[name] = rng.choice(spec[1])
+        elif spec[0] == "log":
+            config[name] = math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2])))
+        else:
+            config[name] = rng.uniform(spec[1], spec[2])
+    return config
+
+
+def rung_budgets(min_episodes, max_episodes, eta):
+    """Cumulative training episodes at each rung: min_episodes * eta^k up to max_episodes"""
+    budgets = [min_episodes]
+    while budgets[-1] * eta <= max_episodes:
+        budgets.append(budgets[-1] * eta)
+    return budgets
+
+
+def greedy_return(agent, seed, max_steps):
+    """Total training reward of one greedy episode on a seeded model. Actions are chosen at the start of
+    every day, like train_with_toggle, and applied with apply_action like the evaluation tools."""
+    from src.environment.FactoryModel import factory_model
+    from src.evaluation.Episode import apply_action
+    from src.Train import GRID_HEIGHT, GRID_WIDTH, step_reward
+
+    model = factory_model(width=GRID_WIDTH, height=GRID_HEIGHT, N=100, seed=seed)
+    actions = agent.action_space
+    total = 0.0
+    for step in range(max_steps):
+        if step % 24 == 0:
+            apply_action(model, actions[agent.select_action(model.get_state(), train=False)])
+        total += step_reward(model.step())
+        if model.stats.is_done():
+            break
+    return total
+
+
+def run_rung(trial_dir, trial, config, rung, start_episodes, end_episodes, eval_seeds, max_steps, seed):
+    """Worker process entry point. Trains a trial from start_episodes to end_episodes, continuing from its
+    checkpoint after the previous rung, then scores it by the mean greedy return over the evaluation seeds."""
+    import shutil
+    import numpy as np
+    import torch
+    from src.environment.FactoryConfig import build_action_space
+    from src.evaluation.Episode import silenced
+    from src.model.dqn_agent import DQNAgent
+    from src.model.training_checkpoint import TrainingCheckpoint
+    from src.Train import STATE_DIM, train_with_toggle
+
+    torch.set_num_threads(1) #one intra-op thread per worker process, the pool already uses every core
+    start = time.perf_counter()
+    checkpoint_dir = os.path.join(trial_dir, f"rung{rung}")
+    shutil.rmtree(checkpoint_dir, ignore_errors=True) #left by an attempt at this rung that was never logged
+    random.seed(seed + rung)
+    np.random.seed(seed + rung)
+    torch.manual_seed(seed + rung)
+    agent = DQNAgent(STATE_DIM, len(build_action_space()), **config)
+    if start_episodes > 0:
+        #the trial's own training state and replay buffer as saved after the previous rung, RNG states included
+        TrainingCheckpoint(os.path.join(trial_dir, f"rung{rung - 1}")).restore(agent)
+    agent.action_space = build_action_space()
+    rewards_before = len(agent.rewards_history)
+    with silenced():
+        train_with_toggle(agent, end_episodes - start_episodes, max_steps, actions=agent.action_space,
+                          model_path=os.path.join(trial_dir, "q_network.pth"), plot_path=None)
+        TrainingCheckpoint(checkpoint_dir).save(agent, end_episodes)
+        eval_returns = [greedy_return(agent, eval_seed, max_steps) for eval_seed in eval_seeds]
+    return {
+        "trial": trial, "config": config, "rung": rung, "episodes": end_episodes,
+        "eval_return": float(np.mean(eval_returns)), "eval_returns": eval_returns,
+        "train_returns": agent.rewards_history[rewards_before:],
+        "mean_loss": float(np.mean(agent.losses_history[-100:])) if agent.losses_history else None,
+        "epsilon": agent.epsilon, "seconds": time.perf_counter() - start,
+    }
+
+
+class AshaSearch:
+    """Asynchronous successive halving over DQN hyperparameters. Trials start at the lowest rung and a free
+    worker always takes the best job available: promoting a trial that is in the top 1/eta of the results
+    reported at its rung, or starting a new trial when none qualifies. Weak trials therefore stop after the
+    smallest budget while workers never wait for a rung to fill up.
+
+    Every rung result (config, evaluation return and the episode returns of that stretch) is appended to
+    trials.jsonl in the output directory, and each trial's training state and replay buffer are checkpointed
+    after each rung (see training_checkpoint.py), so an interrupted search resumes where it stopped."""
+    def __init__(self, output="hyperparameter_search", num_trials=27, min_episodes=10, max_episodes=270, eta=3,
+                 eval_seeds=(1000, 1001), max_steps=240, workers=None, seed=0):
+        self.output = output
+        self.num_trials = num_trials
+        self.budgets = rung_budgets(min_episodes, max_episodes, eta)
+        self.eta = eta
+        self.eval_seeds = list(eval_seeds)
+        self.max_steps = max_steps
+        self.workers = workers or os.cpu_count()
+        self.seed = seed
+        self.log_path = os.path.join(output, "trials.jsonl")
+        self.configs = {}
+        self.results = [{} for _ in self.budgets] #rung -> {trial: eval_return}
+        self.promoted = [set() for _ in self.budgets]
+        os.makedirs(output, exist_ok=True)
+        self.load()
+
+    def load(self):
+        from src.evaluation.Evaluator import load_records
+        for record in load_records(self.log_path):
+            self.configs[record["trial"]] = record["config"]
+            self.results[record["rung"]][record["trial"]] = record["eval_return"]
+            if record["rung"] > 0:
+                self.promoted[record["rung"] - 1].add(record["trial"])
+
+    def trial_config(self, trial):
+        if trial not in self.configs:
+            self.configs[trial] = sample_config(random.Random(f"{self.seed}-{trial}"))
+        return self.configs[trial]
+
+    def next_job(self, running):
+        """(trial, rung) of the next job, or None when nothing can start until a running job reports"""
+        busy = {trial for trial, _ in running}
+        for rung in reversed(range(len(self.budgets) - 1)):
+            ranked = sorted(self.results[rung], key=lambda t: -self.results[rung][t])
+            for trial in ranked[:len(ranked) // self.eta]:
+                if trial not in self.promoted[rung] and trial not in busy:
+                    self.promoted[rung].add(trial)
+                    return trial, rung + 1
+        #trials that started but never reported their first rung are rerun from scratch
+        started = set(self.results[0]) | busy
+        for trial in range(self.num_trials):
+            if trial not in started:
+                return trial, 0
+        return None
+
+    def submit(self, executor, trial, rung):
+        trial_dir = os.path.join(self.output, f"trial_{trial:04d}")
+        os.makedirs(trial_dir, exist_ok=True)
+        start_episodes = self.budgets[rung - 1] if rung > 0 else 0
+        return executor.submit(run_rung, trial_dir, trial, self.trial_config(trial), rung, start_episodes,
+                               self.budgets[rung], self.eval_seeds, self.max_steps, self.seed + trial)
+
+    def run(self):
+        print(f"ASHA over {self.num_trials} trials, rungs at {self.budgets} episodes, {self.workers} workers")
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor, open(self.log_path, "a") as log:
+            running = {}
+            while True:
+                while len(running) < self.workers:
+                    job = self.next_job(running.values())
+                    if job is None:
+                        break
+                    running[self.submit(executor, *job)] = job
+                if not running:
+                    break
+                ready, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in ready:
+                    running.pop(future)
+                    record = future.result()
+                    self.results[record["rung"]][record["trial"]] = record["eval_return"]
+                    log.write(json.dumps(record) + "\n")
+                    log.flush()
+                    print(f"  trial {record['trial']} rung {record['rung']} ({record['episodes']} episodes): "
+                          f"eval return {record['eval_return']:.1f} ({time.perf_counter() - start:.0f}s)")
+        return self.best()
+
+    def best(self):
+        """Trial with the best evaluation return at the highest rung any trial reached"""
+        for rung in reversed(range(len(self.budgets))):
+            if self.results[rung]:
+                trial = max(self.results[rung], key=self.results[rung].get)
+                return {"trial": trial, "rung": rung, "episodes": self.budgets[rung],
+                        "eval_return": self.results[rung][trial], "config": self.configs[trial],
+                        "model": os.path.join(self.output, f"trial_{trial:04d}", "q_network.pth")}
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel DQN hyperparameter search with successive halving")
+    parser.add_argument("--output", default="hyperparameter_search",
+                        help="directory of the trial log and trial checkpoints, the search resumes from it")
+    parser.add_argument("--trials", type=int, default=27)
+    parser.add_argument("--min-episodes", type=int, default=10, help="training episodes of the first rung")
+    parser.add_argument("--max-episodes", type=int, default=270, help="training episodes of the last rung")
+    parser.add_argument("--eta", type=int, default=3, help="only the top 1/eta of a rung is promoted")
+    parser.add_argument("--eval-episodes", type=int, default=2, help="greedy episodes scored after each rung")
+    parser.add_argument("--max-steps", type=int, default=240)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    search = AshaSearch(args.output, args.trials, args.min_episodes, args.max_episodes, args.eta,
+                        [1000 + i for i in range(args.eval_episodes)], args.max_steps, args.workers, args.seed)
+    best = search.run()
+    if best is not None:
+        print(f"Best trial {best['trial']} after {best['episodes']} episodes: eval return "
+              f"{best['eval_return']:.1f}, config {best['config']}, Q network at {best['model']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import time
+import numpy as np
+import torch
+from src.environment.FactoryConfig import build_action_space
+from src.model.qNetwork import QNetwork
+from src.model.transition_dataset import TransitionDataset
+
+ALGORITHMS = ("cql", "bc")
+
+
+def episode_normalization(dataset):
+    """Mean and std to normalize every transition's states with. DQNAgent normalizes by the scalar mean and
+    std of the first state it sees and NetworkPolicy resets that every episode, so each transition uses the
+    first state of its own episode."""
+    first = dataset.gather([episode["start"] for episode in dataset.episodes])["states"]
+    episode_of = dataset.episode_index()
+    return first.mean(axis=1)[episode_of], (first.std(axis=1) + 1e-8)[episode_of]
+
+
+def train_offline(dataset_path, algorithm="cql", steps=20000, bc_steps=0, batch_size=256, lr=3e-4, gamma=0.99,
+                  alpha=1.0, tau=0.005, reward_scale=1e-4, grad_clip=1.0, seed=0, output="offline_q_network.pth",
+                  log_every=1000):
+    """Trains a QNetwork from a transition dataset without simulating.
+
+    cql is double DQN with the conservative Q-learning penalty of discrete CQL, alpha * (logsumexp Q(s, .) -
+    Q(s, a)), which keeps the Q values of actions the data never took from being overestimated. bc treats Q
+    values as logits of the dataset's actions (behaviour cloning), and bc_steps of it can initialize a cql
+    run. The saved state_dict loads like a DQNAgent export (NetworkPolicy, Run.py, the evaluator)."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm {algorithm!r}, expected one of {ALGORITHMS}")
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    dataset = TransitionDataset(dataset_path)
+    if len(dataset) == 0:
+        raise ValueError(f"No transitions in {dataset_path}")
+    mean, std = episode_normalization(dataset)
+    state_dim = dataset.chunks[0]["states"].shape[1]
+    q_network = QNetwork(state_dim, len(build_action_space()))
+    target_network = QNetwork(state_dim, len(build_action_space()))
+    target_network.load_state_dict(q_network.state_dict())
+    optimizer = torch.optim.Adam(q_network.parameters(), lr=lr)
+    print(f"Offline {algorithm} on {len(dataset)} transitions from {len(dataset.episodes)} episodes")
+
+    total_steps = steps if algorithm == "bc" else bc_steps + steps
+    start = time.perf_counter()
+    logged = {}
+    for step in range(total_steps):
+        indices, batch = dataset.sample(batch_size, rng)
+        scale_mean, scale_std = mean[indices, None], std[indices, None]
+        states = torch.from_numpy((batch["states"] - scale_mean) / scale_std)
+        actions = torch.from_numpy(batch["actions"].astype(np.int64))
+        q_values = q_network(states)
+
+        if algorithm == "bc" or step < bc_steps:
+            loss = torch.nn.functional.cross_entropy(q_values, actions)
+            logged = {"bc_loss": loss.item(), "accuracy": (q_values.argmax(1) == actions).float().mean().item()}
+        else:
+            next_states = torch.from_numpy((batch["next_states"] - scale_mean) / scale_std)
+            rewards = torch.from_numpy(batch["rewards"] * reward_scale)
+            dones = torch.from_numpy(batch["dones"].astype(np.float32))
+            with torch.no_grad():
+                next_actions = q_network(next_states).argmax(1, keepdim=True)
+                next_q_values = target_network(next_states).gather(1, next_actions).squeeze(1)
+                target_q_values = rewards + gamma * next_q_values * (1 - dones)
+            current_q_values = q_values.gather(1, actions.unsqueeze(1)).squeeze(1)
+            td_loss = torch.nn.functional.smooth_l1_loss(current_q_values, target_q_values)
+            conservative_gap = (torch.logsumexp(q_values, dim=1) - current_q_values).mean()
+            loss = td_loss + alpha * conservative_gap
+            logged = {"td_loss": td_loss.item(), "cql_gap": conservative_gap.item()}
+
+        optimizer.zero_grad()
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(q_network.parameters(), grad_clip)
+        optimizer.step()
+        with torch.no_grad():
+            for target_param, param in zip(target_network.parameters(), q_network.parameters()):
+                target_param.mul_(1 - tau).add_(tau * param)
+
+        if (step + 1) % log_every == 0 or step + 1 == total_steps:
+            line = ", ".join(f"{name}={value:.4f}" for name, value in logged.items())
+            print(f"  step {step + 1}/{total_steps}: {line} ({(step + 1) / (time.perf_counter() - start):.0f} steps/s)")
+
+    tmp = f"{output}.tmp"
+    torch.save(q_network.state_dict(), tmp)
+    os.replace(tmp, output)
+    print(f"Saved {output}")
+    return q_network
+
+
+def evaluate(model_path, episodes=4, num_days=10):
+    """Mean outcomes of the trained network's greedy policy on fresh simulations"""
+    from src.evaluation.Episode import NetworkPolicy, run_episode, summarize_episode
+    runs = [summarize_episode(run_episode(NetworkPolicy(model_path), seed=1000 + i, num_days=num_days))
+            for i in range(episodes)]
+    return {outcome: float(np.mean([run[outcome] for run in runs])) for outcome in runs[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train a Q network from recorded transitions (CQL or behaviour cloning)")
+    parser.add_argument("dataset", help="dataset directory written by train --dataset or the dataset collect command")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="cql")
+    parser.add_argument("--steps", type=int, default=20000, help="gradient steps")
+    parser.add_argument("--bc-steps", type=int, default=0, help="behaviour cloning steps before cql")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--lr", type=float, default=3e-4)
+    parser.add_argument("--gamma", type=float, default=0.99)
+    parser.add_argument("--alpha", type=float, default=1.0, help="weight of the conservative penalty")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="offline_q_network.pth")
+    parser.add_argument("--eval-episodes", type=int, default=0, help="simulate the trained policy afterwards")
+    args = parser.parse_args(argv)
+
+    train_offline(args.dataset, args.algorithm, args.steps, args.bc_steps, args.batch_size, args.lr, args.gamma,
+                  args.alpha, seed=args.seed, output=args.output)
+    if args.eval_episodes:
+        print(f"Greedy policy over {args.eval_episodes} episodes: {evaluate(args.output, args.eval_episodes)}")
+
+
+if __name__ == "__main__":
+    main()
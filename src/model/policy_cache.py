@@ -0,0 +1,152 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class CachedPolicy:
+    """Memoizes a trained agent's greedy actions and Q values by observation. get_state() is a handful of
+    worker counts, the productivity and two flags, so an observation comes back whenever an episode is
+    rerun with the same seed, or the deterministic compartmental engine with the same floor. Distinct
+    episodes rarely share observations, and there the cache only adds its lookup.
+
+    Observations are quantized to `resolution` (only the productivity is not already an integer) and the key
+    also holds the agent's state normalization, which NetworkPolicy resets every episode. Entries live in a
+    bounded LRU. The cache is cleared whenever the network's weights change, detected from the parameter
+    tensors' version counters, so reloading weights or training in place never serves stale actions.
+    Exploration (select_action with train=True) is passed straight to the agent."""
+    def __init__(self, agent, max_entries=100000, resolution=1e-3):
+        self.agent = agent
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.entries = OrderedDict()
+        self.weights_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def current_weights_version(self):
+        network = self.agent.q_network
+        return (id(network),) + tuple(parameter._version for parameter in network.parameters())
+
+    def invalidate(self):
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+
+    def key(self, state):
+        self.agent.normalize_state(state) #the first state seen sets the normalization, like an uncached agent
+        quantized = np.rint(np.asarray(state, dtype=np.float64) / self.resolution).astype(np.int64)
+        return quantized.tobytes(), float(self.agent.state_mean), float(self.agent.state_std)
+
+    def lookup(self, state):
+        """(greedy action, Q values) of a state, from the cache or the network"""
+        version = self.current_weights_version()
+        if version != self.weights_version:
+            self.invalidate()
+            self.weights_version = version
+        key = self.key(state)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        q_values = self.agent.q_values(state)
+        entry = (self.agent.greedy_action(q_values), q_values.numpy())
+        self.entries[key] = entry
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def select_action(self, state, train=False):
+        if train:
+            return self.agent.select_action(state, train=True)
+        return self.lookup(state)[0]
+
+    def q_values(self, state):
+        return self.lookup(state)[1]
+
+    def load_model(self, path):
+        self.agent.load_model(path)
+        self.invalidate()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries), "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+def benchmark(model_path, episodes=20, num_days=10, engine="compartmental", params=None):
+    """Evaluates a saved network with and without the cache over the same episodes and reports the time spent
+    in inference, the hit rate and whether every action matched. Both policies load the network and run a
+    forward pass before the timed episodes. The compartmental engine is deterministic, so its episodes
+    differ by workforce size instead of by seed."""
+    from src.cli import build_engine
+    from src.environment.FactoryConfig import FactoryConfig
+    from src.evaluation.Episode import DEFAULT_CONFIG, NetworkPolicy, build_model, run_episode
+
+    class TimedPolicy:
+        def __init__(self, policy):
+            self.policy = policy
+            self.actions = []
+            self.seconds = 0.0
+
+        def reset(self):
+            self.policy.reset()
+
+        def __call__(self, state):
+            start = time.perf_counter()
+            action = self.policy(state)
+            self.seconds += time.perf_counter() - start
+            self.actions.append(action)
+            return action
+
+    def build(episode):
+        if engine == "compartmental":
+            config = FactoryConfig(**{**DEFAULT_CONFIG, "num_agents": DEFAULT_CONFIG["num_agents"] + 10 * episode})
+            return build_engine("compartmental", config, params=params)
+        return build_model(seed=episode)
+
+    results = {}
+    for cached in (False, True):
+        network = NetworkPolicy(model_path, cache=cached)
+        network(build(0).get_state()) #imports torch and loads the network outside the timed runs
+        if cached:
+            network.cache = CachedPolicy(network.agent)
+        policy = TimedPolicy(network)
+        start = time.perf_counter()
+        for episode in range(episodes):
+            model = build(episode)
+            run_episode(policy, num_days=num_days, model=model)
+        results[cached] = {"seconds": time.perf_counter() - start, "inference_seconds": policy.seconds,
+                           "actions": policy.actions, "stats": policy.policy.cache.stats() if cached else None}
+    matched = sum(a == b for a, b in zip(results[False]["actions"], results[True]["actions"]))
+    return results, matched / len(results[False]["actions"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the policy inference cache on a saved network")
+    parser.add_argument("--model", default="dqn_factory_model.pth")
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--engine", choices=("compartmental", "python"), default="compartmental")
+    parser.add_argument("--params", default=None, help="fitted parameters of the compartmental engine (SurrogateFit)")
+    args = parser.parse_args(argv)
+
+    results, agreement = benchmark(args.model, args.episodes, args.days, args.engine, args.params)
+    for cached, result in results.items():
+        share = result["inference_seconds"] / result["seconds"]
+        print(f"{'cached' if cached else 'uncached'}: {result['seconds']:.3f}s, inference "
+              f"{result['inference_seconds']:.3f}s ({share:.0%})")
+    print(f"cache: {results[True]['stats']}, actions identical to the uncached policy: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,4 +12,44 @@ class QNetwork(nn.Module):
     def forward(self, x):
         x = torch.relu(self.fc1(x))
         x = torch.relu(self.fc2(x))
-        return self.fc3(x)
\ No newline at end of file
+        return self.fc3(x)
+
+class BatchedLinear(nn.Module):
+    """members independent linear layers applied as one batched matrix product. Weights are stored as
+    (members, in, out) and initialized like nn.Linear."""
+    def __init__(self, members, input_dim, output_dim):
+        super(BatchedLinear, self).__init__()
+        bound = 1.0 / input_dim ** 0.5
+        self.weight = nn.Parameter(torch.empty(members, input_dim, output_dim).uniform_(-bound, bound))
+        self.bias = nn.Parameter(torch.empty(members, 1, output_dim).uniform_(-bound, bound))
+
+    def forward(self, x):
+        return torch.baddbmm(self.bias, x, self.weight)
+
+
+class QNetworkEnsemble(nn.Module):
+    """members QNetworks with independent weights, evaluated together. Takes a batch of states shared by
+    every member, (batch, input_dim), or one batch per member, (members, batch, input_dim), and returns
+    Q values of shape (members, batch, output_dim)."""
+    def __init__(self, input_dim, output_dim, members):
+        super(QNetworkEnsemble, self).__init__()
+        self.members = members
+        self.fc1 = BatchedLinear(members, input_dim, 128)
+        self.fc2 = BatchedLinear(members, 128, 64)
+        self.fc3 = BatchedLinear(members, 64, output_dim)
+
+    def forward(self, x):
+        if x.dim() == 2:
+            x = x.unsqueeze(0).expand(self.members, -1, -1)
+        x = torch.relu(self.fc1(x))
+        x = torch.relu(self.fc2(x))
+        return self.fc3(x)
+
+    def member_state_dict(self, member):
+        """state_dict of one member as a plain QNetwork"""
+        state = {}
+        for name in ("fc1", "fc2", "fc3"):
+            layer = getattr(self, name)
+            state[f"{name}.weight"] = layer.weight[member].detach().t().clone()
+            state[f"{name}.bias"] = layer.bias[member, 0].detach().clone()
+        return state
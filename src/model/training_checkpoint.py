@@ -0,0 +1,101 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import glob
+import random
+import time
+import numpy as np
+import torch
+
+
+class TrainingCheckpoint:
+    """Checkpoints of a training run in one directory, enough to continue it after a crash or preemption.
+
+    state.pt holds the agent's networks, optimizer, epsilon, normalization and metric histories
+    (DQNAgent.training_state), the python, numpy and torch RNG states, the episode to continue from and
+    any extra state of the training loop. It is replaced atomically, so a checkpoint is either the old or the
+    new one, never half written.
+
+    The replay buffer is saved incrementally: each checkpoint appends one segment with only the experiences
+    stored since the previous one, so its cost does not grow with the buffer. state.pt records how many
+    experiences it covers, and segments past that count (written by a checkpoint that crashed before
+    committing state.pt) are ignored and removed. Segments that fell out of the buffer's window are deleted."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "state.pt")
+        self.replay_dir = os.path.join(directory, "replay")
+        self.committed = None #experiences covered by state.pt
+        os.makedirs(self.replay_dir, exist_ok=True)
+
+    def exists(self):
+        return os.path.exists(self.state_path)
+
+    def segments(self):
+        """(first, last) experience indices and path of every replay segment, oldest first"""
+        found = []
+        for path in glob.glob(os.path.join(self.replay_dir, "segment_*.npz")):
+            first, last = os.path.basename(path)[len("segment_"):-len(".npz")].split("_")
+            found.append((int(first), int(last), path))
+        return sorted(found)
+
+    def save_replay(self, agent, saved):
+        """Appends the experiences stored since `saved` as one segment"""
+        total = agent.experiences_stored
+        new = min(total - saved, len(agent.replay_buffer))
+        if new <= 0:
+            return
+        size = len(agent.replay_buffer)
+        experiences = [agent.replay_buffer[i] for i in range(size - new, size)] #deque indexing is cheap at the ends
+        fields = {f"f{i}": np.asarray([experience[i] for experience in experiences])
+                  for i in range(len(experiences[0]))}
+        path = os.path.join(self.replay_dir, f"segment_{total - new:012d}_{total:012d}.npz")
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(f, **fields)
+        os.replace(f"{path}.tmp", path)
+
+    def save(self, agent, episode, extra=None):
+        """Checkpoints the agent after `episode` finished episodes"""
+        start = time.perf_counter()
+        if self.committed is None:
+            self.committed = self.load_state()["agent"]["experiences_stored"] if self.exists() else 0
+        for first, _, path in self.segments():
+            if first >= self.committed:
+                os.remove(path) #left by a checkpoint that never committed
+        self.save_replay(agent, self.committed)
+        state = {
+            "agent": agent.training_state(),
+            "episode": episode,
+            "extra": extra or {},
+            "rng": {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()},
+            "saved": time.time(),
+        }
+        torch.save(state, f"{self.state_path}.tmp")
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+        self.committed = agent.experiences_stored
+        window = agent.experiences_stored - agent.replay_buffer.maxlen
+        for _, last, path in self.segments():
+            if last <= window:
+                os.remove(path)
+        return time.perf_counter() - start
+
+    def load_state(self):
+        return torch.load(self.state_path, weights_only=False) #our own checkpoint, it holds numpy RNG state
+
+    def restore(self, agent):
+        """Restores the agent and the RNG states. Returns the episode to continue from and the extra state."""
+        state = self.load_state()
+        agent.load_training_state(state["agent"])
+        total = self.committed = agent.experiences_stored
+        agent.replay_buffer.clear()
+        for first, last, path in self.segments():
+            if last > total or last <= total - agent.replay_buffer.maxlen:
+                continue
+            with np.load(path) as data:
+                fields = [data[f"f{i}"] for i in range(len(data.files))]
+            for i in range(last - first):
+                agent.replay_buffer.append(tuple(field[i] if field.ndim > 1 else field[i].item() for field in fields))
+        random.setstate(state["rng"]["python"])
+        np.random.set_state(state["rng"]["numpy"])
+        torch.set_rng_state(state["rng"]["torch"])
+        return state["episode"], state["extra"]
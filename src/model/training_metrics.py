@@ -0,0 +1,270 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError: #not available on Windows, peak memory is then not reported
+    resource = None
+
+#Sections of a training step, timed with TrainingMetrics.timed
+SECTIONS = ("simulation", "reconfiguration", "action_selection", "learner")
+PREFIX = "factory_training"
+
+
+def rss_bytes():
+    """Current resident set size, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class TrainingMetrics:
+    """Throughput and time split of the DQN training loop. Rates are reported both over the whole run and over
+    a sliding window of recent seconds, so a stall or slowdown shows up while the run is still going. Replay
+    sampling is timed by wrapping the agent's sample_experiences on the instance."""
+    def __init__(self, dqn_agent=None, window_seconds=60, latency_samples=1000):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.window_seconds = window_seconds
+        self.section_seconds = dict.fromkeys(SECTIONS, 0.0)
+        self.env_steps = 0
+        self.learner_updates = 0
+        self.episodes = 0
+        self.last_episode_reward = None
+        self.last_progress = self.start_time
+        self.recent_env_steps = deque()
+        self.recent_updates = deque()
+        self.sample_latencies = deque(maxlen=latency_samples)
+        self.sample_seconds = 0.0
+        self.samples = 0
+        self.agent = None
+        if dqn_agent is not None:
+            self.watch_agent(dqn_agent)
+
+    def watch_agent(self, dqn_agent):
+        self.agent = dqn_agent
+        sample_experiences = dqn_agent.sample_experiences
+
+        def timed_sample():
+            start = time.perf_counter()
+            batch = sample_experiences()
+            self.record_sample(time.perf_counter() - start)
+            return batch
+        dqn_agent.sample_experiences = timed_sample
+
+    def unwatch_agent(self):
+        """Restores the agent's own sample_experiences, so it can be pickled or trained again"""
+        if self.agent is not None:
+            self.agent.__dict__.pop("sample_experiences", None)
+            self.agent = None
+
+    @contextmanager
+    def timed(self, section):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.section_seconds[section] += elapsed
+
+    def record_sample(self, seconds):
+        with self.lock:
+            self.sample_latencies.append(seconds)
+            self.sample_seconds += seconds
+            self.samples += 1
+
+    def env_step(self, count=1):
+        now = time.time()
+        with self.lock:
+            self.env_steps += count
+            self.recent_env_steps.append((now, count))
+            self.last_progress = now
+
+    def learner_update(self, count=1):
+        now = time.time()
+        with self.lock:
+            self.learner_updates += count
+            self.recent_updates.append((now, count))
+            self.last_progress = now
+
+    def end_episode(self, total_reward):
+        with self.lock:
+            self.episodes += 1
+            self.last_episode_reward = total_reward
+
+    def window_rate(self, events, now):
+        while events and events[0][0] < now - self.window_seconds:
+            events.popleft()
+        span = min(self.window_seconds, now - self.start_time)
+        return sum(count for _, count in events) / span if span > 0 else 0.0
+
+    def snapshot(self):
+        """Point-in-time copy of every metric as a plain dict"""
+        now = time.time()
+        with self.lock:
+            elapsed = max(now - self.start_time, 1e-9)
+            latencies = sorted(self.sample_latencies)
+            timed_total = sum(self.section_seconds.values()) or 1.0
+            snapshot = {
+                "uptime_seconds": elapsed,
+                "episodes": self.episodes,
+                "env_steps": self.env_steps,
+                "learner_updates": self.learner_updates,
+                "env_steps_per_second": self.env_steps / elapsed,
+                "learner_updates_per_second": self.learner_updates / elapsed,
+                "recent_env_steps_per_second": self.window_rate(self.recent_env_steps, now),
+                "recent_learner_updates_per_second": self.window_rate(self.recent_updates, now),
+                "seconds_since_progress": now - self.last_progress,
+                "section_seconds": dict(self.section_seconds),
+                "section_share": {k: v / timed_total for k, v in self.section_seconds.items()},
+                "replay_samples": self.samples,
+                "replay_sample_seconds": self.sample_seconds,
+                "replay_sample_quantiles": {
+                    q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+                    for q in (0.5, 0.95, 0.99)
+                },
+                "last_episode_reward": self.last_episode_reward,
+                "rss_bytes": rss_bytes(),
+                "peak_rss_bytes": peak_rss_bytes(),
+            }
+        if self.agent is not None:
+            snapshot["epsilon"] = self.agent.epsilon
+            snapshot["replay_buffer_size"] = len(self.agent.replay_buffer)
+            snapshot["last_loss"] = self.agent.losses_history[-1] if self.agent.losses_history else None
+        return snapshot
+
+    def prometheus_text(self):
+        """Snapshot in the Prometheus text exposition format"""
+        s = self.snapshot()
+        lines = []
+
+        def metric(name, kind, value, help_text, labels=None):
+            if value is None:
+                return
+            if help_text:
+                lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+            lines.append(f"{PREFIX}_{name}{label_text} {float(value):.9g}")
+
+        metric("uptime_seconds", "gauge", s["uptime_seconds"], "Seconds since training started")
+        metric("episodes_total", "counter", s["episodes"], "Finished episodes")
+        metric("env_steps_total", "counter", s["env_steps"], "Simulation steps taken")
+        metric("learner_updates_total", "counter", s["learner_updates"], "Gradient updates of the Q network")
+        metric("env_steps_per_second", "gauge", s["recent_env_steps_per_second"],
+               "Simulation steps per second over the recent window")
+        metric("learner_updates_per_second", "gauge", s["recent_learner_updates_per_second"],
+               "Gradient updates per second over the recent window")
+        metric("seconds_since_progress", "gauge", s["seconds_since_progress"],
+               "Seconds since the last simulation step or update, high values mean a stall")
+        for i, (section, seconds) in enumerate(s["section_seconds"].items()):
+            metric("section_seconds_total", "counter", seconds,
+                   "Wall time spent per section of the training loop" if i == 0 else None, {"section": section})
+        for i, (q, seconds) in enumerate(s["replay_sample_quantiles"].items()):
+            metric("replay_sample_seconds", "summary", seconds,
+                   "Latency of sampling a replay batch" if i == 0 else None, {"quantile": q})
+        lines.append(f"{PREFIX}_replay_sample_seconds_sum {s['replay_sample_seconds']:.9g}")
+        lines.append(f"{PREFIX}_replay_sample_seconds_count {s['replay_samples']}")
+        metric("last_episode_reward", "gauge", s["last_episode_reward"], "Total reward of the last episode")
+        metric("epsilon", "gauge", s.get("epsilon"), "Exploration rate")
+        metric("last_loss", "gauge", s.get("last_loss"), "Loss of the last update")
+        metric("replay_buffer_size", "gauge", s.get("replay_buffer_size"), "Experiences in the replay buffer")
+        metric("rss_bytes", "gauge", s["rss_bytes"], "Resident memory")
+        metric("peak_rss_bytes", "gauge", s["peak_rss_bytes"], "Peak resident memory")
+        return "\n".join(lines) + "\n"
+
+    def summary_line(self):
+        s = self.snapshot()
+        share = ", ".join(f"{k} {v:.0%}" for k, v in s["section_share"].items())
+        return (f"  Throughput: {s['recent_env_steps_per_second']:.1f} env steps/s, "
+                f"{s['recent_learner_updates_per_second']:.2f} updates/s, "
+                f"replay p95 {1000 * s['replay_sample_quantiles'][0.95]:.2f} ms ({share})")
+
+
+class MetricsExporter:
+    """Publishes TrainingMetrics while training runs: an HTTP endpoint on localhost serving /metrics
+    (Prometheus text) and /metrics.json, and/or a text file rewritten every interval seconds for the node
+    exporter textfile collector. Both run on daemon threads."""
+    def __init__(self, metrics, port=None, textfile=None, interval=15.0, host="127.0.0.1"):
+        self.metrics = metrics
+        self.textfile = textfile
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server = None
+        self.threads = []
+
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), self.handler())
+            self.server.daemon_threads = True
+            self.start(self.server.serve_forever)
+            print(f"Training metrics at http://{host}:{self.server.server_address[1]}/metrics")
+        if textfile is not None:
+            self.start(self.refresh_textfile)
+
+    def start(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.prometheus_text().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass #keep scrapes out of the training log
+
+        return Handler
+
+    def write_textfile(self):
+        tmp_path = f"{self.textfile}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.metrics.prometheus_text())
+        os.replace(tmp_path, self.textfile)
+
+    def refresh_textfile(self):
+        while not self.stopped.is_set():
+            self.write_textfile()
+            self.stopped.wait(self.interval)
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.textfile is not None:
+            self.write_textfile()
@@ -0,0 +1,227 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import argparse
+import glob
+import json
+import time
+import uuid
+import numpy as np
+
+#Arrays of every chunk, stored as .npy files and memory mapped when read
+FIELDS = {"states": np.float32, "actions": np.int16, "rewards": np.float32, "next_states": np.float32,
+          "dones": np.uint8}
+
+
+class TransitionWriter:
+    """Appends transitions to a dataset directory. Transitions are buffered in memory and written as a chunk
+    of .npy arrays once chunk_size is reached at an episode boundary, so an episode never spans two chunks.
+    A chunk's manifest (its length and the metadata of its episodes) is written last and atomically, and
+    readers only see chunks with a manifest, so any number of runs can append to the same dataset at once
+    and a crash loses at most the chunk being filled.
+
+    States are stored raw and rewards unscaled, so each consumer normalizes them its own way."""
+    def __init__(self, path, chunk_size=50000, metadata=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.metadata = metadata or {}
+        self.writer_id = uuid.uuid4().hex[:12]
+        self.chunks_written = 0
+        self.buffers = {name: [] for name in FIELDS}
+        self.episodes = []
+        self.episode_start = 0
+        self.episode_return = 0.0
+        os.makedirs(os.path.join(path, "chunks"), exist_ok=True)
+
+    def __len__(self):
+        return len(self.buffers["actions"])
+
+    def add(self, state, action, reward, next_state, done):
+        self.buffers["states"].append(state)
+        self.buffers["actions"].append(action)
+        self.buffers["rewards"].append(reward)
+        self.buffers["next_states"].append(next_state)
+        self.buffers["dones"].append(done)
+        self.episode_return += reward
+
+    def end_episode(self, **metadata):
+        if len(self) == self.episode_start:
+            return
+        self.episodes.append({"start": self.episode_start, "length": len(self) - self.episode_start,
+                              "return": self.episode_return, **self.metadata, **metadata})
+        self.episode_start = len(self)
+        self.episode_return = 0.0
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the finished episodes as one chunk. Transitions of an unfinished episode are dropped."""
+        count = self.episode_start
+        if count == 0:
+            return
+        name = f"{self.writer_id}_{self.chunks_written:05d}"
+        chunk_dir = os.path.join(self.path, "chunks", name)
+        os.makedirs(chunk_dir, exist_ok=True)
+        for field, dtype in FIELDS.items():
+            np.save(os.path.join(chunk_dir, f"{field}.npy"), np.asarray(self.buffers[field][:count], dtype=dtype))
+        manifest = {"chunk": name, "count": count, "created": time.time(), "episodes": self.episodes}
+        tmp = os.path.join(self.path, "chunks", f"{name}.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, "chunks", f"{name}.json"))
+        self.chunks_written += 1
+        self.buffers = {field: [] for field in FIELDS}
+        self.episodes = []
+        self.episode_start = 0
+
+    def close(self):
+        self.flush()
+
+
+class DecisionRecorder:
+    """Turns the per-step loop of a simulation into one transition per decision: the state an action was
+    chosen in, the action, the reward summed until the next decision, the state of the next decision and
+    whether the episode ended there."""
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = None
+        self.reward = 0.0
+
+    def decide(self, state, action):
+        if self.pending is not None:
+            self.writer.add(self.pending[0], self.pending[1], self.reward, state, False)
+        self.pending = (np.asarray(state, dtype=np.float32), int(action))
+        self.reward = 0.0
+
+    def add_reward(self, reward):
+        self.reward += float(reward)
+
+    def end_episode(self, final_state, done, **metadata):
+        if self.pending is not None:
+            self.writer.add(self.pending[0], self.pending[1], self.reward, final_state, done)
+        self.pending = None
+        self.reward = 0.0
+        self.writer.end_episode(**metadata)
+
+
+class TransitionDataset:
+    """Read side of a dataset directory. Arrays are memory mapped, so opening a dataset is cheap and
+    sampling only reads the pages of the sampled transitions."""
+    def __init__(self, path):
+        self.path = path
+        self.chunks = []
+        self.episodes = []
+        manifests = sorted(glob.glob(os.path.join(path, "chunks", "*.json")))
+        offset = 0
+        for manifest_path in manifests:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            chunk_dir = os.path.join(path, "chunks", manifest["chunk"])
+            arrays = {field: np.load(os.path.join(chunk_dir, f"{field}.npy"), mmap_mode="r") for field in FIELDS}
+            self.chunks.append(arrays)
+            for episode in manifest["episodes"]:
+                self.episodes.append({**episode, "start": offset + episode["start"]})
+            offset += manifest["count"]
+        self.offsets = np.cumsum([0] + [len(chunk["actions"]) for chunk in self.chunks])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, indices):
+        """Transitions at global indices as a dict of arrays, in the order given"""
+        indices = np.asarray(indices)
+        chunk_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        out = {field: np.empty((len(indices),) + self.chunks[0][field].shape[1:], dtype=dtype)
+               for field, dtype in FIELDS.items()}
+        for chunk_id in np.unique(chunk_ids):
+            where = np.flatnonzero(chunk_ids == chunk_id)
+            local = indices[where] - self.offsets[chunk_id]
+            for field in FIELDS:
+                out[field][where] = self.chunks[chunk_id][field][local]
+        return out
+
+    def sample(self, batch_size, rng):
+        indices = rng.integers(0, len(self), batch_size)
+        return indices, self.gather(indices)
+
+    def episode_index(self):
+        """Index of the episode of every transition"""
+        index = np.empty(len(self), dtype=np.int64)
+        for i, episode in enumerate(self.episodes):
+            index[episode["start"]:episode["start"] + episode["length"]] = i
+        return index
+
+    def summary(self):
+        returns = [episode["return"] for episode in self.episodes]
+        sources = {}
+        for episode in self.episodes:
+            sources[episode.get("source", "unknown")] = sources.get(episode.get("source", "unknown"), 0) + 1
+        return {"transitions": len(self), "episodes": len(self.episodes), "chunks": len(self.chunks),
+                "mean_return": float(np.mean(returns)) if returns else None, "sources": sources,
+                "bytes": sum(array.nbytes for chunk in self.chunks for array in chunk.values())}
+
+
+def collect(path, episodes=10, policy=None, epsilon=1.0, max_steps=240, seed=0, chunk_size=50000):
+    """Simulates episodes with a behaviour policy and appends them to a dataset: epsilon greedy over a saved
+    Q network, or uniformly random actions without one. Actions are chosen and applied once a day like
+    train_with_toggle, and rewarded with its step_reward."""
+    import random
+    from src.environment.FactoryConfig import build_action_space
+    from src.environment.FactoryModel import factory_model
+    from src.evaluation.Episode import apply_action, silenced
+    from src.Train import GRID_HEIGHT, GRID_WIDTH, STATE_DIM, step_reward
+
+    actions = build_action_space()
+    agent = None
+    if policy:
+        from src.model.ensemble_dqn_agent import load_agent
+        agent = load_agent(policy, STATE_DIM, len(actions))
+    rng = random.Random(seed)
+    writer = TransitionWriter(path, chunk_size, {"source": policy or "random", "epsilon": epsilon})
+    recorder = DecisionRecorder(writer)
+    with silenced():
+        for episode in range(episodes):
+            model = factory_model(width=GRID_WIDTH, height=GRID_HEIGHT, N=100, seed=seed + episode)
+            if agent is not None:
+                agent.state_mean = agent.state_std = None #normalize against this episode, like NetworkPolicy
+            state, done = model.get_state(), False
+            for step in range(max_steps):
+                if step % 24 == 0:
+                    if agent is not None and rng.random() >= epsilon:
+                        action = agent.select_action(state, train=False)
+                    else:
+                        action = rng.randrange(len(actions))
+                    recorder.decide(state, action)
+                    apply_action(model, actions[action])
+                recorder.add_reward(step_reward(model.step()))
+                state, done = model.get_state(), model.stats.is_done()
+                if done:
+                    break
+            recorder.end_episode(state, done, seed=seed + episode)
+    writer.close()
+    return writer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transition datasets for offline training")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="summarize a dataset")
+    info.add_argument("dataset")
+    col = commands.add_parser("collect", help="simulate episodes with a behaviour policy into a dataset")
+    col.add_argument("dataset")
+    col.add_argument("--episodes", type=int, default=10)
+    col.add_argument("--policy", default=None, help="saved Q network to act with, random actions without one")
+    col.add_argument("--epsilon", type=float, default=1.0, help="share of random actions")
+    col.add_argument("--steps", type=int, default=240)
+    col.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "collect":
+        collect(args.dataset, args.episodes, args.policy, args.epsilon if args.policy else 1.0, args.steps,
+                args.seed)
+    print(json.dumps(TransitionDataset(args.dataset).summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
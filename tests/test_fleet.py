@@ -0,0 +1,38 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from src.environment.FactoryConfig import build_action_space
+from src.environment.Recording import model_config
+from src.evaluation.Episode import SchedulePolicy, build_model, iter_episode, silenced
+from src.evaluation.Fleet import SiteController
+
+LOCKDOWN = build_action_space()[-1]
+
+
+def configs_under_override(policy, overrides):
+    configs = []
+    with silenced():
+        model = build_model({"num_agents": 40}, seed=0)
+        controller = SiteController(model, policy)
+        days = iter_episode(controller, num_days=len(overrides), model=model)
+        for action in overrides:
+            controller.action = action
+            next(days)
+            configs.append(model_config(model))
+    return configs
+
+
+def test_override_is_undone_for_a_site_without_policy():
+    configs = configs_under_override(None, [None, LOCKDOWN, LOCKDOWN, None])
+    for key in ("cleaning_type", "splitting_level", "testing_level", "social_distancing"):
+        assert configs[1][key] == LOCKDOWN[key]
+        assert configs[3][key] == configs[0][key]
+
+
+def test_own_actions_issued_during_the_override_apply_on_release():
+    schedule = SchedulePolicy([None, None, {"testing_level": "medium"}, None])
+    configs = configs_under_override(schedule, [None, LOCKDOWN, LOCKDOWN, None])
+    assert configs[2]["testing_level"] == LOCKDOWN["testing_level"]
+    assert configs[3]["testing_level"] == "medium"
+    assert configs[3]["cleaning_type"] == configs[0]["cleaning_type"]
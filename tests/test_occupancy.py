@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import numpy as np
+import pytest
+from src.environment.FactoryConfig import FactoryConfig
+from src.environment.VectorizedModel import vectorized_model
+from src.evaluation.Episode import silenced
+
+STEPS = 144
+
+
+def crowded_model(backend):
+    #heavy testing keeps releasing quarantined workers onto stacked cells
+    config = FactoryConfig(width=50, height=25, num_agents=1000, testing_level="heavy")
+    with silenced():
+        return vectorized_model(config.width, config.height, config.num_agents, config=config, seed=0,
+                                backend=backend)
+
+
+def recount(model):
+    occupancy = np.zeros_like(model.occupancy)
+    on_grid = ~model.quarantined
+    np.add.at(occupancy, (model.x[on_grid], model.y[on_grid]), 1)
+    return occupancy
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_occupancy_matches_recount(backend):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    model = crowded_model(backend)
+    with silenced():
+        for step in range(STEPS):
+            model.step()
+            assert np.array_equal(model.occupancy, recount(model)), f"step {step}"
+
+
+def test_numpy_matches_numba():
+    pytest.importorskip("numba")
+    models = [crowded_model("numpy"), crowded_model("numba")]
+    with silenced():
+        for step in range(STEPS):
+            for model in models:
+                model.step()
+            numpy_model, numba_model = models
+            assert np.array_equal(numpy_model.x, numba_model.x), f"step {step}"
+            assert np.array_equal(numpy_model.y, numba_model.y), f"step {step}"
+            assert np.array_equal(numpy_model.occupancy, numba_model.occupancy), f"step {step}"
@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import random
+import pytest
+from src.evaluation.Pareto import (ParetoSearch, crowding_distance, dominates, nondominated_sort, random_genome,
+                                   select_survivors)
+
+#Minimized objectives: 0, 1 and 2 trade off, 3 and 4 are only beaten by the first front, 5 is beaten by 4
+OBJECTIVES = [(1, 5), (2, 3), (4, 1), (2, 6), (3, 4), (5, 5)]
+
+
+def test_dominates():
+    assert dominates((1, 3), (2, 3))
+    assert not dominates((2, 3), (1, 3))
+    assert not dominates((1, 5), (2, 3))
+    assert not dominates((2, 3), (2, 3))
+
+
+def test_nondominated_sort_finds_known_fronts():
+    fronts = nondominated_sort(OBJECTIVES)
+    assert [sorted(front) for front in fronts] == [[0, 1, 2], [3, 4], [5]]
+
+
+def test_crowding_distance_is_infinite_at_the_front_ends():
+    distance = crowding_distance(OBJECTIVES, [0, 1, 2])
+    assert distance[0] == distance[2] == float("inf")
+    #(4 - 1) / (4 - 1) along the first objective plus (5 - 1) / (5 - 1) along the second
+    assert distance[1] == pytest.approx(2.0)
+
+
+def test_select_survivors_fills_whole_fronts_then_cuts_by_crowding():
+    genomes = ["a", "b", "c", "d", "e", "f"]
+    assert sorted(select_survivors(genomes, OBJECTIVES, 5)) == ["a", "b", "c", "d", "e"]
+    assert sorted(select_survivors(genomes, OBJECTIVES, 2)) == ["a", "c"]
+
+
+def test_load_rejects_a_checkpoint_with_other_segments(tmp_path):
+    checkpoint = str(tmp_path / "pareto.json")
+    search = ParetoSearch(population=2, segments=3, checkpoint=checkpoint)
+    rng = random.Random(0)
+    search.population = [random_genome(3, rng) for _ in range(2)]
+    search.scores = {genome: {"productivity": 10.0 + i, "infections": 5.0 - i, "deaths": 0.0}
+                     for i, genome in enumerate(search.population)}
+    search.save()
+
+    assert ParetoSearch(population=2, segments=3, checkpoint=checkpoint).load()
+    with pytest.raises(ValueError):
+        ParetoSearch(population=2, segments=2, checkpoint=checkpoint).load()
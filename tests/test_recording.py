@@ -0,0 +1,29 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import numpy as np
+from src.environment.Recording import RunReplay, agent_state
+from src.evaluation.Episode import build_model, silenced
+
+STEPS = 50 #past a shift change, so the recording has jumps as well as moves
+KEYFRAME_EVERY = 7
+
+
+def test_replay_matches_the_live_run_at_every_frame(tmp_path):
+    path = str(tmp_path / "run")
+    with silenced():
+        model = build_model({"num_agents": 40, "shifts_per_day": 2}, seed=0)
+        recorder = model.enable_recording(path, keyframe_every=KEYFRAME_EVERY)
+        live = [agent_state(recorder.agents)]
+        for _ in range(STEPS):
+            model.step()
+            live.append(agent_state(recorder.agents))
+        model.disable_recording()
+
+    replay = RunReplay(path)
+    assert replay.num_frames == STEPS + 1
+    for frame, expected in enumerate(live):
+        np.testing.assert_array_equal(replay.state(frame), expected, err_msg=f"frame {frame}")
+    for frame, state in replay.frames(3):
+        np.testing.assert_array_equal(state, live[frame], err_msg=f"frame {frame}")
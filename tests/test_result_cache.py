@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import itertools
+import numpy as np
+import pytest
+from src.evaluation import ResultCache as result_cache
+from src.evaluation.Episode import DAILY_METRICS
+from src.evaluation.ResultCache import ResultCache, scenario_key
+
+CONFIG = {"num_agents": 30, "width": 20, "height": 10}
+
+
+def daily(value, num_days=10):
+    return {name: np.full(num_days, value + i, dtype=np.float64) for i, name in enumerate(DAILY_METRICS)}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = itertools.count(1)
+    monkeypatch.setattr(result_cache.time, "time", lambda: float(next(ticks)))
+
+
+def blob_size(tmp_path):
+    probe = ResultCache(str(tmp_path / "probe"))
+    probe.put("00probe", daily(0))
+    size = probe.stats()["size_bytes"]
+    probe.close()
+    return size
+
+
+def test_scenario_key_ignores_config_order():
+    reordered = dict(reversed(list(CONFIG.items())))
+    schedule = [{"testing_level": "heavy", "cleaning_type": "medium"}]
+    schedule_reordered = [{"cleaning_type": "medium", "testing_level": "heavy"}]
+    assert scenario_key(CONFIG, schedule, 1, 5) == scenario_key(reordered, schedule_reordered, 1, 5)
+    assert scenario_key(CONFIG, schedule, 1, 5) != scenario_key(CONFIG, schedule, 2, 5)
+    #explicit defaults hash like omitted ones
+    assert scenario_key({**CONFIG, "steps_per_day": 24}, None, 1, 5) == scenario_key(CONFIG, None, 1, 5)
+
+
+def test_get_after_put_returns_identical_arrays(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    stored = daily(3.5)
+    cache.put("ab" * 32, stored)
+    loaded = cache.get("ab" * 32)
+    for name in DAILY_METRICS:
+        assert np.array_equal(loaded[name], stored[name])
+    assert cache.get("cd" * 32) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_least_recently_used_entry_is_evicted_first(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2 * blob_size(tmp_path))
+    cache.put("aa" * 32, daily(1))
+    cache.put("bb" * 32, daily(2))
+    assert cache.get("aa" * 32) is not None #aa is now more recently used than bb
+    cache.put("cc" * 32, daily(3))
+    assert cache.get("bb" * 32) is None
+    assert cache.get("aa" * 32) is not None and cache.get("cc" * 32) is not None
+    assert not os.path.exists(cache.blob_path("bb" * 32))
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1 and stats["lifetime_evictions"] == 1
+    cache.close()
+
+
+def test_unseeded_runs_bypass_the_cache(tmp_path, monkeypatch):
+    runs = []
+    def run_episode(policy, config=None, seed=None, num_days=10):
+        runs.append(seed)
+        return daily(len(runs), num_days)
+    monkeypatch.setattr(result_cache, "run_episode", run_episode)
+
+    cache = ResultCache(str(tmp_path))
+    first = cache.get_or_run(CONFIG, None, None, 2)
+    second = cache.get_or_run(CONFIG, None, None, 2)
+    assert runs == [None, None] #every unseeded query simulates
+    assert cache.stats()["entries"] == 0 and cache.hits == 0
+    assert not np.array_equal(first["healthy"], second["healthy"])
+
+    seeded = cache.get_or_run(CONFIG, None, 7, 2)
+    again = cache.get_or_run(CONFIG, None, 7, 2)
+    assert runs == [None, None, 7]
+    assert cache.stats()["entries"] == 1 and cache.hits == 1
+    for name in DAILY_METRICS:
+        assert np.array_equal(seeded[name], again[name])
+    cache.close()
@@ -0,0 +1,40 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import json
+import pytest
+from src.evaluation.Sweep import SweepStore, load_manifest, run_sweep
+
+
+def write_manifest(tmp_path, manifest):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_rerun_skips_finished_runs(tmp_path, capsys):
+    path = write_manifest(tmp_path, {"name": "small", "num_days": 1, "fixed": {"width": 20, "height": 10},
+                                     "parameters": {"num_agents": {"values": [20, 30]}}})
+    db = str(tmp_path / "sweep.sqlite")
+    manifest = load_manifest(path)
+
+    assert run_sweep(manifest, db, workers=1) == (2, 0)
+    assert run_sweep(manifest, db, workers=1) == (0, 0)
+    assert "0 runs to go, 2 already finished" in capsys.readouterr().out
+
+    store = SweepStore(db)
+    assert len(store.finished()) == 2
+    assert sorted(row["num_agents"] for row in store.results("small")) == [20, 30]
+    store.close()
+
+
+def test_integer_range_needs_int_type(tmp_path):
+    path = write_manifest(tmp_path, {"sampling": "random", "samples": 4,
+                                     "parameters": {"testing_frequency": {"range": [1, 5]}}})
+    with pytest.raises(ValueError, match="testing_frequency"):
+        load_manifest(path)
+
+    path = write_manifest(tmp_path, {"sampling": "random", "samples": 4,
+                                     "parameters": {"testing_frequency": {"range": [1, 5], "type": "int"}}})
+    assert load_manifest(path)["parameters"]["testing_frequency"]["type"] == "int"
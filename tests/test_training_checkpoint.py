@@ -0,0 +1,99 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+import copy
+import random
+from collections import deque
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+from src.model.dqn_agent import DQNAgent
+from src.model.training_checkpoint import TrainingCheckpoint
+
+WINDOW = 30
+
+
+def small_agent():
+    agent = DQNAgent(8, 4, batch_size=8)
+    agent.replay_buffer = deque(maxlen=WINDOW)
+    return agent
+
+
+def store(agent, count):
+    for _ in range(count):
+        state = np.random.rand(8)
+        agent.store_experience(state, random.randrange(4), random.random() * 1000, np.random.rand(8),
+                               random.random() < 0.1)
+        agent.train()
+
+
+def assert_same_experiences(left, right):
+    assert len(left) == len(right)
+    for a, b in zip(left, right):
+        for field_a, field_b in zip(a, b):
+            assert np.array_equal(np.asarray(field_a), np.asarray(field_b))
+
+
+def assert_same_optimizer(left, right):
+    assert left["param_groups"] == right["param_groups"]
+    for key, slots in left["state"].items():
+        for name, value in slots.items():
+            assert torch.equal(torch.as_tensor(value), torch.as_tensor(right["state"][key][name]))
+
+
+def test_restore_continues_where_the_checkpoint_left_off(tmp_path):
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    agent = small_agent()
+    checkpoint = TrainingCheckpoint(str(tmp_path))
+
+    store(agent, 20)
+    checkpoint.save(agent, 3)
+    store(agent, 20)
+    checkpoint.save(agent, 5)
+    store(agent, 25) #65 stored, the window holds experiences 35 to 65
+    checkpoint.save(agent, 7, {"counters": [1, 2]})
+    assert [(first, last) for first, last, _ in checkpoint.segments()] == [(20, 40), (40, 65)]
+
+    expected = (random.random(), float(np.random.rand()), float(torch.rand(1)))
+    saved_buffer = list(agent.replay_buffer)
+    saved_epsilon = agent.epsilon
+    saved_weights = copy.deepcopy(agent.q_network.state_dict())
+    saved_optimizer = copy.deepcopy(agent.optimizer.state_dict())
+
+    #a checkpoint that crashed after writing its segment but before committing state.pt
+    store(agent, 5)
+    checkpoint.save_replay(agent, 65)
+    assert checkpoint.segments()[-1][:2] == (65, 70)
+
+    restored = small_agent()
+    episode, extra = TrainingCheckpoint(str(tmp_path)).restore(restored)
+    assert episode == 7 and extra == {"counters": [1, 2]}
+    assert restored.epsilon == saved_epsilon < 1.0
+    assert restored.experiences_stored == 65
+    assert_same_experiences(restored.replay_buffer, saved_buffer)
+    assert (random.random(), float(np.random.rand()), float(torch.rand(1))) == expected
+    assert saved_optimizer["state"] #the agent has trained, so Adam has moments to restore
+    assert_same_optimizer(saved_optimizer, restored.optimizer.state_dict())
+    for name, value in saved_weights.items():
+        assert torch.equal(value, restored.q_network.state_dict()[name])
+
+
+def test_uncommitted_segments_are_removed_by_the_next_save(tmp_path):
+    agent = small_agent()
+    checkpoint = TrainingCheckpoint(str(tmp_path))
+    store(agent, 10)
+    checkpoint.save(agent, 1)
+    store(agent, 5)
+    checkpoint.save_replay(agent, 10) #never committed
+
+    resumed = small_agent()
+    checkpoint = TrainingCheckpoint(str(tmp_path))
+    checkpoint.restore(resumed)
+    assert resumed.experiences_stored == 10 and len(resumed.replay_buffer) == 10
+    store(resumed, 3)
+    checkpoint.save(resumed, 2)
+    assert [(first, last) for first, last, _ in checkpoint.segments()] == [(0, 10), (10, 13)]